@@ -30,7 +30,7 @@ VdcInitFont:
 ;		the font; bits 4-0 are ignored and assumed to
 ;		be zero.
 ; Outputs:
-; Destroys:	A, HL
+; Destroys:	A, BC, DE, HL
 
 	ld	a,(vdcFontBase)
 	and	0E0h
@@ -41,19 +41,25 @@ VdcInitFont:
 	ex	de,hl
 	call	VdcSetUpdatePtr
 
+	ld	a,49		; Glyphs stored as 8x8 tiles, so have the VDC
+	ld	e,2		; store every byte twice to achieve 8x16
+	call	VdcOutByte	; representation in VDC memory.
+
 	ld	hl,fontBase
 .vdcinitfontloop
 	ld	a,(hl)
 	inc	hl
-	call	VdcWriteByte	; Glyphs stored as 8x8 tiles, so write twice
-	call	VdcWriteByte	; to achieve 8x16 representation in VDC memory.
+	call	VdcWriteByte
 	ld	a,h
 	cp	fontEnd / 256
 	jr	nz,vdcinitfontloop
 	ld	a,l
 	cp	fontEnd & 0FFH
 	jr	nz,vdcinitfontloop
-	ret
+
+	ld	a,49		; Back to one store per byte written.
+	ld	e,1
+	jp	VdcOutByte
 
 .fontBase
 	include	"glyphs.inc"
@@ -77,18 +83,18 @@ VdcInitMode:
 	ld	hl,vdcModeSettings	; HL=VDC register values
 	ld	b,(hl)			; B=number of bytes to initialize
 	inc	hl
-	ld	e,0			; E=current register
-.vdcinitloop
-	ld	a,e
-	inc	e
-	out	(c),a
+	ld	a,80H			; Select R0, auto-incrementing after
+	out	(c),a			; every data port write.
 	inc	c
+.vdcinitloop
 	ld	a,(hl)
 	inc	hl
 	out	(c),a
-	dec	c
 	call	VdcWaitReady
 	djnz	vdcinitloop
+	dec	c
+	xor	a			; Back to one register per select.
+	out	(c),a
 	ret
 
 .vdcModeSettings
@@ -168,11 +174,46 @@ VdcWriteByte:
 	jp	VdcOutByte
 
 
+VdcReadByte:
+; Reads the byte at the update pointer, advancing the pointer.
+; Writes to R31 are posted, so right after VdcWriteByte, R31 may
+; still hold the byte at an older address.  R38 bit 7 stays set
+; until R31 has caught up; its low bits count the writes still on
+; their way to VDC memory.
+;
+; Inputs:	(vdcPort) refers to I/O port of VDC-II core.
+; Outputs:	A = Byte read from VDC memory
+; Destroys:	A, BC
+
+	call	VdcWaitReady
+	ld	bc,(vdcPort)
+	ld	a,38
+	out	(c),a
+	inc	c
+.vdcreadwait
+	in	a,(c)
+	and	80H
+	jr	nz,vdcreadwait
+	dec	c
+	ld	a,31
+	out	(c),a
+	inc	c
+	in	a,(c)
+	ret
+
+
 VdcDrawTextSlab:
 ; Draws a solid rectangle filled with the character in (r4).
 ; The upper left-hand corner is specified in (r0,r1).
 ; The lower right-hand corner is in (r2,r3).
 ;
+; The VDC-II can fill a rectangle by itself, too.  Write the number
+; of rows to R40 and the distance between rows to R59:R41.  R59 resets
+; to zero, so R41 alone covers strides up to 255 bytes.  Store the
+; fill byte through R31 first.  That moves the update pointer past
+; the corner, so write the corner to R18:R19 again, then write the
+; row width to R30 to start the fill.
+;
 ; Inputs:
 ; Outputs:
 ; Destroys:	AF, (r1)
@@ -0,0 +1,115 @@
+"""
+Simulation benchmark for the Memory Port Engine (MPE).
+
+This script drives the register set, write queue, MPE, block RAM
+arbiter, and block RAM that test_mpe.MPESystem wires together, and
+measures how long block fill and block copy operations take to
+complete while a simulated video fetch engine competes for video
+memory.
+
+Contention is expressed as the fraction of each 32-clock window during
+which the VFE holds the bus, mimicking the burst behavior of the real
+video fetch engine (one burst per four-column strip).
+
+Usage:
+
+    python bench_mpe.py
+"""
+
+from nmigen.back.pysim import Simulator
+
+from test_mpe import MPESystem, vfe_contention
+
+
+# Length of one simulated strip-fetch window, in clocks.
+WINDOW = 32
+
+# Fraction of each window during which the VFE owns video memory.
+CONTENTION_LEVELS = (0.0, 0.25, 0.375, 0.5, 0.75)
+
+# A 1KB video RAM keeps the simulator fast; the MPE's timing does not
+# depend on how much memory sits behind the arbiter.
+ABUS_WIDTH = 10
+
+
+def write_reg(dut, reg, value):
+    yield dut.regset.adr_i.eq(reg)
+    yield dut.regset.dat_i.eq(value)
+    yield dut.regset.we_i.eq(1)
+    yield
+    yield dut.regset.we_i.eq(0)
+
+
+def wait_idle(dut):
+    clocks = 0
+    while True:
+        yield
+        clocks += 1
+        if (yield dut.mpe.idle):
+            return clocks
+
+
+def wait_drained(dut):
+    while True:
+        yield
+        if (yield dut.mpe.idle) and not (yield dut.mpe.cpudatar_stale):
+            return
+
+
+def measure(contention, copy, length=255, dual_port=False):
+    """
+    Returns the number of clocks needed to fill or copy `length` bytes,
+    measured from the write to R30 until the MPE reports idle again.
+    With dual_port, MPE writes may share cycles with VFE reads.
+    """
+    dut = MPESystem(abus_width=ABUS_WIDTH, dual_port=dual_port)
+    busy_clocks = int(contention * WINDOW)
+    result = {}
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+
+    vfe = vfe_contention(dut, busy_clocks, WINDOW)
+
+    def host():
+        yield from write_reg(dut, 24, 0x80 if copy else 0x00)
+        yield from write_reg(dut, 18, 0x01)
+        yield from write_reg(dut, 19, 0x00)
+        yield from wait_idle(dut)
+        yield from write_reg(dut, 32, 0x02)
+        yield from write_reg(dut, 33, 0x00)
+        yield from write_reg(dut, 31, 0x55)
+        yield from wait_drained(dut)
+        yield dut.regset.adr_i.eq(30)
+        yield dut.regset.dat_i.eq(length)
+        yield dut.regset.we_i.eq(1)
+        yield
+        yield dut.regset.we_i.eq(0)
+        result['clocks'] = 1 + (yield from wait_idle(dut))
+
+    sim.add_sync_process(vfe)
+    sim.add_sync_process(host)
+    sim.run()
+    return result['clocks']
+
+
+def main():
+    length = 255
+    print("MPE block transfer benchmark ({} bytes per operation)".format(length))
+    print()
+    print("{:>10}  {:>14}  {:>14}  {:>14}  {:>14}".format(
+        "VFE load", "fill B/clk", "copy B/clk", "dp fill B/clk", "dp copy B/clk",
+    ))
+    for level in CONTENTION_LEVELS:
+        fill = measure(level, copy=False, length=length)
+        copy = measure(level, copy=True, length=length)
+        dp_fill = measure(level, copy=False, length=length, dual_port=True)
+        dp_copy = measure(level, copy=True, length=length, dual_port=True)
+        print("{:>9.1f}%  {:>14.3f}  {:>14.3f}  {:>14.3f}  {:>14.3f}".format(
+            level * 100, length / fill, length / copy,
+            length / dp_fill, length / dp_copy,
+        ))
+
+
+if __name__ == '__main__':
+    main()
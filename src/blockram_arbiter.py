@@ -1,6 +1,8 @@
 from nmigen import (
+    Cat,
     Elaboratable,
     Module,
+    Mux,
     Signal,
 )
 
@@ -8,8 +10,65 @@ from interfaces import create_blockram_arbiter_interface
 
 
 class BlockRamArbiter(Elaboratable):
-    def __init__(self, platform=None, asize=14):
-        create_blockram_arbiter_interface(self, platform=platform, asize=asize)
+    """
+    Shares video RAM between the video fetch engine (VFE), which always
+    wins, and the memory port engine (MPE).
+
+    Reads go through adr_o, and writes through wadr_o, matching the
+    separate read and write ports of the block RAM.  With dual_port set,
+    an MPE write is granted in the same cycle as a VFE read, since the
+    two use different ports; only MPE reads, which need the read port,
+    wait for the VFE.  This lets the host keep updating video memory
+    during active display.  A VFE read of the byte the MPE writes in the
+    same cycle sees the new byte.  Without dual_port, one master is
+    granted per cycle, and wadr_o always equals adr_o.
+
+    With deadline set, the VFE no longer wins unconditionally.  The
+    shifter tells us how many clocks remain before it swaps strip
+    buffers (vfe_slack_i), and the VFE tells us how many clocks it
+    still needs to finish its current fetch if left alone (vfe_left_i).
+    While the slack exceeds the work left, a cycle the MPE strobes for
+    cannot make the VFE late, so the MPE gets it.  Clocks the MPE spends
+    waiting, with cyc asserted but no strobe, stay with the VFE.  Once
+    slack and work left meet, the VFE has the RAM to itself until it is
+    done.  A slack of zero means no deadline is known, and the VFE
+    always wins, as before.  The formal proofs of this module and of
+    VideoFetch together show the VFE is never late: this one assumes
+    what VideoFetchDeadlineFormal proves of cycles_left.
+    deadline_bits sets the width of vfe_slack_i and vfe_left_i, which
+    must hold the longest strip the shifter and VFE are built for.
+
+    Free-running performance counters record, per clock, whether each
+    master was granted an access (pc_vfe, pc_mpe), whether the MPE was
+    held off an access it wanted (pc_stall), and whether the RAM went
+    unused (pc_idle).
+
+    With wide set, the block RAM holds 16-bit words, and both masters
+    keep addressing bytes.  Byte writes enable the lane selected by the
+    low address bit, with the byte on both lanes.  The MPE reads the
+    addressed byte; the VFE reads the whole word, swapped if needed so
+    the addressed byte is in the low lane.  Reading an even address
+    thus fetches a character code and its attribute in one access.
+
+    The bus is pipelined.  latency, which must match the read latency of
+    the block RAM, sets the number of clocks from an accepted strobe to
+    its acknowledgement.  Each master may have that many accesses in
+    flight, one per clock, and they are acknowledged in the order they
+    were accepted.  Read data goes to both masters at once, and each
+    keeps only what arrives with its own acknowledgement; no ack-driven
+    multiplexer sits between the block RAM and the masters.
+    """
+
+    def __init__(self, platform=None, asize=14, dual_port=False, deadline=False,
+                 wide=False, latency=1, deadline_bits=6):
+        self.dual_port = dual_port
+        self.deadline = deadline
+        self.wide = wide
+        self.latency = latency
+        create_blockram_arbiter_interface(
+            self, platform=platform, asize=asize, wide=wide,
+            deadline_bits=deadline_bits,
+        )
 
     def elaborate(self, platform):
         m = Module()
@@ -18,39 +77,112 @@ class BlockRamArbiter(Elaboratable):
 
         grant_mpe = Signal(1)
         grant_vfe = Signal(1)
+        share = Signal(1)
+        defer_vfe = Signal(1)
+
+        if self.dual_port:
+            comb += share.eq(self.mpe_we_i & ~self.vfe_we_i)
+
+        if self.deadline:
+            comb += defer_vfe.eq(
+                self.mpe_stb_i & ~share & (self.vfe_slack_i > self.vfe_left_i)
+            )
 
         comb += [
-            grant_vfe.eq(self.vfe_cyc_i),
-            grant_mpe.eq(self.mpe_cyc_i & ~grant_vfe),
+            grant_vfe.eq(self.vfe_cyc_i & ~defer_vfe),
+            grant_mpe.eq(self.mpe_cyc_i & (~grant_vfe | share)),
         ]
 
+        # Byte addresses become word addresses and lane enables.
+        def word(adr):
+            return adr[1:] if self.wide else adr
+
+        def lanes(adr, we):
+            return Cat(we & ~adr[0], we & adr[0]) if self.wide else we
+
+        def lanes_dat(dat):
+            return Cat(dat, dat) if self.wide else dat
+
         with m.If(grant_vfe):
             comb += [
-                self.adr_o.eq(self.vfe_adr_i),
-                self.we_o.eq(self.vfe_we_i),
-                self.dat_o.eq(self.vfe_dat_i),
-
-                self.mpe_stall_o.eq(1),
+                self.adr_o.eq(word(self.vfe_adr_i)),
+                self.we_o.eq(lanes(self.vfe_adr_i, self.vfe_we_i)),
+                self.dat_o.eq(lanes_dat(self.vfe_dat_i)),
             ]
         with m.Elif(grant_mpe):
             comb += [
-                self.adr_o.eq(self.mpe_adr_i),
-                self.we_o.eq(self.mpe_we_i),
-                self.dat_o.eq(self.mpe_dat_i),
+                self.adr_o.eq(word(self.mpe_adr_i)),
+                self.we_o.eq(lanes(self.mpe_adr_i, self.mpe_we_i)),
+                self.dat_o.eq(lanes_dat(self.mpe_dat_i)),
+            ]
+        comb += self.wadr_o.eq(self.adr_o)
 
-                self.vfe_stall_o.eq(1),
+        # A shared cycle gives the write port to the MPE.
+        with m.If(grant_vfe & grant_mpe):
+            comb += [
+                self.wadr_o.eq(word(self.mpe_adr_i)),
+                self.we_o.eq(lanes(self.mpe_adr_i, self.mpe_stb_i)),
+                self.dat_o.eq(lanes_dat(self.mpe_dat_i)),
             ]
 
+        comb += [
+            self.mpe_stall_o.eq(~grant_mpe & grant_vfe),
+            self.vfe_stall_o.eq(~grant_vfe & grant_mpe),
+        ]
+
+        vfe_access = Signal(1)
+        mpe_access = Signal(1)
+
+        comb += [
+            vfe_access.eq(grant_vfe & self.vfe_stb_i),
+            mpe_access.eq(grant_mpe & self.mpe_stb_i),
+        ]
+
+        # In-flight tracking.
+        #
+        # Bit i of each shift register is set when that master's access
+        # was accepted i+1 clocks ago.  The oldest bit is its ack.  The
+        # low address bit of each access travels alongside, to steer the
+        # byte lanes of a wide RAM when its data arrives.
+        vfe_inflight = Signal(self.latency)
+        mpe_inflight = Signal(self.latency)
+        vfe_lanes = Signal(self.latency)
+        mpe_lanes = Signal(self.latency)
+
         sync += [
-            self.vfe_ack_o.eq(grant_vfe & self.vfe_stb_i),
-            self.mpe_ack_o.eq(grant_mpe & self.mpe_stb_i),
+            vfe_inflight.eq(Cat(vfe_access, vfe_inflight)),
+            mpe_inflight.eq(Cat(mpe_access, mpe_inflight)),
+            vfe_lanes.eq(Cat(self.vfe_adr_i[0], vfe_lanes)),
+            mpe_lanes.eq(Cat(self.mpe_adr_i[0], mpe_lanes)),
+        ]
+        comb += [
+            self.vfe_ack_o.eq(vfe_inflight[-1]),
+            self.mpe_ack_o.eq(mpe_inflight[-1]),
         ]
 
-        with m.If(self.vfe_ack_o):
-            comb += self.vfe_dat_o.eq(self.dat_i)
-        with m.Elif(self.mpe_ack_o):
-            comb += self.mpe_dat_o.eq(self.dat_i)
+        # Performance counters.
+        with m.If(vfe_access):
+            sync += self.pc_vfe.eq(self.pc_vfe + 1)
+        with m.If(mpe_access):
+            sync += self.pc_mpe.eq(self.pc_mpe + 1)
+        with m.If(self.mpe_stb_i & self.mpe_stall_o):
+            sync += self.pc_stall.eq(self.pc_stall + 1)
+        with m.If(~vfe_access & ~mpe_access):
+            sync += self.pc_idle.eq(self.pc_idle + 1)
 
-        return m
+        # Read data.
+        if self.wide:
+            vfe_lane = vfe_lanes[-1]
+            mpe_lane = mpe_lanes[-1]
 
+            comb += [
+                self.vfe_dat_o.eq(Mux(vfe_lane, Cat(self.dat_i[8:16], self.dat_i[0:8]), self.dat_i)),
+                self.mpe_dat_o.eq(Mux(mpe_lane, self.dat_i[8:16], self.dat_i[0:8])),
+            ]
+        else:
+            comb += [
+                self.vfe_dat_o.eq(self.dat_i),
+                self.mpe_dat_o.eq(self.dat_i),
+            ]
 
+        return m
@@ -12,8 +12,23 @@ from interfaces import VDC_VERSION, create_hostbus_interface
 
 class HostBus(Elaboratable):
     """
-    This module implements a Z80 CPU-compatible bus interface that should
-    work up to about 8MHz, assuming the FPGA is clocked at least at 24MHz.
+    This module implements a Z80 CPU-compatible bus interface.  With the
+    default parameters, it should work up to about 8MHz, assuming the FPGA
+    is clocked at least at 24MHz.  With early_writes set, it keeps up with
+    a 12MHz Z80 at the same FPGA clock.
+
+    Parameters:
+
+    - sync_stages :: Number of flip-flops each host input passes through
+      before use.  Must be at least 1; 2, the default, is the usual
+      minimum for a safe synchronizer.  Fewer stages shorten the time
+      from a host cycle to its effect on the register set, at the cost of
+      a higher chance of metastability.
+    - early_writes :: If set, writes take effect once the start of the
+      host cycle has been synchronized, instead of after it ends.  Writes
+      to the data port also wait for ready_i, so they land once WAIT is
+      released.  Only safe for hosts which drive the data bus before
+      asserting CS, as the Z80 does for I/O writes.
 
     This module is designed to connect to a RegSet8Bit module.
 
@@ -37,6 +52,15 @@ class HostBus(Elaboratable):
       CPU data bus combinatorially.  q is always driven, even if the output
       enable (qoe) is negated.
     - qoe :: Data bus output enable.
+    - wait :: Wait request.  Asserted while the host is accessing the data
+      port and the register set is not ready for it, and while the host
+      reads R31 before it has caught up with posted writes.  A Z80 with
+      its WAIT input wired to this signal can use block I/O instructions
+      such as OTIR and INIR on the data port without polling the status
+      port, even INIR right after OTIR; cycles are stretched only while
+      the VDC-II cannot keep up.  Hosts which do not wire it up simply
+      poll as before.  Derived directly from cs, a and rd, so it responds
+      within the same host cycle.
 
     Register Set signals.  These are designed to interface with a VDC register
     set module.
@@ -44,18 +68,29 @@ class HostBus(Elaboratable):
     Inputs:
     - ready_i :: A flag indicating when the video memory read/write engine
       is ready for another host CPU-activated operation.
+    - stale_i :: Set while the CPU Data register (R31) does not yet hold
+      the byte at the update location, as after writes to R31 which have
+      been posted but not yet stored.
     - vblank_i :: Vertical blank in progress flag.
     - lp_i :: Light pen values are valid flag.
 
     Outputs:
     - dat_o :: 8-bit data path going *to* the register set module.
-    - adr_o :: 6-bit register select address.
+    - adr_o :: 6-bit register select address.  If bit 7 of the byte
+      written to the register select port is set, adr_o advances after
+      every write to the data port, so a table of consecutive registers
+      can be streamed in with a single OTIR.  Writing the register select
+      port with bit 7 clear restores the original behavior.
     - we_o :: A write-enable strobe for writing a value to the register set.
       Lasts for a single clock cycle, and indicates when dat_o is valid.
       Only asserts if the host processor is writing to the data port.
     """
-    def __init__(self, platform=""):
+    def __init__(self, platform="", sync_stages=2, early_writes=False):
         super().__init__()
+        if sync_stages < 1:
+            raise ValueError("sync_stages must be at least 1")
+        self.sync_stages = sync_stages
+        self.early_writes = early_writes
         create_hostbus_interface(self, platform=platform)
 
     def elaborate(self, platform=''):
@@ -66,60 +101,106 @@ class HostBus(Elaboratable):
         # qoe is driven only during valid read transactions.
         comb += self.qoe.eq(self.cs & self.rd)
 
-        # Synchronize the chip inputs to control metastability.
-        a1 = Signal(1)
-        a2 = Signal(1)
-        a3 = Signal(1)
-
-        cs1 = Signal(1)
-        cs2 = Signal(1)
-        cs3 = Signal(1)
-
-        rd1 = Signal(1)
-        rd2 = Signal(1)
-        rd3 = Signal(1)
-
-        d1 = Signal(len(self.d))
-        d2 = Signal(len(self.d))
-        d3 = Signal(len(self.d))
-
-        sync += [
-            a1.eq(self.a),
-            a2.eq(a1),
-            a3.eq(a2),
-
-            cs1.eq(self.cs),
-            cs2.eq(cs1),
-            cs3.eq(cs2),
+        # The status port never waits; it's how software without a WAIT
+        # line finds out whether it would have to.  Reads of R31 also wait
+        # for the CPU Data register to catch up, which ready_i doesn't
+        # cover, since posted writes leave the MPE ready.  By the time a
+        # read can follow a write, the write has reached the MPE, so
+        # stale_i is already set.
+        comb += self.wait.eq(self.cs & self.a & (
+            ~self.ready_i | (self.rd & (self.adr_o == 31) & self.stale_i)
+        ))
+
+        # Synchronize the chip inputs to control metastability.  Each
+        # input passes through sync_stages flip-flops, plus one more so
+        # that cs and rd can be compared against their previous samples
+        # for edge detection.  a and d are taken from the last stage, so
+        # they line up with the strobes derived from them.
+        def synchronize(name, sig):
+            stages = [
+                Signal(len(sig), name="{}{}".format(name, i + 1))
+                for i in range(self.sync_stages + 1)
+            ]
+            m.d.sync += stages[0].eq(sig)
+            for prev, nxt in zip(stages, stages[1:]):
+                m.d.sync += nxt.eq(prev)
+            return stages
 
-            rd1.eq(self.rd),
-            rd2.eq(rd1),
-            rd3.eq(rd2),
+        a_s = synchronize("a", self.a)
+        cs_s = synchronize("cs", self.cs)
+        rd_s = synchronize("rd", self.rd)
+        d_s = synchronize("d", self.d)
 
-            d1.eq(self.d),
-            d2.eq(d1),
-            d3.eq(d2),
-        ]
+        cs_new, cs_old = cs_s[-2], cs_s[-1]
+        rd_new, rd_old = rd_s[-2], rd_s[-1]
+        a_old = a_s[-1]
+        d_old = d_s[-1]
 
         comb += [
-            self.dat_o.eq(d3),
+            self.dat_o.eq(d_old),
         ]
 
         # Derive write enable and read strobe pulses for the I/O ports and
         # register set.
+        #
+        # Reads always complete on the trailing edge of CS, once the host
+        # has taken the data; this is what advances the update location
+        # after a read of R31.
+        #
+        # Writes complete on the trailing edge of CS as well, unless
+        # early_writes is set.  A Z80 drives the data bus before it
+        # asserts IORQ, so its writes can be taken as soon as CS has been
+        # seen on two consecutive samples without RD.  Waiting for the
+        # second sample rides out any skew between CS and RD at the start
+        # of a read.  wdone makes sure each cycle writes only once.
+        #
+        # An early write to the data port also waits for ready_i, as the
+        # host does while WAIT is asserted; otherwise a byte written to R31
+        # with the write queue full would be dropped, while the update
+        # location still advanced.  A host which doesn't honour WAIT has
+        # its write taken on the trailing edge of CS instead, just as
+        # without early_writes.
 
         we_ports = Signal(1)
         rd_ports = Signal(1)
+        wdone = Signal(1)
+
+        if self.early_writes:
+            early = Signal(1)
+
+            comb += [
+                early.eq(
+                    cs_new & cs_old & ~rd_new & ~rd_old &
+                    (self.ready_i | ~a_old)
+                ),
+                we_ports.eq(
+                    (early | (~cs_new & cs_old & ~rd_old)) & ~wdone
+                ),
+            ]
+            with m.If(we_ports):
+                sync += wdone.eq(1)
+            with m.Elif(~cs_old):
+                sync += wdone.eq(0)
+        else:
+            comb += we_ports.eq(~cs_new & cs_old & ~rd_old)
+
         comb += [
-            we_ports.eq(~cs2 & cs3 & ~rd3),
-            rd_ports.eq(~cs2 & cs3 & rd3),
-            self.we_o.eq(we_ports & a3),
-            self.rd_o.eq(rd_ports & a3),
+            rd_ports.eq(~cs_new & cs_old & rd_old),
+            self.we_o.eq(we_ports & a_old),
+            self.rd_o.eq(rd_ports & a_old),
         ]
 
-        # Write to the register select port if addressed.
-        with m.If(we_ports & ~a3):
-            sync += self.adr_o.eq(d3[0:6])
+        # Write to the register select port if addressed.  Bit 7 selects
+        # auto-increment mode; see adr_o above.
+        autoinc = Signal(1)
+
+        with m.If(we_ports & ~a_old):
+            sync += [
+                self.adr_o.eq(d_old[0:6]),
+                autoinc.eq(d_old[7]),
+            ]
+        with m.Elif(self.we_o & autoinc):
+            sync += self.adr_o.eq(self.adr_o + 1)
 
         # Read from the status port or addressed register.
         status = Cat(
@@ -127,19 +208,22 @@ class HostBus(Elaboratable):
             Const(0b11, 2),
             self.vblank_i, self.lp_i, self.ready_i
         )
-        with m.If(~a3):
+        with m.If(~a_old):
             comb += self.q.eq(status)
         with m.Else():
             comb += self.q.eq(self.dat_i)
 
         if platform == 'formal':
             comb += [
-                self.fv_old_cssync.eq(cs2),
-                self.fv_cssync.eq(cs3),
-                self.fv_rdsync.eq(rd3),
+                self.fv_old_cssync.eq(cs_new),
+                self.fv_cssync.eq(cs_old),
+                self.fv_rdsync.eq(rd_old),
+                self.fv_old_rdsync.eq(rd_new),
+                self.fv_wdone.eq(wdone),
+                self.fv_autoinc.eq(autoinc),
                 self.fv_we_ports.eq(we_ports),
                 self.fv_rd_ports.eq(rd_ports),
-                self.fv_async.eq(a3),
-                self.fv_dsync.eq(d3),
+                self.fv_async.eq(a_old),
+                self.fv_dsync.eq(d_old),
             ]
         return m
@@ -13,40 +13,102 @@ REG_WIDTH=8
 # Character tile data can be no wider than 8 pixels.
 MAX_PIXELS_PER_CHAR=8
 
+# Raster operations applied by block fills and copies, selected by
+# R43[1:0].  R43[2] inverts the source byte first, R43[3] makes block
+# operations walk memory downward, and R43[4] makes plain fills store
+# the attribute plane as well.
+ROP_SRC=0
+ROP_AND=1
+ROP_OR=2
+ROP_XOR=3
+
+# Size of one MPE command list descriptor in video memory, in bytes.
+DESC_SIZE=10
+
+# Interrupt sources, as bits of the interrupt enable (R50) and status
+# (R51) registers.
+INT_MPE=0x01
+INT_VSYNC=0x02
+INT_RASTER=0x04
+
+# Performance counters, as selected by R54.  Counters are PC_WIDTH bits
+# wide and free-running; software measures a period by subtracting two
+# readings.
+PC_WIDTH=24
+PC_VFE_GRANTS=0
+PC_MPE_GRANTS=1
+PC_MPE_STALLS=2
+PC_IDLE=3
+PC_MPE_OPS=4
+
+# The row cache holds the character/attribute pairs of one text row, so
+# later rasters of the row need not fetch them again.  It covers the
+# 256 columns R1 can describe.
+ROW_CACHE_BITS=8
+
+# A strip is the group of character columns the video fetch engine
+# fetches in one burst, and the strip buffer double-buffers for the
+# shifter.  Wider strips take more registers, but fewer, longer bursts.
+STRIP_WIDTHS=(4, 8, 16)
+
+
+def strip_bits(strip_width):
+    # The number of bits addressing a column within a strip.
+    if strip_width not in STRIP_WIDTHS:
+        raise ValueError("strip_width must be one of {}".format(STRIP_WIDTHS))
+    return int(log2(strip_width))
+
+
+def create_strip_buffer_interface(self, platform=None, wide=False, strip_width=4):
+    col_bits = strip_bits(strip_width)
 
-def create_strip_buffer_interface(self, platform=None):
     # Video Fetch Engine Interface
     ## Inputs
-    self.padr = Signal(2)
+    self.padr = Signal(col_bits)
     self.cwe = Signal(1)
     self.awe = Signal(1)
-    self.wadr = Signal(2)
-    self.dat_i = Signal(8)
+    self.pwe = Signal(1)
+    self.wadr = Signal(col_bits)
+    self.dat_i = Signal(16 if wide else 8)
+    self.cadr = Signal(ROW_CACHE_BITS)
+    self.record = Signal(1)
+    self.recall = Signal(1)
+    self.lwe = Signal(1)
 
     ## Outputs
     self.pair = Signal(16)
 
+    # Line Buffer Interface
+    ## Inputs
+    self.lhalf = Signal(1)
+    self.shalf = Signal(1)
+    self.copy = Signal(1)
+    self.copy_rst = Signal(1)
+
+    ## Outputs
+    self.copy_done = Signal(1)
+
     # Shifter Interface
     ## Inputs
-    self.sh_padr = Signal(2)
+    self.sh_padr = Signal(col_bits)
     self.swap = Signal(1)
 
     ## Outputs
     self.sh_pair = Signal(16)
 
     if platform == 'formal':
-        self.fv_col0a = Signal(16)
-        self.fv_col1a = Signal(16)
-        self.fv_col2a = Signal(16)
-        self.fv_col3a = Signal(16)
-        self.fv_col0b = Signal(16)
-        self.fv_col1b = Signal(16)
-        self.fv_col2b = Signal(16)
-        self.fv_col3b = Signal(16)
+        self.fv_cols_a = [
+            Signal(16, name="fv_col{}a".format(i)) for i in range(strip_width)
+        ]
+        self.fv_cols_b = [
+            Signal(16, name="fv_col{}b".format(i)) for i in range(strip_width)
+        ]
         self.fv_ab = Signal(1)
 
 
-def create_video_fetch_interface(self, platform=None):
+def create_video_fetch_interface(self, platform=None, latency=1, strip_width=4):
+    col_bits = strip_bits(strip_width)
+
     # Video Timing Interface
     ## Inputs
     self.atrptr = Signal(16)
@@ -54,9 +116,11 @@ def create_video_fetch_interface(self, platform=None):
     self.go_i = Signal(1)
     self.ldptr = Signal(1)
     self.ra = Signal(5)
+    self.first_raster = Signal(1)
 
     ## Outputs
     self.done_o = Signal(1)
+    self.started_o = Signal(1)
 
     # Register Set Interface
     ## Inputs
@@ -84,43 +148,49 @@ def create_video_fetch_interface(self, platform=None):
     ## Outputs
     self.awe = Signal(1)
     self.cwe = Signal(1)
-    self.padr = Signal(2)
-    self.wadr = Signal(2)
+    self.pwe = Signal(1)
+    self.padr = Signal(col_bits)
+    self.wadr = Signal(col_bits)
+    self.cadr = Signal(ROW_CACHE_BITS)
+    self.record = Signal(1)
+    self.recall = Signal(1)
+    self.lwe = Signal(1)
+
+    # Arbiter Interface
+    ## Outputs
+    self.cycles_left = Signal(range(3 * strip_width + 1 + 2 * latency))
 
     if platform == 'formal':
-        self.fv_ag_a1 = Signal(1)
-        self.fv_ag_a2 = Signal(1)
-        self.fv_ag_a3 = Signal(1)
-        self.fv_ag_a4 = Signal(1)
-        self.fv_ag_c1 = Signal(1)
-        self.fv_ag_c2 = Signal(1)
-        self.fv_ag_c3 = Signal(1)
-        self.fv_ag_c4 = Signal(1)
-        self.fv_ag_f1 = Signal(1)
-        self.fv_ag_f2 = Signal(1)
-        self.fv_ag_f3 = Signal(1)
-        self.fv_ag_f4 = Signal(1)
+        # One flag per state of each FSM, the states of a phase numbered
+        # from 1, one per column of the strip.
+        def states(prefix):
+            return [
+                Signal(1, name="{}{}".format(prefix, i + 1))
+                for i in range(strip_width)
+            ]
+
+        self.fv_ag_a = states("fv_ag_a")
+        self.fv_ag_c = states("fv_ag_c")
+        self.fv_ag_f = states("fv_ag_f")
         self.fv_ag_go_font = Signal(1)
         self.fv_ag_idle = Signal(1)
         self.fv_atrptr = Signal(len(self.adr_o))
         self.fv_chrptr = Signal(len(self.adr_o))
         self.fv_dr_idle = Signal(1)
-        self.fv_dr_a1 = Signal(1)
-        self.fv_dr_a2 = Signal(1)
-        self.fv_dr_a3 = Signal(1)
-        self.fv_dr_a4 = Signal(1)
-        self.fv_dr_c1 = Signal(1)
-        self.fv_dr_c2 = Signal(1)
-        self.fv_dr_c3 = Signal(1)
-        self.fv_dr_c4 = Signal(1)
-        self.fv_dr_f1 = Signal(1)
-        self.fv_dr_f2 = Signal(1)
-        self.fv_dr_f3 = Signal(1)
-        self.fv_dr_f4 = Signal(1)
+        self.fv_dr_idle_state = Signal(1)
+        self.fv_dr_a = states("fv_dr_a")
+        self.fv_dr_c = states("fv_dr_c")
+        self.fv_dr_f = states("fv_dr_f")
+        self.fv_dr_bitmap_mode = Signal(1)
+        self.fv_queued = Signal(1)
+        self.fv_queued_attr = Signal(1)
+        self.fv_queued_bitmap_mode = Signal(1)
         self.fv_bitmap_mode = Signal(1)
 
 
-def create_shifter_interface(self, platform=None):
+def create_shifter_interface(self, platform=None, strip_width=4):
+    col_bits = strip_bits(strip_width)
+
     # CRTC Interface
     ## Inputs
     self.hclken = Signal(1)
@@ -128,6 +198,7 @@ def create_shifter_interface(self, platform=None):
     self.hs = Signal(1)
     self.vs = Signal(1)
     self.vden = Signal(1)
+    self.vden_next = Signal(1)
 
     # Register Set Interface
     ## Inputs
@@ -144,6 +215,7 @@ def create_shifter_interface(self, platform=None):
     self.chrbase = Signal(16)
     self.vscroll = Signal(5)
     self.bitmap_mode = Signal(1)
+    self.hd = Signal(8)
 
     # Video Interface
     ## Outputs
@@ -154,6 +226,15 @@ def create_shifter_interface(self, platform=None):
     self.chrptr = Signal(16)
     self.ra = Signal(5)
     self.go_ldptr = Signal(1)
+    self.first_raster = Signal(1)
+    self.go_fetch = Signal(1)
+    self.fetch_ldptr = Signal(1)
+    self.fetch_started = Signal(1)
+
+    # Line Buffer Interface
+    ## Outputs
+    self.lhalf = Signal(1)
+    self.shalf = Signal(1)
 
     # Strip Buffer Interface
     ## Inputs
@@ -167,7 +248,11 @@ def create_shifter_interface(self, platform=None):
     ## Outputs
     self.go_prefetch = Signal(1)
     self.swap_strip = Signal(1)
-    self.padr = Signal(2)
+    self.padr = Signal(col_bits)
+
+    # Arbiter Interface
+    ## Outputs
+    self.swap_ctr = Signal(col_bits + 4)
 
     if platform == 'formal':
         self.fv_reveal_ctr = Signal(4)
@@ -180,17 +265,22 @@ def create_shifter_interface(self, platform=None):
         self.fv_sbsm_prefetch = Signal(1)
         self.fv_sbsm_wait_den = Signal(1)
         self.fv_lpic = Signal(1)
-        self.fv_sbsm_column0 = Signal(1)
-        self.fv_sbsm_column1 = Signal(1)
-        self.fv_sbsm_column2 = Signal(1)
-        self.fv_sbsm_column3 = Signal(1)
+        self.fv_sbsm_columns = [
+            Signal(1, name="fv_sbsm_column{}".format(i))
+            for i in range(strip_width)
+        ]
         self.fv_pixctr = Signal(3)
         self.fv_lastrow = Signal(1)
         self.fv_bump_atrptr = Signal(1)
         self.fv_bump_chrptr = Signal(1)
 
 
-def create_blockram_arbiter_interface(self, platform=None, asize=14):
+def create_blockram_arbiter_interface(self, platform=None, asize=14, wide=False,
+                                      deadline_bits=6):
+    # With wide, the block RAM holds 16-bit words.  Masters still present
+    # byte addresses; the VFE receives the whole word.
+    lanes = 2 if wide else 1
+
     # VFE Memory Interface
     ## Inputs
     self.vfe_adr_i = Signal(asize)
@@ -198,10 +288,12 @@ def create_blockram_arbiter_interface(self, platform=None, asize=14):
     self.vfe_dat_i = Signal(8)
     self.vfe_stb_i = Signal(1)
     self.vfe_we_i = Signal(1)
+    self.vfe_left_i = Signal(deadline_bits)
+    self.vfe_slack_i = Signal(deadline_bits)
 
     ## Outputs
     self.vfe_ack_o = Signal(1)
-    self.vfe_dat_o = Signal(8)
+    self.vfe_dat_o = Signal(8 * lanes)
     self.vfe_stall_o = Signal(1)
 
     # MPE Memory Interface
@@ -219,36 +311,78 @@ def create_blockram_arbiter_interface(self, platform=None, asize=14):
 
     # Block RAM Interface
     ## Inputs
-    self.dat_i = Signal(8)
+    self.dat_i = Signal(8 * lanes)
 
     ## Outputs
-    self.adr_o = Signal(asize)
-    self.dat_o = Signal(8)
-    self.we_o = Signal(1)
+    self.adr_o = Signal(asize - (lanes - 1))
+    self.wadr_o = Signal(len(self.adr_o))
+    self.dat_o = Signal(8 * lanes)
+    self.we_o = Signal(lanes)
+
+    # Performance Counters
+    ## Outputs
+    self.pc_vfe = Signal(PC_WIDTH)
+    self.pc_mpe = Signal(PC_WIDTH)
+    self.pc_stall = Signal(PC_WIDTH)
+    self.pc_idle = Signal(PC_WIDTH)
 
     if platform == 'formal':
         pass
 
 
-def create_mpe_interface(self, platform='', abus_width=14):
+def create_mpe_interface(self, platform='', abus_width=14, readahead=4):
     # Register-File Interface
     ## Outputs
     self.ready = Signal(1)
+    self.idle = Signal(1)
     self.cpudatar = Signal(8)
     self.incr_updloc = Signal(1)
     self.incr_copysrc = Signal(1)
+    self.decr_updloc = Signal(1)
+    self.decr_copysrc = Signal(1)
     self.decr_bytecnt = Signal(1)
+    self.next_row = Signal(1)
+    self.ld_desc = Signal(1)
+    self.desc_dst = Signal(16)
+    self.desc_src = Signal(16)
+    self.desc_len = Signal(16)
+    self.list_done = Signal(1)
 
     ## Inputs
     self.go_wr_updloc = Signal(1)
     self.go_rd_cpudatar = Signal(1)
-    self.go_wr_cpudataw = Signal(1)
     self.go_wr_bytecnt = Signal(1)
+    self.go_wr_listptr = Signal(1)
     self.update_location = Signal(16)
     self.cpudataw = Signal(8)
     self.block_copy = Signal(1)
     self.copysrc = Signal(16)
-    self.bytecnt = Signal(8)
+    self.bytecnt = Signal(16)
+    self.rows = Signal(8)
+    self.rop = Signal(3)
+    self.wrmask = Signal(8)
+    self.descending = Signal(1)
+    self.stride = Signal(8)
+    self.dualplane = Signal(1)
+    self.attrfill = Signal(8)
+    self.chrbase = Signal(16)
+    self.atrbase = Signal(16)
+    self.listptr = Signal(16)
+
+    # Write Queue Interface
+    ## Outputs
+    self.wq_pop = Signal(1)
+    self.cpudatar_stale = Signal(1)
+
+    ## Inputs
+    self.wq_adr = Signal(abus_width)
+    self.wq_dat = Signal(8)
+    self.wq_stride = Signal(8)
+    self.wq_repeat = Signal(4)
+    self.wq_dual = Signal(1)
+    self.wq_attr = Signal(8)
+    self.wq_empty = Signal(1)
+    self.wq_full = Signal(1)
 
     # Memory Interface
     ## Outputs
@@ -263,7 +397,26 @@ def create_mpe_interface(self, platform='', abus_width=14):
     self.mem_ack_i = Signal(1)
     self.mem_dat_i = Signal(8)
 
+    # Performance Counters
+    ## Outputs
+    self.pc_ops = Signal(PC_WIDTH)
+
     if platform == 'formal':
+        self.fv_idle = Signal(1)
+        self.fv_pend_prefetch = Signal(1)
+        self.fv_pend_block = Signal(1)
+        self.fv_stale = Signal(1)
+        self.fv_refreshing = Signal(1)
+        self.fv_ra_adr = Signal(abus_width)
+        self.fv_ra_stride = Signal(8)
+        self.fv_plane = Signal(1)
+        self.fv_store_off = Signal(16)
+        self.fv_store_last = Signal(1)
+        self.fv_ra_count = Signal(range(readahead + 1))
+        self.fv_ra_head = Signal(8)
+        self.fv_ra_hit = Signal(1)
+        self.fv_readahead_0 = Signal(1)
+        self.fv_readahead_1 = Signal(1)
         self.fv_prefetch_0 = Signal(1)
         self.fv_prefetch_1 = Signal(1)
         self.fv_store_0 = Signal(1)
@@ -272,6 +425,48 @@ def create_mpe_interface(self, platform='', abus_width=14):
         self.fv_block_1 = Signal(1)
         self.fv_block_2 = Signal(1)
         self.fv_block_3 = Signal(1)
+        self.fv_block_4 = Signal(1)
+        self.fv_block_5 = Signal(1)
+        self.fv_list_0 = Signal(1)
+        self.fv_list_1 = Signal(1)
+        self.fv_list_2 = Signal(1)
+        self.fv_listing = Signal(1)
+        self.fv_pend_list = Signal(1)
+
+
+def create_write_queue_interface(self, platform=None, depth=4, abus_width=14):
+    # Register Set Interface
+    ## Inputs
+    self.push = Signal(1)
+    self.adr_i = Signal(16)
+    self.dat_i = Signal(8)
+    self.stride_i = Signal(8)
+    self.repeat_i = Signal(4)
+    self.dual_i = Signal(1)
+    self.attr_i = Signal(8)
+
+    ## Outputs
+    self.level = Signal(range(depth + 1))
+    self.posted = Signal(range(depth + 1))
+
+    # MPE Interface
+    ## Inputs
+    self.pop = Signal(1)
+
+    ## Outputs
+    self.adr_o = Signal(abus_width)
+    self.dat_o = Signal(8)
+    self.stride_o = Signal(8)
+    self.repeat_o = Signal(4)
+    self.dual_o = Signal(1)
+    self.attr_o = Signal(8)
+    self.empty = Signal(1)
+    self.full = Signal(1)
+
+    if platform == 'formal':
+        self.fv_pending = Signal(1)
+        self.fv_rdptr = Signal(range(depth))
+        self.fv_wrptr = Signal(range(depth))
 
 
 def create_vdc2_interface(self, platform=""):
@@ -279,11 +474,14 @@ def create_vdc2_interface(self, platform=""):
     ## Inputs
     self.adr_i = Signal(6)
     self.we_i = Signal(1)
+    self.rd_i = Signal(1)
     self.dat_i = Signal(8)
 
     ## Outputs
     self.dat_o = Signal(8)
     self.ready_o = Signal(1)
+    self.stale_o = Signal(1)
+    self.irq_o = Signal(1)
 
     # Video Interface
     ## Outputs
@@ -329,6 +527,7 @@ def create_syncgen_interface(
     self.xs = Signal(1)
     self.xden = Signal(1)
     self.rastclken = Signal(1)
+    self.xden_next = Signal(1)
 
     # FV outputs
     if platform == 'formal':
@@ -391,22 +590,59 @@ def create_regset8bit_interface(self, platform=''):
     self.tallfont = Signal(1)
     self.fontbase = Signal(3)
 
+    # Interrupts
+    ## Inputs
+    self.int_mpe = Signal(1)
+    self.int_vsync = Signal(1)
+    self.rasterline = Signal(10)
+
+    ## Outputs
+    self.irq = Signal(1)
+
+    # Performance Counters
+    ## Inputs
+    self.pc_vfe = Signal(PC_WIDTH)
+    self.pc_mpe = Signal(PC_WIDTH)
+    self.pc_stall = Signal(PC_WIDTH)
+    self.pc_idle = Signal(PC_WIDTH)
+    self.pc_ops = Signal(PC_WIDTH)
+
     # Memory Port Engine/DMA Engine Interface
     ## Inputs
     self.cpudatar = Signal(8)
     self.incr_updloc = Signal(1)
     self.incr_copysrc = Signal(1)
+    self.decr_updloc = Signal(1)
+    self.decr_copysrc = Signal(1)
     self.decr_bytecnt = Signal(1)
+    self.next_row = Signal(1)
+    self.ld_desc = Signal(1)
+    self.desc_dst = Signal(16)
+    self.desc_src = Signal(16)
+    self.desc_len = Signal(16)
+    self.list_done = Signal(1)
+    self.cpudatar_stale = Signal(1)
+    self.wq_level = Signal(4)
 
     ## Outputs
     self.update_location = Signal(16)
     self.copysrc = Signal(16)
     self.cpudataw = Signal(8)
-    self.bytecnt = Signal(8)
+    self.bytecnt = Signal(16)
+    self.rows = Signal(8)
+    self.rop = Signal(3)
+    self.wrmask = Signal(8, reset=0xFF)
+    self.descending = Signal(1)
+    self.stride = Signal(8, reset=1)
+    self.dualplane = Signal(1)
+    self.attrfill = Signal(8)
+    self.wrrepeat = Signal(4)
+    self.listptr = Signal(16)
     self.go_wr_updloc = Signal(1)
     self.go_rd_cpudatar = Signal(1)
     self.go_wr_cpudataw = Signal(1)
     self.go_wr_bytecnt = Signal(1)
+    self.go_wr_listptr = Signal(1)
 
 
 def create_hostbus_interface(self, platform=""):
@@ -417,8 +653,10 @@ def create_hostbus_interface(self, platform=""):
 
     self.q = Signal(len(self.d))
     self.qoe = Signal(1)
+    self.wait = Signal(1)
 
     self.ready_i = Signal(1)
+    self.stale_i = Signal(1)
     self.vblank_i = Signal(1)
     self.lp_i = Signal(1)
     self.dat_i = Signal(len(self.d))
@@ -431,6 +669,9 @@ def create_hostbus_interface(self, platform=""):
         self.fv_old_cssync = Signal(1)
         self.fv_cssync = Signal(1)
         self.fv_rdsync = Signal(1)
+        self.fv_old_rdsync = Signal(1)
+        self.fv_wdone = Signal(1)
+        self.fv_autoinc = Signal(1)
         self.fv_we_ports = Signal(1)
         self.fv_rd_ports = Signal(1)
         self.fv_async = Signal(1)
@@ -1,21 +1,52 @@
 from nmigen.test.utils import FHDLTestCase
 from nmigen import (
+    Array,
+    Cat,
     Elaboratable,
     Module,
+    Mux,
     Signal,
 )
 
 
-from interfaces import create_mpe_interface
+from interfaces import (
+    DESC_SIZE,
+    ROP_AND,
+    ROP_OR,
+    ROP_SRC,
+    ROP_XOR,
+    create_mpe_interface,
+)
 
 
 class MPE(Elaboratable):
-    def __init__(self, platform='', abus_width=14):
+    """
+    The Memory Port Engine gives the host CPU access to video memory
+    through the register set, and performs block fill and block copy
+    operations on its behalf.
+
+    Parameters:
+
+    - abus_width.  Width of the video memory address bus.
+    - burst.  Maximum number of source bytes a block copy reads ahead of
+      the bytes it writes.  Larger bursts amortize the turnaround between
+      reading and writing, at the cost of an 8-bit register per byte.
+    - readahead.  Number of bytes beyond the update location the MPE
+      fetches ahead of sequential host reads through R31.  Must be at
+      least 1.
+    """
+
+    def __init__(self, platform='', abus_width=14, burst=4, readahead=4):
         super().__init__()
-        create_mpe_interface(self, platform=platform, abus_width=abus_width)
+        self.burst = burst
+        self.readahead = readahead
+        create_mpe_interface(
+            self, platform=platform, abus_width=abus_width, readahead=readahead
+        )
 
     def elaborate(self, platform):
         m = Module()
+        abus_width = len(self.mem_adr_o)
         sync = m.d.sync
         comb = m.d.comb
 
@@ -24,22 +55,451 @@ class MPE(Elaboratable):
             self.mem_stb_o.eq(0),
             self.mem_adr_o.eq(0),
             self.mem_we_o.eq(0),
-            self.incr_updloc.eq(0),
-            self.incr_copysrc.eq(0),
             self.decr_bytecnt.eq(0),
+            self.next_row.eq(0),
+            self.ld_desc.eq(0),
+            self.wq_pop.eq(0),
+        ]
+
+        # Outstanding access tracking.
+        #
+        # Wishbone acknowledges accesses in the order they were issued.
+        # inflight counts accesses issued but not yet acknowledged, and
+        # inflight_we remembers which of them were writes, oldest first in
+        # bit 0.  An acknowledgement for a read carries copy data.
+        max_inflight = 2 * self.burst
+
+        issue = Signal(1)
+        inflight = Signal(range(max_inflight + 1))
+        inflight_we = Signal(max_inflight)
+        room = Signal(1)
+        retire = Signal(1)
+        rd_ack = Signal(1)
+
+        comb += [
+            room.eq(inflight != max_inflight),
+            retire.eq(self.mem_ack_i & (inflight != 0)),
+            rd_ack.eq(retire & ~inflight_we[0]),
+        ]
+
+        remaining = Signal(range(max_inflight + 1))
+        remaining_we = Signal(max_inflight)
+
+        with m.If(retire):
+            comb += [
+                remaining.eq(inflight - 1),
+                remaining_we.eq(inflight_we >> 1),
+            ]
+        with m.Else():
+            comb += [
+                remaining.eq(inflight),
+                remaining_we.eq(inflight_we),
+            ]
+
+        sync += [
+            inflight.eq(remaining + issue),
+            inflight_we.eq(remaining_we),
+        ]
+        with m.If(issue):
+            sync += inflight_we.bit_select(remaining, 1).eq(self.mem_we_o)
+
+        # Block operation settings.
+        #
+        # A block operation started through R30 runs with the settings the
+        # host left in the register set.  A command list runs each of its
+        # operations with the settings in the descriptor instead (see
+        # Command lists below), so running a list leaves R24 bit 7, R31,
+        # R40, R43 and R48 as the host set them.
+        desc = Array(Signal(8, name="desc{}".format(i)) for i in range(DESC_SIZE))
+        listing = Signal(1)
+        op_copy = Signal(1)
+        op_rop = Signal(len(self.rop))
+        op_descending = Signal(1)
+        op_dual = Signal(1)
+        op_attr = Signal(8)
+        op_fill = Signal(8)
+        op_rows = Signal(len(self.rows))
+
+        comb += [
+            op_copy.eq(Mux(listing, desc[0][7], self.block_copy)),
+            op_rop.eq(Mux(listing, desc[0][0:len(self.rop)], self.rop)),
+            op_descending.eq(Mux(listing, desc[0][3], self.descending)),
+            op_dual.eq(Mux(listing, desc[0][4], self.dualplane)),
+            op_attr.eq(Mux(listing, desc[4], self.attrfill)),
+            op_fill.eq(Mux(listing, desc[7], self.cpudataw)),
+            op_rows.eq(Mux(listing, 0, self.rows)),
+        ]
+
+        # Copy buffer.
+        #
+        # Source bytes land here as their reads are acknowledged, and are
+        # written out in the same order.  When the raster operation needs
+        # the destination too, each burst then reads the destination bytes
+        # it is about to overwrite into dstbuf.  Source reads are always
+        # issued first, so the first src_reads acknowledgements of a burst
+        # carry source bytes, and the rest destination bytes.
+        copybuf = Array(Signal(8, name="copybuf{}".format(i)) for i in range(self.burst))
+        dstbuf = Array(Signal(8, name="dstbuf{}".format(i)) for i in range(self.burst))
+        burst_len = Signal(range(self.burst + 1))
+        src_reads = Signal(range(self.burst + 1))
+        rd_issued = Signal(range(self.burst + 1))
+        dst_issued = Signal(range(self.burst + 1))
+        rd_recvd = Signal(range(2 * self.burst + 1))
+        wr_issued = Signal(range(self.burst + 1))
+
+        comb += src_reads.eq(Mux(op_copy, burst_len, 0))
+
+        with m.If(rd_ack):
+            with m.If(rd_recvd < src_reads):
+                sync += copybuf[rd_recvd].eq(self.mem_dat_i)
+            with m.Else():
+                sync += dstbuf[rd_recvd - src_reads].eq(self.mem_dat_i)
+            sync += rd_recvd.eq(rd_recvd + 1)
+
+        # Raster operations.
+        #
+        # Each byte a block operation writes combines a source byte (from
+        # the copy buffer, or the fill byte) with the destination byte it
+        # replaces.  The source may first be inverted; it is then passed
+        # through, or ANDed, ORed or XORed with the destination.  Only the
+        # bits set in the write mask are taken from the result; the rest
+        # keep their destination value.  The default (pass the source
+        # through, all mask bits set) never reads the destination, and
+        # behaves exactly as a plain fill or copy.
+        need_dst = Signal(1)
+        rop_in = Signal(8)
+        rop_src = Signal(8)
+        rop_dst = Signal(8)
+        rop_fn = Signal(8)
+        rop_out = Signal(8)
+
+        comb += [
+            need_dst.eq((op_rop[0:2] != ROP_SRC) | (self.wrmask != 0xFF)),
+            rop_in.eq(Mux(op_copy, copybuf[wr_issued], self.cpudatar)),
+            rop_src.eq(Mux(op_rop[2], ~rop_in, rop_in)),
+            rop_dst.eq(dstbuf[wr_issued]),
+            rop_out.eq((rop_fn & self.wrmask) | (rop_dst & ~self.wrmask)),
+        ]
+        with m.Switch(op_rop[0:2]):
+            with m.Case(ROP_SRC):
+                comb += rop_fn.eq(rop_src)
+            with m.Case(ROP_AND):
+                comb += rop_fn.eq(rop_src & rop_dst)
+            with m.Case(ROP_OR):
+                comb += rop_fn.eq(rop_src | rop_dst)
+            with m.Case(ROP_XOR):
+                comb += rop_fn.eq(rop_src ^ rop_dst)
+
+        # Burst sizing.
+        #
+        # A copy burst reads ahead of the bytes it writes.  If the
+        # destination lies just above the source, reading ahead would
+        # fetch bytes before this very copy has rewritten them, so the
+        # burst is clipped to the distance between the two pointers.
+        # This preserves the byte-at-a-time semantics of overlapping
+        # copies (e.g., smearing one byte across a region).  Descending
+        # copies walk memory the other way, so for them the hazard arises
+        # when the destination lies just below the source.
+        distance = Signal(abus_width)
+        safe_burst = Signal(range(self.burst + 1))
+        next_burst = Signal(range(self.burst + 1))
+
+        comb += [
+            distance.eq(Mux(
+                op_descending,
+                self.copysrc - self.update_location,
+                self.update_location - self.copysrc,
+            )),
+            safe_burst.eq(self.burst),
+            next_burst.eq(safe_burst),
+        ]
+        with m.If(op_copy & (distance != 0)):
+            with m.If((self.stride == 1) & (distance < self.burst)):
+                comb += safe_burst.eq(distance)
+            # With any other stride, overlapping copies are rare enough to
+            # simply fall back to one byte at a time.
+            with m.Elif((self.stride != 1) & (distance < self.stride * self.burst)):
+                comb += safe_burst.eq(1)
+        with m.If(self.bytecnt < safe_burst):
+            comb += next_burst.eq(self.bytecnt)
+
+        # Copy direction.
+        #
+        # Block operations normally step both pointers upward, by the
+        # stride in R47.  With R43 bit 3 set, they step downward instead,
+        # so that the pointers start out addressing the *last* byte of the
+        # destination and source.  Copying downward makes it safe to move
+        # a region to an overlapping, higher address.  Destination reads
+        # for raster operations run ahead of the update location, at
+        # dst_ahead.
+        step_dst = Signal(1)
+        step_src = Signal(1)
+        dst_ahead = Signal(abus_width)
+
+        comb += [
+            step_dst.eq(0),
+            step_src.eq(0),
+            self.incr_updloc.eq(step_dst & ~op_descending),
+            self.decr_updloc.eq(step_dst & op_descending),
+            self.incr_copysrc.eq(step_src & ~op_descending),
+            self.decr_copysrc.eq(step_src & op_descending),
+        ]
+
+        # Repeated stores.
+        #
+        # Each byte written to R31 is stored R49 times, one stride apart,
+        # starting at the address posted with it.  The write queue keeps
+        # the stride and repeat count each byte was written under, since
+        # the host may change R47 and R49 before the byte is drained.
+        # store_off is the offset of the next copy from that address.  The
+        # byte stays at the head of the write queue until its last copy has
+        # been issued.
+        store_off = Signal(16)
+        store_last = Signal(1)
+        store_rep = Signal(4)
+
+        comb += store_last.eq((store_rep + 1) >= self.wq_repeat)
+
+        # Dual-plane fills.
+        #
+        # With R43 bit 4 set, a plain fill (no raster operation) stores
+        # each byte twice: the fill byte at the update location, then the
+        # attribute fill byte (R48) at the corresponding address in the
+        # attribute plane.  Both addresses advance together, so one fill
+        # clears a whole screen or window, characters and attributes
+        # alike.  plane selects which of the two stores is next.
+        #
+        # As a fill started through R30 begins after the byte the host
+        # wrote to R31, bytes written to R31 while in dual-plane mode are
+        # stored along with the attribute fill byte in the same way, so
+        # the first cell gets its attribute too.  The write queue keeps the
+        # mode and attribute each byte was written with.
+        dual = Signal(1)
+        plane = Signal(1)
+        plane_offset = Signal(16)
+
+        comb += [
+            dual.eq(op_dual & ~op_copy & ~need_dst),
+            plane_offset.eq(self.atrbase - self.chrbase),
+        ]
+
+        # Host request tracking.
+        #
+        # Because R31 writes are posted, the host may keep issuing commands
+        # while the MPE is still draining the write queue.  Requests which
+        # cannot be serviced right away are remembered until the queue has
+        # drained, so they observe every write posted before them.
+        #
+        # The host is told the MPE is ready whenever the write queue has
+        # room and no other operation is pending or in progress.  Refreshing
+        # the CPU Data register after draining the queue does not count;
+        # software wishing to read R31 after posting writes should first
+        # wait for R38 bit 7 to clear.  The MPE is idle once it is ready
+        # and the queue has drained as well; unlike ready, which comes and
+        # goes as the queue fills while the host streams bytes to R31,
+        # idle only rises once all of the host's work is done, so it is
+        # what raises the MPE interrupt.
+        pend_prefetch = Signal(1)
+        pend_block = Signal(1)
+        pend_list = Signal(1)
+        want_prefetch = Signal(1)
+        want_block = Signal(1)
+        want_list = Signal(1)
+        stale = Signal(1)
+        refreshing = Signal(1)
+        busy = Signal(1)
+
+        # Sequential read-ahead.
+        #
+        # Hosts often read video memory back one byte after another
+        # through R31.  Whenever it has nothing better to do, the MPE
+        # fetches the bytes following the update location into ra, so
+        # that the next read can be answered without waiting on the
+        # arbiter.  ra[0] holds the byte at ra_adr, and ra_count bytes
+        # are valid, ra_stride bytes apart.  Each fetch is tagged with its
+        # address, and only lands if it still extends the buffer when it
+        # completes.
+        #
+        # The buffer is emptied when the host moves the update location,
+        # changes the stride, or starts a block operation.  Stores which
+        # land within the buffer cut it short at the address they write
+        # (or, with strides other than one, empty it).  Reads are only
+        # served from it while the CPU Data register is up to date.
+        ra = Array(Signal(8, name="ra{}".format(i)) for i in range(self.readahead))
+        ra_adr = Signal(abus_width)
+        ra_stride = Signal(8)
+        ra_count = Signal(range(self.readahead + 1))
+        ra_span = Signal(abus_width)
+        ra_next = Signal(abus_width)
+        ra_fetch = Signal(abus_width)
+        ra_slot = Signal(range(self.readahead))
+        ra_offset = Signal(abus_width)
+        ra_hit = Signal(1)
+        ra_serve = Signal(1)
+        ra_shift = Signal(1)
+        ra_land = Signal(1)
+
+        comb += [
+            ra_span.eq(ra_count * ra_stride),
+            ra_next.eq(ra_adr + ra_span),
+            ra_slot.eq(ra_count - ra_shift),
+            ra_offset.eq(self.wq_adr + store_off - ra_adr),
+            ra_hit.eq(
+                self.go_rd_cpudatar & ~self.cpudatar_stale & (ra_count != 0) &
+                (ra_stride == self.stride) &
+                (ra_adr == (self.update_location + self.stride)[0:abus_width])
+            ),
+            ra_shift.eq(ra_hit | ra_serve),
+            ra_land.eq(0),
+            ra_serve.eq(0),
+        ]
+
+        comb += [
+            want_prefetch.eq(
+                pend_prefetch | self.go_wr_updloc |
+                (self.go_rd_cpudatar & ~ra_hit)
+            ),
+            want_block.eq(pend_block | self.go_wr_bytecnt),
+            want_list.eq(pend_list | self.go_wr_listptr),
+            self.cpudatar_stale.eq(stale | ~self.wq_empty),
+            self.ready.eq(~busy & ~self.wq_full),
+            self.idle.eq(~busy & self.wq_empty),
+        ]
+
+        with m.If(self.go_wr_updloc | (self.go_rd_cpudatar & ~ra_hit)):
+            sync += pend_prefetch.eq(1)
+        with m.If(self.go_wr_bytecnt):
+            sync += pend_block.eq(1)
+        with m.If(self.go_wr_listptr):
+            sync += [
+                pend_list.eq(1),
+                self.list_done.eq(0),
+            ]
+
+        # Command lists.
+        #
+        # Instead of programming each block operation through the register
+        # set, the host may chain descriptors together in video memory, and
+        # start the whole chain by writing its address to R45/R46.  Each
+        # descriptor is DESC_SIZE bytes long:
+        #
+        # Offset  Contents
+        # 0       Opcode: bit 7 selects copy (1) or fill (0), as R24 bit 7
+        #         does; bits 4:0 select the raster operation, direction
+        #         and dual-plane fill, as R43 does.
+        # 1-2     Destination address (high byte first)
+        # 3-4     Source address (copies); offset 4 holds the attribute
+        #         fill byte for dual-plane fills, as R48 does.
+        # 5-6     Length in bytes
+        # 7       Fill byte (fills only)
+        # 8-9     Address of the next descriptor; zero ends the chain.
+        #
+        # Each descriptor is fetched into desc, and run as a one-dimensional
+        # block operation.  Only its pointers and length are loaded into the
+        # register set (R18:R19, R32:R33 and R39:R30), since the operation
+        # steps them there; its other settings are used straight from desc
+        # (see Block operation settings above).  Unlike a
+        # fill started through R30, a descriptor fill stores exactly its
+        # length in fill bytes, starting at the destination.  Once the
+        # last descriptor completes, list_done is raised (R38 bit 6).  It
+        # stays set until the next chain is started.
+        listptr = Signal(16)
+        list_issued = Signal(range(DESC_SIZE + 1))
+        list_recvd = Signal(range(DESC_SIZE + 1))
+
+        comb += [
+            self.desc_dst.eq(Cat(desc[2], desc[1])),
+            self.desc_src.eq(Cat(desc[4], desc[3])),
+            self.desc_len.eq(Cat(desc[6], desc[5])),
         ]
 
+        with m.If(ra_shift):
+            sync += [ra[i].eq(ra[i + 1]) for i in range(self.readahead - 1)]
+            sync += [
+                self.cpudatar.eq(ra[0]),
+                ra_adr.eq(ra_adr + ra_stride),
+            ]
+        with m.If(ra_land):
+            sync += ra[ra_slot].eq(self.mem_dat_i)
+        sync += ra_count.eq(ra_count - ra_shift + ra_land)
+
+        # Operations completed, for the performance counters: every byte
+        # written or read through R31, and every block operation (each
+        # descriptor of a command list counts as one).
+        block_done = Signal(1)
+
+        sync += self.pc_ops.eq(
+            self.pc_ops + self.wq_pop + self.go_rd_cpudatar + block_done
+        )
+
         with m.FSM() as fsm:
-            comb += self.ready.eq(fsm.ongoing("IDLE"))
+            comb += busy.eq(
+                pend_prefetch | pend_block | pend_list |
+                ~(fsm.ongoing("IDLE") |
+                  fsm.ongoing("STORE_0") | fsm.ongoing("STORE_1") |
+                  fsm.ongoing("READAHEAD_0") | fsm.ongoing("READAHEAD_1") |
+                  (refreshing & (fsm.ongoing("PREFETCH_0") | fsm.ongoing("PREFETCH_1"))))
+            )
             with m.State("IDLE"):
-                with m.If(self.go_wr_updloc):
-                    m.next = "PREFETCH_0"
-                with m.If(self.go_rd_cpudatar):
-                    m.next = "PREFETCH_0"
-                with m.If(self.go_wr_cpudataw):
+                with m.If(~self.wq_empty):
                     m.next = "STORE_0"
-                with m.If(self.go_wr_bytecnt):
+                with m.Elif(pend_prefetch & ~stale & (ra_count != 0) &
+                            (ra_stride == self.stride) &
+                            (ra_adr == self.update_location[0:abus_width])):
+                    # A read which arrived before its byte was fetched
+                    # ahead can still be served from the buffer.
+                    comb += ra_serve.eq(1)
+                    sync += pend_prefetch.eq(0)
+                with m.Elif(want_prefetch):
+                    sync += [
+                        pend_prefetch.eq(0),
+                        refreshing.eq(0),
+                    ]
+                    m.next = "PREFETCH_0"
+                with m.Elif(want_block):
+                    sync += [
+                        pend_block.eq(0),
+                        ra_count.eq(0),
+                    ]
                     m.next = "BLOCK_0"
+                with m.Elif(want_list):
+                    sync += [
+                        pend_list.eq(0),
+                        ra_count.eq(0),
+                        listptr.eq(self.listptr),
+                        listing.eq(1),
+                        list_issued.eq(0),
+                        list_recvd.eq(0),
+                    ]
+                    m.next = "LIST_0"
+                with m.Elif(stale):
+                    sync += refreshing.eq(1)
+                    m.next = "PREFETCH_0"
+                with m.Elif((ra_stride != self.stride) |
+                            (ra_adr != (self.update_location + self.stride)[0:abus_width])):
+                    sync += [
+                        ra_adr.eq(self.update_location + self.stride),
+                        ra_stride.eq(self.stride),
+                        ra_count.eq(0),
+                    ]
+                with m.Elif((ra_count != self.readahead) & (ra_stride != 0)):
+                    m.next = "READAHEAD_0"
+
+            with m.State("READAHEAD_0"):
+                comb += [
+                    self.mem_cyc_o.eq(1),
+                    self.mem_stb_o.eq(1),
+                    self.mem_adr_o.eq(ra_next),
+                ]
+                with m.If(~self.mem_stall_i):
+                    sync += ra_fetch.eq(ra_next)
+                    m.next = "READAHEAD_1"
+
+            with m.State("READAHEAD_1"):
+                comb += self.mem_cyc_o.eq(1)
+                with m.If(self.mem_ack_i):
+                    comb += ra_land.eq(ra_fetch == ra_next)
+                    m.next = "IDLE"
 
             with m.State("PREFETCH_0"):
                 comb += [
@@ -56,77 +516,280 @@ class MPE(Elaboratable):
                 ]
                 with m.If(self.mem_ack_i):
                     m.next = "IDLE"
-                    sync += self.cpudatar.eq(self.mem_dat_i)
+                    sync += [
+                        self.cpudatar.eq(self.mem_dat_i),
+                        stale.eq(0),
+                    ]
+
+            # Writes to R31 are posted to the write queue, which already
+            # knows the address each byte is destined for.  Drain them one
+            # at a time.  Once the queue is empty, IDLE refreshes the CPU
+            # Data register from the (since advanced) update location.
 
             with m.State("STORE_0"):
                 comb += [
                     self.mem_cyc_o.eq(1),
-                    self.mem_stb_o.eq(1),
-                    self.mem_adr_o.eq(self.update_location),
+                    self.mem_stb_o.eq(room),
                     self.mem_we_o.eq(1),
-                    self.mem_dat_o.eq(self.cpudataw),
                 ]
-                with m.If(~self.mem_stall_i):
-                    m.next = "STORE_1"
+                with m.If(plane):
+                    comb += [
+                        self.mem_adr_o.eq(self.wq_adr + store_off + plane_offset),
+                        self.mem_dat_o.eq(self.wq_attr),
+                    ]
+                with m.Else():
+                    comb += [
+                        self.mem_adr_o.eq(self.wq_adr + store_off),
+                        self.mem_dat_o.eq(self.wq_dat),
+                    ]
+                with m.If(self.mem_stb_o & ~self.mem_stall_i & self.wq_dual & ~plane):
+                    # The attribute store to follow may land anywhere in the
+                    # read-ahead buffer, so simply empty it.
+                    comb += issue.eq(1)
+                    sync += [
+                        stale.eq(1),
+                        plane.eq(1),
+                        ra_count.eq(0),
+                    ]
+                with m.Elif(self.mem_stb_o & ~self.mem_stall_i):
+                    comb += issue.eq(1)
+                    sync += [
+                        stale.eq(1),
+                        plane.eq(0),
+                    ]
+                    with m.If((ra_offset < ra_span) & (ra_stride == 1)):
+                        sync += ra_count.eq(ra_offset)
+                    with m.Elif(ra_offset < ra_span):
+                        sync += ra_count.eq(0)
+                    with m.If(store_last):
+                        comb += self.wq_pop.eq(1)
+                        sync += [
+                            store_off.eq(0),
+                            store_rep.eq(0),
+                        ]
+                        m.next = "STORE_1"
+                    with m.Else():
+                        sync += [
+                            store_off.eq(store_off + self.wq_stride),
+                            store_rep.eq(store_rep + 1),
+                        ]
 
             with m.State("STORE_1"):
                 comb += [
                     self.mem_cyc_o.eq(1),
                 ]
-                with m.If(self.mem_ack_i):
-                    comb += self.incr_updloc.eq(1)
-                    m.next = "PREFETCH_0"
+                with m.If((inflight == 0) | ((inflight == 1) & self.mem_ack_i)):
+                    m.next = "IDLE"
+
+            # Block fills and copies are pipelined.  Rather than waiting
+            # for each access to complete before starting the next, the
+            # MPE issues a new access on every clock the arbiter lets it,
+            # and tracks the outstanding accesses until they're acknowledged.
+            #
+            # Fills simply stream writes until the byte count reaches zero.
+            #
+            # Copies alternate between a read burst (BLOCK_1), which issues
+            # up to `burst` source reads back to back into the copy buffer,
+            # and a write burst (BLOCK_2), which retires the buffered bytes
+            # to the destination back to back.  BLOCK_0 sizes each burst,
+            # and BLOCK_3 drains outstanding acknowledgements before the
+            # final prefetch.
+            #
+            # Raster operations which need the destination byte run fills
+            # in bursts as well.  After any source reads, each burst reads
+            # the destination bytes it will overwrite (BLOCK_5), and
+            # BLOCK_2 writes each byte once both its inputs have arrived.
+            #
+            # Rectangular operations (R40 greater than one) run once per
+            # row.  At the end of each row but the last, BLOCK_4 has the
+            # register set move both pointers to the next row and reload
+            # the byte count, and the operation starts over at BLOCK_0.
+            #
+            # Pointer registers are stepped as each access is *issued*,
+            # so the register set always holds the address of the next
+            # access to issue.
 
             with m.State("BLOCK_0"):
+                sync += [
+                    rd_issued.eq(0),
+                    dst_issued.eq(0),
+                    rd_recvd.eq(0),
+                    wr_issued.eq(0),
+                    plane.eq(0),
+                ]
+                sync += dst_ahead.eq(self.update_location)
                 with m.If(self.bytecnt != 0):
-                    with m.If(self.block_copy):
-                        comb += [
-                            self.mem_cyc_o.eq(1),
-                            self.mem_stb_o.eq(1),
-                            self.mem_adr_o.eq(self.copysrc),
+                    with m.If(op_copy):
+                        sync += burst_len.eq(next_burst)
+                        m.next = "BLOCK_1"
+                    with m.Elif(need_dst):
+                        sync += [
+                            self.cpudatar.eq(op_fill),
+                            burst_len.eq(next_burst),
                         ]
-                        with m.If(~self.mem_stall_i):
-                            m.next = "BLOCK_1"
+                        m.next = "BLOCK_5"
                     with m.Else():
-                        sync += self.cpudatar.eq(self.cpudataw)
+                        sync += self.cpudatar.eq(op_fill)
                         m.next = "BLOCK_2"
                 with m.Else():
-                    m.next = "PREFETCH_0"
+                    m.next = "BLOCK_3"
 
             with m.State("BLOCK_1"):
                 comb += [
                     self.mem_cyc_o.eq(1),
+                    self.mem_stb_o.eq(room),
+                    self.mem_adr_o.eq(self.copysrc),
                 ]
-                with m.If(self.mem_ack_i):
-                    sync += self.cpudatar.eq(self.mem_dat_i)
-                    m.next = "BLOCK_2"
+                with m.If(self.mem_stb_o & ~self.mem_stall_i):
+                    comb += [
+                        issue.eq(1),
+                        step_src.eq(1),
+                    ]
+                    sync += rd_issued.eq(rd_issued + 1)
+                    with m.If((rd_issued == burst_len - 1) & need_dst):
+                        m.next = "BLOCK_5"
+                    with m.Elif(rd_issued == burst_len - 1):
+                        m.next = "BLOCK_2"
+
+            with m.State("BLOCK_5"):
+                comb += [
+                    self.mem_cyc_o.eq(1),
+                    self.mem_stb_o.eq(room),
+                    self.mem_adr_o.eq(dst_ahead),
+                ]
+                with m.If(self.mem_stb_o & ~self.mem_stall_i):
+                    comb += issue.eq(1)
+                    sync += [
+                        dst_issued.eq(dst_issued + 1),
+                        dst_ahead.eq(Mux(
+                            op_descending,
+                            dst_ahead - self.stride,
+                            dst_ahead + self.stride,
+                        )),
+                    ]
+                    with m.If(dst_issued == burst_len - 1):
+                        m.next = "BLOCK_2"
 
             with m.State("BLOCK_2"):
                 comb += [
                     self.mem_cyc_o.eq(1),
-                    self.mem_stb_o.eq(1),
-                    self.mem_adr_o.eq(self.update_location),
                     self.mem_we_o.eq(1),
-                    self.mem_dat_o.eq(self.cpudatar),
                 ]
+                with m.If(plane):
+                    comb += [
+                        self.mem_adr_o.eq(self.update_location + plane_offset),
+                        self.mem_dat_o.eq(op_attr),
+                    ]
+                with m.Else():
+                    comb += [
+                        self.mem_adr_o.eq(self.update_location),
+                        self.mem_dat_o.eq(rop_out),
+                    ]
+                with m.If(need_dst):
+                    comb += self.mem_stb_o.eq(
+                        room & (rd_recvd > src_reads + wr_issued)
+                    )
+                with m.Elif(op_copy):
+                    comb += self.mem_stb_o.eq(room & (rd_recvd > wr_issued))
+                with m.Else():
+                    comb += self.mem_stb_o.eq(room)
 
-                with m.If(~self.mem_stall_i):
-                    m.next = "BLOCK_3"
+                with m.If(self.mem_stb_o & ~self.mem_stall_i & dual & ~plane):
+                    comb += issue.eq(1)
+                    sync += plane.eq(1)
+                with m.Elif(self.mem_stb_o & ~self.mem_stall_i):
+                    comb += [
+                        issue.eq(1),
+                        step_dst.eq(1),
+                        self.decr_bytecnt.eq(1),
+                    ]
+                    sync += [
+                        wr_issued.eq(wr_issued + 1),
+                        plane.eq(0),
+                    ]
+                    with m.If((self.bytecnt == 1) & (op_rows > 1)):
+                        m.next = "BLOCK_4"
+                    with m.Elif(self.bytecnt == 1):
+                        m.next = "BLOCK_3"
+                    with m.Elif((op_copy | need_dst) &
+                                (wr_issued == burst_len - 1)):
+                        m.next = "BLOCK_0"
 
             with m.State("BLOCK_3"):
                 comb += self.mem_cyc_o.eq(1)
+                with m.If((inflight == 0) | ((inflight == 1) & self.mem_ack_i)):
+                    comb += block_done.eq(1)
+                    with m.If(listing & (listptr != 0)):
+                        sync += [
+                            list_issued.eq(0),
+                            list_recvd.eq(0),
+                        ]
+                        m.next = "LIST_0"
+                    with m.Else():
+                        with m.If(listing):
+                            sync += [
+                                listing.eq(0),
+                                self.list_done.eq(1),
+                            ]
+                        sync += refreshing.eq(0)
+                        m.next = "PREFETCH_0"
 
-                with m.If(self.mem_ack_i):
-                    comb += [
-                        self.incr_updloc.eq(1),
-                        self.decr_bytecnt.eq(1),
+            with m.State("LIST_0"):
+                comb += [
+                    self.mem_cyc_o.eq(1),
+                    self.mem_stb_o.eq(room),
+                    self.mem_adr_o.eq(listptr + list_issued),
+                ]
+                with m.If(self.mem_stb_o & ~self.mem_stall_i):
+                    comb += issue.eq(1)
+                    sync += list_issued.eq(list_issued + 1)
+                    with m.If(list_issued == DESC_SIZE - 1):
+                        m.next = "LIST_1"
+                with m.If(rd_ack):
+                    sync += [
+                        desc[list_recvd].eq(self.mem_dat_i),
+                        list_recvd.eq(list_recvd + 1),
                     ]
-                    with m.If(self.block_copy):
-                        comb += self.incr_copysrc.eq(1)
-                    m.next = "BLOCK_0"
+
+            with m.State("LIST_1"):
+                comb += self.mem_cyc_o.eq(1)
+                with m.If(rd_ack):
+                    sync += [
+                        desc[list_recvd].eq(self.mem_dat_i),
+                        list_recvd.eq(list_recvd + 1),
+                    ]
+                    with m.If(list_recvd == DESC_SIZE - 1):
+                        m.next = "LIST_2"
+
+            with m.State("LIST_2"):
+                comb += self.ld_desc.eq(1)
+                sync += listptr.eq(Cat(desc[9], desc[8]))
+                m.next = "BLOCK_0"
+
+            with m.State("BLOCK_4"):
+                comb += [
+                    self.mem_cyc_o.eq(1),
+                    self.next_row.eq(1),
+                ]
+                m.next = "BLOCK_0"
 
             if platform == 'formal':
                 comb += [
+                    self.fv_idle.eq(fsm.ongoing("IDLE")),
+                    self.fv_pend_prefetch.eq(pend_prefetch),
+                    self.fv_pend_block.eq(pend_block),
+                    self.fv_stale.eq(stale),
+                    self.fv_refreshing.eq(refreshing),
+                    self.fv_ra_adr.eq(ra_adr),
+                    self.fv_ra_stride.eq(ra_stride),
+                    self.fv_plane.eq(plane),
+                    self.fv_store_off.eq(store_off),
+                    self.fv_store_last.eq(store_last),
+                    self.fv_ra_count.eq(ra_count),
+                    self.fv_ra_head.eq(ra[0]),
+                    self.fv_ra_hit.eq(ra_hit),
+                    self.fv_readahead_0.eq(fsm.ongoing("READAHEAD_0")),
+                    self.fv_readahead_1.eq(fsm.ongoing("READAHEAD_1")),
                     self.fv_prefetch_0.eq(fsm.ongoing("PREFETCH_0")),
                     self.fv_prefetch_1.eq(fsm.ongoing("PREFETCH_1")),
                     self.fv_store_0.eq(fsm.ongoing("STORE_0")),
@@ -135,6 +798,17 @@ class MPE(Elaboratable):
                     self.fv_block_1.eq(fsm.ongoing("BLOCK_1")),
                     self.fv_block_2.eq(fsm.ongoing("BLOCK_2")),
                     self.fv_block_3.eq(fsm.ongoing("BLOCK_3")),
+                    self.fv_block_4.eq(fsm.ongoing("BLOCK_4")),
+                    self.fv_block_5.eq(fsm.ongoing("BLOCK_5")),
+                    self.fv_list_0.eq(fsm.ongoing("LIST_0")),
+                    self.fv_list_1.eq(fsm.ongoing("LIST_1")),
+                    self.fv_list_2.eq(fsm.ongoing("LIST_2")),
+                    self.fv_listing.eq(listing),
+                    self.fv_pend_list.eq(pend_list),
                 ]
 
+        # Moving the update location discards everything fetched ahead.
+        with m.If(self.go_wr_updloc):
+            sync += ra_count.eq(0)
+
         return m
@@ -9,30 +9,53 @@ from nmigen import (
 class RAM(Elaboratable):
     """
     This core should map to one or more block RAM resources.
+
+    Reads are addressed by adr_i, and writes by wadr_i, so that a read
+    and a write may proceed in the same cycle.  A read from the address
+    being written in the same cycle returns the byte being written.
+
+    With wide set, the same number of bytes (2**abus_width) is organized
+    as 16-bit words, addressed by abus_width-1 bit word addresses.  we_i
+    then has one enable per byte lane, the low lane holding the byte at
+    the even byte address.
+
+    latency sets the number of clocks from an address on adr_i to its data
+    on dat_o.  Beyond the first, each clock adds a register after the read
+    port, which block RAMs usually provide for free as an output register.
     """
 
-    def __init__(self, platform="", abus_width=14):
+    def __init__(self, platform="", abus_width=14, wide=False, latency=1):
         super().__init__()
-        self.adr_i = Signal(abus_width)
-        self.dat_i = Signal(8)
-        self.we_i = Signal(1)
-        self.dat_o = Signal(8)
+        self.latency = latency
+        lanes = 2 if wide else 1
+        self.adr_i = Signal(abus_width - (lanes - 1))
+        self.wadr_i = Signal(len(self.adr_i))
+        self.dat_i = Signal(8 * lanes)
+        self.we_i = Signal(lanes)
+        self.dat_o = Signal(8 * lanes)
 
-        self.mem = Memory(width=8, depth=(1<<abus_width))
+        self.mem = Memory(width=8 * lanes, depth=(1<<len(self.adr_i)))
 
     def elaborate(self, platform):
         m = Module()
+        sync = m.d.sync
         comb = m.d.comb
 
         m.submodules.rdport = rdport = self.mem.read_port()
-        m.submodules.wrport = wrport = self.mem.write_port()
+        m.submodules.wrport = wrport = self.mem.write_port(granularity=8)
         comb += [
             rdport.addr.eq(self.adr_i),
-            self.dat_o.eq(rdport.data),
 
-            wrport.addr.eq(self.adr_i),
+            wrport.addr.eq(self.wadr_i),
             wrport.data.eq(self.dat_i),
             wrport.en.eq(self.we_i),
         ]
 
+        dat = rdport.data
+        for i in range(self.latency - 1):
+            stage = Signal(len(dat), name="dat_stage{}".format(i))
+            sync += stage.eq(dat)
+            dat = stage
+        comb += self.dat_o.eq(dat)
+
         return m
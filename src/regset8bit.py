@@ -1,13 +1,14 @@
 from nmigen import (
     Elaboratable,
     Module,
+    Mux,
     Signal,
     Cat,
     Const,
 )
 
 
-from interfaces import create_regset8bit_interface
+from interfaces import PC_WIDTH, create_regset8bit_interface
 
 
 class RegSet8Bit(Elaboratable):
@@ -63,6 +64,19 @@ class RegSet8Bit(Elaboratable):
         hcd_reg = Signal(4)                     # R22[3:0]
         hsync_xor_reg = Signal(1, reset=1)      # R37 [7]
         vsync_xor_reg = Signal(1, reset=1)      # R37 [6]
+        int_enable = Signal(3)                  # R50
+        int_status = Signal(3)                  # R51
+        rastcmp = Signal(10)                    # R52[1:0], R53
+        pc_select = Signal(3)                   # R54
+        pc_held = Signal(PC_WIDTH)              # R55, R56, R57
+        pc_capture = Signal(1)
+        pc_snap_mask = Signal(5)                # R58
+        pc_value = Signal(PC_WIDTH)
+        dststride_reg = Signal(16)              # R59, R41
+        srcstride_reg = Signal(16)              # R60, R42
+        blkwidth = Signal(16)
+        rowdst = Signal(16)
+        rowsrc = Signal(16)
 
         comb += [
             self.ht.eq(ht_reg),
@@ -114,11 +128,50 @@ class RegSet8Bit(Elaboratable):
             ),
             26: Cat(self.bgpen, self.fgpen),
             28: Cat(Const(-1, 5), self.fontbase),
-            30: self.bytecnt,
+            30: self.bytecnt[0:8],
             31: self.cpudatar,
             32: self.copysrc[8:16],
             33: self.copysrc[0:8],
             37: Cat(Const(-1, 6), self.vsync_xor, self.hsync_xor),
+            # R38 reports the writes to R31 still waiting to reach video
+            # memory (bits 3-0), the end of a command list (bit 6), and
+            # whether R31 has yet to catch up with the update location
+            # (bit 7).  Writes to R31 are posted, so a read of R31 made
+            # while bit 7 is set returns the byte at a stale address,
+            # unless the host bus holds the host in WAIT until it clears.
+            38: Cat(
+                self.wq_level,
+                Const(0, 2),
+                self.list_done,
+                self.cpudatar_stale,
+            ),
+            39: self.bytecnt[8:16],
+            40: self.rows,
+            41: dststride_reg[0:8],
+            42: srcstride_reg[0:8],
+            43: Cat(
+                self.rop,
+                self.descending,
+                self.dualplane,
+                Const(-1, 6-len(self.rop)),
+            ),
+            44: self.wrmask,
+            45: self.listptr[8:16],
+            46: self.listptr[0:8],
+            47: self.stride,
+            48: self.attrfill,
+            49: Cat(self.wrrepeat, Const(-1, 4)),
+            50: Cat(int_enable, Const(-1, 8-len(int_enable))),
+            51: Cat(int_status, Const(-1, 8-len(int_status))),
+            52: Cat(rastcmp[8:10], Const(-1, 6)),
+            53: rastcmp[0:8],
+            54: Cat(pc_select, Const(-1, 8-len(pc_select))),
+            55: pc_held[16:24],
+            56: pc_held[8:16],
+            57: pc_held[0:8],
+            58: Cat(pc_snap_mask, Const(-1, 8-len(pc_snap_mask))),
+            59: dststride_reg[8:16],
+            60: srcstride_reg[8:16],
         }
 
         with m.If(self.adr_i == 0):
@@ -145,8 +198,15 @@ class RegSet8Bit(Elaboratable):
             self.go_wr_bytecnt.eq(
                 (self.adr_i == 30) & self.we_i
             ),
+            self.go_wr_listptr.eq(
+                (self.adr_i == 46) & self.we_i
+            ),
 
-            incr_updloc.eq(self.go_rd_cpudatar | self.incr_updloc),
+            # Writes to R31 are posted to the write queue along with the
+            # current update location, so the pointer advances right away.
+            incr_updloc.eq(
+                self.go_rd_cpudatar | self.go_wr_cpudataw | self.incr_updloc
+            ),
         ]
 
         # Handle write data routing
@@ -212,7 +272,12 @@ class RegSet8Bit(Elaboratable):
             with m.Elif(self.adr_i == 28):
                 sync += self.fontbase.eq(self.dat_i[5:8])
             with m.Elif((self.adr_i == 30) & ~self.decr_bytecnt):
-                sync += self.bytecnt.eq(self.dat_i)
+                sync += [
+                    self.bytecnt[0:8].eq(self.dat_i),
+                    blkwidth.eq(Cat(self.dat_i, self.bytecnt[8:16])),
+                    rowdst.eq(self.update_location),
+                    rowsrc.eq(self.copysrc),
+                ]
             with m.Elif(self.adr_i == 31):
                 sync += self.cpudataw.eq(self.dat_i)
             with m.Elif((self.adr_i == 32) & ~self.incr_copysrc):
@@ -224,15 +289,195 @@ class RegSet8Bit(Elaboratable):
                     hsync_xor_reg.eq(self.dat_i[7]),
                     vsync_xor_reg.eq(self.dat_i[6]),
                 ]
+            with m.Elif((self.adr_i == 39) & ~self.decr_bytecnt):
+                sync += self.bytecnt[8:16].eq(self.dat_i)
+            with m.Elif((self.adr_i == 40) & ~self.next_row):
+                sync += self.rows.eq(self.dat_i)
+            with m.Elif(self.adr_i == 41):
+                sync += dststride_reg[0:8].eq(self.dat_i)
+            with m.Elif(self.adr_i == 42):
+                sync += srcstride_reg[0:8].eq(self.dat_i)
+            with m.Elif(self.adr_i == 43):
+                sync += [
+                    self.rop.eq(self.dat_i[0:len(self.rop)]),
+                    self.descending.eq(self.dat_i[3]),
+                    self.dualplane.eq(self.dat_i[4]),
+                ]
+            with m.Elif(self.adr_i == 44):
+                sync += self.wrmask.eq(self.dat_i)
+            with m.Elif(self.adr_i == 45):
+                sync += self.listptr[8:16].eq(self.dat_i)
+            with m.Elif(self.adr_i == 46):
+                sync += self.listptr[0:8].eq(self.dat_i)
+            with m.Elif(self.adr_i == 47):
+                sync += self.stride.eq(self.dat_i)
+            with m.Elif(self.adr_i == 48):
+                sync += self.attrfill.eq(self.dat_i)
+            with m.Elif(self.adr_i == 49):
+                sync += self.wrrepeat.eq(self.dat_i[0:4])
+            with m.Elif(self.adr_i == 50):
+                sync += int_enable.eq(self.dat_i[0:len(int_enable)])
+            with m.Elif(self.adr_i == 52):
+                sync += rastcmp[8:10].eq(self.dat_i[0:2])
+            with m.Elif(self.adr_i == 53):
+                sync += rastcmp[0:8].eq(self.dat_i)
+            with m.Elif(self.adr_i == 54):
+                sync += pc_select.eq(self.dat_i[0:len(pc_select)])
+            with m.Elif(self.adr_i == 58):
+                sync += pc_snap_mask.eq(self.dat_i[0:len(pc_snap_mask)])
+            with m.Elif(self.adr_i == 59):
+                sync += dststride_reg[8:16].eq(self.dat_i)
+            with m.Elif(self.adr_i == 60):
+                sync += srcstride_reg[8:16].eq(self.dat_i)
+
+        # Handle updates to pointer registers.  Pointers step by the
+        # stride in R47, which resets to one.  A larger stride lets the
+        # host, fills and copies walk a column of the screen.
+        #
+        # The MPE stores each byte written to R31 R49 times (zero counts
+        # as once), one stride apart, so such writes step the update
+        # location past every copy.  This lets an 8x8 font be uploaded
+        # straight into 8x16 or 8x32 glyph slots.
+        updloc_step = Signal(16)
+
+        with m.If(self.go_wr_cpudataw & (self.wrrepeat > 1)):
+            comb += updloc_step.eq(self.stride * self.wrrepeat)
+        with m.Else():
+            comb += updloc_step.eq(self.stride)
 
-        # Handle updates to pointer registers.
         with m.If(incr_updloc):
-            sync += self.update_location.eq(self.update_location + 1)
+            sync += self.update_location.eq(self.update_location + updloc_step)
 
         with m.If(self.incr_copysrc):
-            sync += self.copysrc.eq(self.copysrc + 1)
+            sync += self.copysrc.eq(self.copysrc + self.stride)
+
+        # Descending block operations step the pointers downward instead.
+        with m.If(self.decr_updloc):
+            sync += self.update_location.eq(self.update_location - self.stride)
 
+        with m.If(self.decr_copysrc):
+            sync += self.copysrc.eq(self.copysrc - self.stride)
+
+        # The byte count is 16 bits wide.  R30 holds its low byte, and R39
+        # its high byte.  R39 resets to zero, and every block operation
+        # counts all 16 bits down to zero, so software which only ever
+        # writes R30 sees the original 8-bit behavior.
         with m.If(self.decr_bytecnt):
             sync += self.bytecnt.eq(self.bytecnt - 1)
 
+        # Rectangular block operations repeat the run of R39:R30 bytes once
+        # per row (R40).  Between rows, both pointers advance to the start
+        # of the next row, R59:R41 (destination) or R60:R42 (source) bytes
+        # past the start of the row just finished, and the byte count is
+        # reloaded with the row width.  R59 and R60 reset to zero, so
+        # software that only writes R41 and R42 gets 8-bit strides.  R40
+        # resets to zero, and is left at one when an operation completes;
+        # either way, the next operation covers a single run, as on the
+        # original VDC.  Descending operations walk the rows from last to
+        # first.
+        #
+        # Each row starts where R18:R19 stood when R30 was written.  A fill
+        # takes its byte from R31, and storing that byte advances R18:R19
+        # past the rectangle's corner.  So a rectangle fill writes R31 first,
+        # then rewrites R18:R19 with the corner before starting with R30;
+        # the fill stores the first byte again, along with the rest.
+        with m.If(self.next_row):
+            sync += [
+                self.bytecnt.eq(blkwidth),
+                self.rows.eq(self.rows - 1),
+            ]
+            with m.If(self.descending):
+                sync += [
+                    self.update_location.eq(rowdst - dststride_reg),
+                    self.copysrc.eq(rowsrc - srcstride_reg),
+                    rowdst.eq(rowdst - dststride_reg),
+                    rowsrc.eq(rowsrc - srcstride_reg),
+                ]
+            with m.Else():
+                sync += [
+                    self.update_location.eq(rowdst + dststride_reg),
+                    self.copysrc.eq(rowsrc + srcstride_reg),
+                    rowdst.eq(rowdst + dststride_reg),
+                    rowsrc.eq(rowsrc + srcstride_reg),
+                ]
+
+        # Interrupts.
+        #
+        # Each source latches its bit in the status register (R51) when
+        # the event occurs: the MPE going idle with its work done, the
+        # start of vertical sync, and the display reaching the raster line
+        # in R52:R53.  Writing ones to R51 acknowledges the corresponding
+        # events.  The interrupt request is asserted for as long as any
+        # latched event is enabled in R50, so the host can sleep through a
+        # long block operation or a frame instead of polling.
+        #
+        # The MPE comes out of reset idle, and the raster compare register
+        # resets to match line 0.  The previous levels reset high, so
+        # neither counts as an event and R51 reads zero after reset.
+        mpe_prev = Signal(1, reset=1)
+        vsync_prev = Signal(1, reset=1)
+        raster_prev = Signal(1, reset=1)
+        raster_hit = Signal(1)
+        events = Signal(len(int_status))
+
+        comb += [
+            raster_hit.eq(self.rasterline == rastcmp),
+            events.eq(Cat(
+                self.int_mpe & ~mpe_prev,
+                self.int_vsync & ~vsync_prev,
+                raster_hit & ~raster_prev,
+            )),
+            self.irq.eq((int_enable & int_status) != 0),
+        ]
+        sync += [
+            mpe_prev.eq(self.int_mpe),
+            vsync_prev.eq(self.int_vsync),
+            raster_prev.eq(raster_hit),
+        ]
+
+        with m.If(self.we_i & (self.adr_i == 51)):
+            sync += int_status.eq((int_status & ~self.dat_i[0:len(int_status)]) | events)
+        with m.Else():
+            sync += int_status.eq(int_status | events)
+
+        # Performance counters.
+        #
+        # R54 selects one of the free-running counters kept by the arbiter
+        # and the MPE (see PC_* in interfaces.py).  Writing R54 captures
+        # all 24 bits of the selected counter in a single clock, and R55,
+        # R56, R57 return that capture from the top byte down, however
+        # long the host takes between reads.  Write R54 again for a new
+        # reading.  Every counter is also copied at the start of vertical
+        # sync.  Setting a counter's bit in R58 makes it read back that
+        # copy instead, so a driver can measure whole frames by
+        # subtracting successive readings.
+        pc_live = [
+            self.pc_vfe, self.pc_mpe, self.pc_stall, self.pc_idle, self.pc_ops,
+        ]
+        pc_snap = [Signal(PC_WIDTH, name="pc_snap%d" % i) for i in range(len(pc_live))]
+
+        with m.Switch(pc_select):
+            for i, (live, snap) in enumerate(zip(pc_live, pc_snap)):
+                with m.Case(i):
+                    comb += pc_value.eq(Mux(pc_snap_mask[i], snap, live))
+
+        with m.If(events[1]):
+            sync += [snap.eq(live) for live, snap in zip(pc_live, pc_snap)]
+
+        # The capture waits a clock, for pc_select to take the new value.
+        sync += pc_capture.eq(self.we_i & (self.adr_i == 54))
+        with m.If(pc_capture):
+            sync += pc_held.eq(pc_value)
+
+        # Command list descriptors load the pointers and length of their
+        # block operation, which the MPE then steps as usual.  The MPE takes
+        # a descriptor's other settings from the descriptor itself, so the
+        # host's R24, R31, R40, R43 and R48 survive a command list.
+        with m.If(self.ld_desc):
+            sync += [
+                self.update_location.eq(self.desc_dst),
+                self.copysrc.eq(self.desc_src),
+                self.bytecnt.eq(self.desc_len),
+            ]
+
         return m
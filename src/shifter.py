@@ -1,21 +1,44 @@
 from nmigen import (
+    Cat,
+    Const,
     Elaboratable,
     Module,
+    Mux,
     Signal,
 )
 
-from interfaces import create_shifter_interface
+from interfaces import create_shifter_interface, strip_bits
 
 
 class Shifter(Elaboratable):
-    def __init__(self, platform=None):
-        create_shifter_interface(self, platform=platform)
+    def __init__(self, platform=None, wide=False, line_buffer=False,
+                 strip_width=4):
+        # With wide, characters and attributes are interleaved in a 16-bit
+        # video RAM, so the character pointer steps over pairs.
+        self.wide = wide
+
+        # With line_buffer, the video fetch engine fetches each scanline
+        # whole into a line buffer, starting as soon as the line before
+        # it has been displayed, and strips are copied out of the line
+        # buffer during display.
+        self.line_buffer = line_buffer
+
+        # Strips of strip_width columns are displayed, and fetched, at a
+        # time.  This must match the strip buffer and video fetch engine.
+        self.strip_width = strip_width
+        create_shifter_interface(
+            self, platform=platform, strip_width=strip_width
+        )
 
     def elaborate(self, platform):
         m = Module()
         sync = m.d.sync
         comb = m.d.comb
 
+        strip_width = self.strip_width
+        col_bits = strip_bits(strip_width)
+        last = strip_width - 1
+
         # Support for vertical smooth scroll in text mode.
         # In bitmap mode, you'll need to update both the
         # vscroll field AND the character base address.
@@ -23,31 +46,81 @@ class Shifter(Elaboratable):
         # with the raster selected by the character base address.
 
         vden1 = Signal(1)
+        vden_next1 = Signal(1)
         hs1 = Signal(1)
+        den1 = Signal(1)
         lastrow = Signal(1)
+        next_raster = Signal(1)
+        frame_start = Signal(1)
 
         comb += lastrow.eq(self.ra == self.vct)
 
         sync += [
             vden1.eq(self.vden),
+            vden_next1.eq(self.vden_next),
             hs1.eq(self.hs),
+            den1.eq(self.den),
         ]
 
-        with m.If(~vden1 & self.vden):
+        # A frame starts when VDEN rises, at the end of the HSYNC just
+        # before the first displayed raster.  With line_buffer, that
+        # raster must be fetched a whole raster ahead, like every other,
+        # so the frame starts when vden_next rises, a raster earlier.
+        if self.line_buffer:
+            comb += frame_start.eq(~vden_next1 & self.vden_next)
+        else:
+            comb += frame_start.eq(~vden1 & self.vden)
+
+        # ra normally steps at the end of HSYNC, ahead of the fetch for the
+        # new raster.  With line_buffer, that fetch starts as soon as the
+        # previous raster has been displayed, so ra steps then instead.
+        if self.line_buffer:
+            comb += next_raster.eq(den1 & ~self.den)
+        else:
+            comb += next_raster.eq(hs1 & ~self.hs)
+
+        with m.If(frame_start):
             sync += self.ra.eq(self.vscroll)
-        with m.Elif(hs1 & ~self.hs):
+        with m.Elif(next_raster):
             with m.If(~lastrow):
                 sync += self.ra.eq(self.ra + 1)
             with m.Else():
                 sync += self.ra.eq(0)
 
+        # first_raster tells the video fetch engine that the character
+        # codes and attributes it fetches are new to it, either because
+        # ra was just reloaded from vscroll or because it wrapped to 0.
+        # It stays set until a raster has actually been fetched, so the
+        # row cache is filled even if the first raster goes undisplayed.
+
+        line_fetched = Signal(1)
+        line_started = Signal(1)
+
+        if self.line_buffer:
+            comb += line_started.eq(self.go_fetch & self.fetch_ldptr)
+        else:
+            comb += line_started.eq(self.go_ldptr)
+
+        with m.If(line_started):
+            sync += line_fetched.eq(1)
+        with m.Elif(next_raster):
+            sync += line_fetched.eq(0)
+
+        with m.If(frame_start):
+            sync += self.first_raster.eq(1)
+        with m.Elif(next_raster):
+            with m.If(lastrow):
+                sync += self.first_raster.eq(1)
+            with m.Elif(line_fetched):
+                sync += self.first_raster.eq(0)
+
         # Support for atrptr, which tracks the start of the
         # current *line's* attributes.  (The atrptr that tracks
         # the current *character* is in the video fetch engine.)
 
         bump_atrptr = Signal(1)
 
-        with m.If(~vden1 & self.vden):
+        with m.If(frame_start):
             sync += self.atrptr.eq(self.atrbase)
         with m.Elif(bump_atrptr):
             sync += self.atrptr.eq(self.atrptr + 1)
@@ -59,10 +132,10 @@ class Shifter(Elaboratable):
 
         bump_chrptr = Signal(1)
 
-        with m.If(~vden1 & self.vden):
+        with m.If(frame_start):
             sync += self.chrptr.eq(self.chrbase)
         with m.Elif(bump_chrptr):
-            sync += self.chrptr.eq(self.chrptr + 1)
+            sync += self.chrptr.eq(self.chrptr + (2 if self.wide else 1))
 
         # Support for the blink attribute.
 
@@ -128,19 +201,84 @@ class Shifter(Elaboratable):
         with m.If(~reveal_ctr_z & chrgate):
             sync += pixctr.eq(pixctr - 1)
 
+        # Line Fetch State Machine
+        #
+        # With line_buffer, a scanline is fetched as soon as the one before
+        # it has been displayed, or, for the first scanline of a frame, at
+        # the start of the last blanked one.  The video fetch engine is kicked off once per strip,
+        # back to back, into the half of the line buffer that is not on
+        # display (lhalf), for all hd columns plus the extra strips the
+        # display prefetches at the start of a line.  The line is shown
+        # from the half it was fetched into (shalf).  go_fetch is held
+        # until the video fetch engine starts the strip (fetch_started),
+        # so it can chain each strip onto the one before.
+
+        if self.line_buffer:
+            strips_left = Signal(8 - col_bits)
+            strips_max = (1 << len(strips_left)) - 1
+
+            with m.FSM():
+                with m.State("Idle"):
+                    with m.If(next_raster | frame_start):
+                        m.next = "Start"
+
+                with m.State("Start"):
+                    comb += [
+                        self.go_fetch.eq(1),
+                        self.fetch_ldptr.eq(1),
+                    ]
+                    with m.If(self.fetch_started):
+                        sync += [
+                            self.lhalf.eq(~self.lhalf),
+                            strips_left.eq(Mux(
+                                self.hd[col_bits:8] == strips_max,
+                                strips_max,
+                                self.hd[col_bits:8] + 1,
+                            )),
+                        ]
+                        m.next = "Fetch"
+
+                with m.State("Fetch"):
+                    with m.If(strips_left == 0):
+                        m.next = "Idle"
+                    with m.Else():
+                        comb += self.go_fetch.eq(1)
+                        with m.If(self.fetch_started):
+                            sync += strips_left.eq(strips_left - 1)
+
         # Strip Buffer State Machine
         #
         # This state machine is responsible for routing the video
         # data to the final output mux at the correct times.  A
         # necessary part of this process is coordinating when to
-        # start video memory fetches as well.
+        # start video memory fetches as well.  With line_buffer,
+        # go_prefetch copies the next strip out of the line buffer
+        # instead, and done_prefetch reports when the copy is done.
 
         comb += [
             self.go_prefetch.eq(0),
             self.swap_strip.eq(0),
             self.padr.eq(0),
         ]
-        
+
+        # Swap Counter
+        #
+        # Counts the clocks left before the next swap_strip, so the
+        # memory arbiter knows how long the video fetch engine can be
+        # held off.  Strips are strip_width characters of R22 clocks
+        # each, so the counter is reloaded with strip_width*(hct+1)-1
+        # on every swap during active display, reaching zero on the
+        # cycle of the next swap.  It is zero whenever no swap is
+        # scheduled (the prefetch at the start of a line waits for the
+        # fetch engine, not the other way around), which means no
+        # deadline slack.
+        # Changing R22 in the middle of a line invalidates the count,
+        # but garbles the display anyway.  With line_buffer, fetches
+        # aren't tied to strip swaps, so the counter stays at zero.
+
+        with m.If(self.swap_ctr != 0):
+            sync += self.swap_ctr.eq(self.swap_ctr - 1)
+
         with m.FSM() as sbsm:
             with m.State("WaitHS"):
                 with m.If(self.hs):
@@ -156,6 +294,8 @@ class Shifter(Elaboratable):
                         m.next = "Prefetch"
                         comb += self.go_prefetch.eq(1)
                         comb += self.go_ldptr.eq(1)
+                        if self.line_buffer:
+                            sync += self.shalf.eq(self.lhalf)
                     with m.Else():
                         m.next = "WaitHS"
 
@@ -178,54 +318,30 @@ class Shifter(Elaboratable):
                         m.next = "Column0"
                     comb += self.go_prefetch.eq(1)
 
-            with m.State("Column0"):
-                with m.If(~self.den):
-                    m.next = "WaitHS"
-                with m.Else():
-                    with m.If(reveal_ctr_z):
-                        comb += [
-                            bump_atrptr.eq(lastrow),
-                            bump_chrptr.eq(lastrow | self.bitmap_mode),
-                        ]
-                        m.next = "Column1"
-
-            with m.State("Column1"):
-                comb += self.padr.eq(1)
-                with m.If(~self.den):
-                    m.next = "WaitHS"
-                with m.Else():
-                    with m.If(reveal_ctr_z):
-                        comb += [
-                            bump_atrptr.eq(lastrow),
-                            bump_chrptr.eq(lastrow | self.bitmap_mode),
-                        ]
-                        m.next = "Column2"
-
-            with m.State("Column2"):
-                comb += self.padr.eq(2)
-                with m.If(~self.den):
-                    m.next = "WaitHS"
-                with m.Else():
-                    with m.If(reveal_ctr_z):
-                        comb += [
-                            bump_atrptr.eq(lastrow),
-                            bump_chrptr.eq(lastrow | self.bitmap_mode),
-                        ]
-                        m.next = "Column3"
-
-            with m.State("Column3"):
-                comb += self.padr.eq(3)
-                with m.If(~self.den):
-                    m.next = "WaitHS"
-                with m.Else():
-                    with m.If(reveal_ctr_z):
-                        m.next = "Column0"
-                        comb += [
-                            bump_atrptr.eq(lastrow),
-                            bump_chrptr.eq(lastrow | self.bitmap_mode),
-                            self.go_prefetch.eq(1),
-                            self.swap_strip.eq(1),
-                        ]
+            for i in range(strip_width):
+                with m.State("Column{}".format(i)):
+                    comb += self.padr.eq(i)
+                    with m.If(~self.den):
+                        m.next = "WaitHS"
+                        sync += self.swap_ctr.eq(0)
+                    with m.Else():
+                        with m.If(reveal_ctr_z):
+                            comb += [
+                                bump_atrptr.eq(lastrow),
+                                bump_chrptr.eq(lastrow | self.bitmap_mode),
+                            ]
+                            if i < last:
+                                m.next = "Column{}".format(i + 1)
+                            else:
+                                m.next = "Column0"
+                                comb += [
+                                    self.go_prefetch.eq(1),
+                                    self.swap_strip.eq(1),
+                                ]
+                                if not self.line_buffer:
+                                    sync += self.swap_ctr.eq(
+                                        Cat(Const(last, col_bits), self.hct)
+                                    )
 
             if platform == 'formal':
                 comb += [
@@ -235,11 +351,9 @@ class Shifter(Elaboratable):
                     self.fv_sbsm_prefetch.eq(sbsm.ongoing("Prefetch")),
                     self.fv_sbsm_wait_den.eq(sbsm.ongoing("WaitDEN")),
                     self.fv_lpic.eq(reveal_ctr_z),
-                    self.fv_sbsm_column0.eq(sbsm.ongoing("Column0")),
-                    self.fv_sbsm_column1.eq(sbsm.ongoing("Column1")),
-                    self.fv_sbsm_column2.eq(sbsm.ongoing("Column2")),
-                    self.fv_sbsm_column3.eq(sbsm.ongoing("Column3")),
                 ]
+                for i, fv_column in enumerate(self.fv_sbsm_columns):
+                    comb += fv_column.eq(sbsm.ongoing("Column{}".format(i)))
 
         # Hi-res dot from character bitmap data.
         char_bm_dot = Signal(1)
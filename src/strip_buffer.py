@@ -1,125 +1,260 @@
 from nmigen import (
+    Array,
+    Cat,
     Elaboratable,
+    Memory,
     Module,
+    Mux,
     Signal,
 )
 
-from interfaces import create_strip_buffer_interface
+from interfaces import ROW_CACHE_BITS, create_strip_buffer_interface, strip_bits
 
 
 class StripBuffer(Elaboratable):
-    def __init__(self, platform=None):
+    """
+    Holds two strips of strip_width (4, 8, or 16) character/attribute
+    pairs: one being filled by the video fetch engine, and one being
+    displayed by the shifter.  swap exchanges them.
+
+    cwe and awe store dat_i[0:8] as the character code or attribute of
+    the pair at wadr.  With wide set, dat_i is 16 bits wide, and pwe
+    stores a whole pair fetched from a 16-bit video RAM at once, its
+    attribute in the upper byte.
+
+    With row_cache set, a block RAM remembers the pairs of the current
+    text row, indexed by column (cadr).  Writes made with record also
+    store their bytes in the row cache at cadr.  recall reloads the pair
+    at cadr from the row cache into the strip being filled, at the column
+    within the strip that cadr's low bits select; the pair lands one clock
+    later, as the block RAM is synchronous.
+
+    With line_buffer set, the video fetch engine works in a staging strip
+    of its own, and a block RAM holds two whole scanlines of pairs, ready
+    for display: one being fetched (lhalf), and one being shown (shalf).
+    lwe stores the pair at wadr, completed by the byte being written, into
+    the line buffer at column cadr.  copy starts copying the next strip of
+    the line being shown into the strip being filled, taking one clock per
+    pair; with copy_rst, it starts over at the first strip of the line.
+    copy_done is negated until the copy lands.
+
+    With strip_ram set, strips A and B are held in a small memory, one
+    half per strip, instead of discrete registers.  It has asynchronous
+    read ports for pair and sh_pair, and one write port with a write
+    enable per byte, so the external interface and its timing are
+    unchanged.  Synthesis tools map it onto distributed (LUT) RAM where
+    the part has it; the iCE40 has none, and its block RAMs can't be read
+    asynchronously, so there it is still built from flip-flops.  The
+    staging strip of the line buffer stays in registers.
+    """
+
+    def __init__(self, platform=None, wide=False, row_cache=False,
+                 line_buffer=False, strip_width=4, strip_ram=False):
         super().__init__()
-        create_strip_buffer_interface(self, platform=platform)
+        self.wide = wide
+        self.row_cache = row_cache
+        self.line_buffer = line_buffer
+        self.strip_ram = strip_ram
+        self.strip_width = strip_width
+        create_strip_buffer_interface(
+            self, platform=platform, wide=wide, strip_width=strip_width
+        )
 
     def elaborate(self, platform):
         m = Module()
         sync = m.d.sync
         comb = m.d.comb
 
+        strip_width = self.strip_width
+        col_bits = strip_bits(strip_width)
+
         # ab selects column registers A or B.
         ab = Signal(1)
-        col0a = Signal(16)
-        col1a = Signal(16)
-        col2a = Signal(16)
-        col3a = Signal(16)
-        col0b = Signal(16)
-        col1b = Signal(16)
-        col2b = Signal(16)
-        col3b = Signal(16)
 
         with m.If(self.swap):
             sync += ab.eq(~ab)
 
-        with m.If(~ab):
-            with m.If(self.padr == 0):
-                comb += self.pair.eq(col0a)
-            with m.Elif(self.padr == 1):
-                comb += self.pair.eq(col1a)
-            with m.Elif(self.padr == 2):
-                comb += self.pair.eq(col2a)
-            with m.Elif(self.padr == 3):
-                comb += self.pair.eq(col3a)
-        with m.Else():
-            with m.If(self.padr == 0):
-                comb += self.pair.eq(col0b)
-            with m.Elif(self.padr == 1):
-                comb += self.pair.eq(col1b)
-            with m.Elif(self.padr == 2):
-                comb += self.pair.eq(col2b)
-            with m.Elif(self.padr == 3):
-                comb += self.pair.eq(col3b)
-
-        with m.If(~ab):
-            with m.If(self.sh_padr == 0):
-                comb += self.sh_pair.eq(col0b)
-            with m.Elif(self.sh_padr == 1):
-                comb += self.sh_pair.eq(col1b)
-            with m.Elif(self.sh_padr == 2):
-                comb += self.sh_pair.eq(col2b)
-            with m.Elif(self.sh_padr == 3):
-                comb += self.sh_pair.eq(col3b)
-        with m.Else():
-            with m.If(self.sh_padr == 0):
-                comb += self.sh_pair.eq(col0a)
-            with m.Elif(self.sh_padr == 1):
-                comb += self.sh_pair.eq(col1a)
-            with m.Elif(self.sh_padr == 2):
-                comb += self.sh_pair.eq(col2a)
-            with m.Elif(self.sh_padr == 3):
-                comb += self.sh_pair.eq(col3a)
+        def store(cols, adr, value, lanes=slice(0, 16)):
+            # Writes value into the given byte lanes of column adr.
+            with m.Switch(adr):
+                for i, col in enumerate(cols):
+                    with m.Case(i):
+                        m.d.sync += col[lanes].eq(value)
 
-        with m.If(self.cwe):
-            with m.If(~ab):
-                with m.If(self.wadr == 0):
-                    sync += col0a[0:8].eq(self.dat_i)
-                with m.Elif(self.wadr == 1):
-                    sync += col1a[0:8].eq(self.dat_i)
-                with m.Elif(self.wadr == 2):
-                    sync += col2a[0:8].eq(self.dat_i)
+        if self.strip_ram:
+            # Strip A is the lower half of the memory, and strip B the
+            # upper; ab addresses the strip being filled.  Each write sets
+            # only the byte lanes it stores, so that a character code and
+            # an attribute written together both land.  No two writers
+            # store different columns at once.
+            strips = Memory(width=16, depth=2 * strip_width, name="strips")
+            m.submodules.strips_rd = strips_rd = strips.read_port(domain="comb")
+            m.submodules.strips_sh = strips_sh = strips.read_port(domain="comb")
+            m.submodules.strips_wr = strips_wr = strips.write_port(granularity=8)
+
+            def store_fill(adr, value, lanes=slice(0, 16)):
+                # Writes into the strip not on display.
+                m.d.comb += [
+                    strips_wr.addr.eq(Cat(adr, ab)),
+                    strips_wr.data[lanes].eq(value),
+                ]
+                for lane in range(lanes.start // 8, lanes.stop // 8):
+                    m.d.comb += strips_wr.en[lane].eq(1)
+
+            comb += strips_sh.addr.eq(Cat(self.sh_padr, ~ab))
+            comb += self.sh_pair.eq(strips_sh.data)
+        else:
+            cols_a = [Signal(16, name="col{}a".format(i)) for i in range(strip_width)]
+            cols_b = [Signal(16, name="col{}b".format(i)) for i in range(strip_width)]
+
+            def store_fill(adr, value, lanes=slice(0, 16)):
+                # Writes into the strip not on display.
+                with m.If(~ab):
+                    store(cols_a, adr, value, lanes)
                 with m.Else():
-                    sync += col3a[0:8].eq(self.dat_i)
+                    store(cols_b, adr, value, lanes)
+
+            with m.If(~ab):
+                comb += self.sh_pair.eq(Array(cols_b)[self.sh_padr])
             with m.Else():
-                with m.If(self.wadr == 0):
-                    sync += col0b[0:8].eq(self.dat_i)
-                with m.Elif(self.wadr == 1):
-                    sync += col1b[0:8].eq(self.dat_i)
-                with m.Elif(self.wadr == 2):
-                    sync += col2b[0:8].eq(self.dat_i)
+                comb += self.sh_pair.eq(Array(cols_a)[self.sh_padr])
+
+        # The video fetch engine fills the strip not on display, unless it
+        # fills the line buffer, in which case it has a staging strip.
+        if self.line_buffer:
+            stage = [
+                Signal(16, name="stage{}".format(i)) for i in range(strip_width)
+            ]
+
+            def store_vfe(adr, value, lanes=slice(0, 16)):
+                store(stage, adr, value, lanes)
+
+            comb += self.pair.eq(Array(stage)[self.padr])
+        else:
+            store_vfe = store_fill
+
+            if self.strip_ram:
+                comb += strips_rd.addr.eq(Cat(self.padr, ab))
+                comb += self.pair.eq(strips_rd.data)
+            else:
+                with m.If(~ab):
+                    comb += self.pair.eq(Array(cols_a)[self.padr])
                 with m.Else():
-                    sync += col3b[0:8].eq(self.dat_i)
+                    comb += self.pair.eq(Array(cols_b)[self.padr])
+
+        if self.row_cache:
+            cache = Memory(width=16, depth=(1 << ROW_CACHE_BITS))
+            m.submodules.cache_rd = cache_rd = cache.read_port()
+            m.submodules.cache_wr = cache_wr = cache.write_port(granularity=8)
+
+            if self.wide:
+                cache_dat = Mux(self.pwe, self.dat_i, Cat(self.dat_i[0:8], self.dat_i[0:8]))
+            else:
+                cache_dat = Cat(self.dat_i, self.dat_i)
+
+            comb += [
+                cache_wr.addr.eq(self.cadr),
+                cache_wr.data.eq(cache_dat),
+                cache_wr.en.eq(Cat(
+                    self.record & (self.cwe | self.pwe),
+                    self.record & (self.awe | self.pwe),
+                )),
+                cache_rd.addr.eq(self.cadr),
+            ]
+
+            recalled = Signal(1)
+            recall_col = Signal(col_bits)
+
+            sync += [
+                recalled.eq(self.recall),
+                recall_col.eq(self.cadr[0:col_bits]),
+            ]
+
+            with m.If(recalled):
+                store_vfe(recall_col, cache_rd.data)
+
+        with m.If(self.cwe):
+            store_vfe(self.wadr, self.dat_i[0:8], slice(0, 8))
 
         with m.If(self.awe):
-            with m.If(~ab):
-                with m.If(self.wadr == 0):
-                    sync += col0a[8:16].eq(self.dat_i)
-                with m.Elif(self.wadr == 1):
-                    sync += col1a[8:16].eq(self.dat_i)
-                with m.Elif(self.wadr == 2):
-                    sync += col2a[8:16].eq(self.dat_i)
-                with m.Else():
-                    sync += col3a[8:16].eq(self.dat_i)
+            store_vfe(self.wadr, self.dat_i[0:8], slice(8, 16))
+
+        if self.wide:
+            with m.If(self.pwe):
+                store_vfe(self.wadr, self.dat_i)
+
+        if self.line_buffer:
+            line = Memory(width=16, depth=(2 << ROW_CACHE_BITS))
+            m.submodules.line_rd = line_rd = line.read_port()
+            m.submodules.line_wr = line_wr = line.write_port()
+
+            # The byte being written completes the staged pair.
+            line_dat = Cat(self.dat_i[0:8], Array(stage)[self.wadr][8:16])
+            if self.wide:
+                line_dat = Mux(self.pwe, self.dat_i, line_dat)
+
+            comb += [
+                line_wr.addr.eq(Cat(self.cadr, self.lhalf)),
+                line_wr.data.eq(line_dat),
+                line_wr.en.eq(self.lwe),
+            ]
+
+            # Copying a strip out of the line buffer.  copy_strip counts
+            # the strips copied so far, and copy_col the pairs of the
+            # strip being copied.  Each pair is read one clock and stored
+            # the next.
+            copying = Signal(1)
+            copy_col = Signal(col_bits)
+            copy_strip = Signal(ROW_CACHE_BITS - col_bits)
+            rd_col = Signal(col_bits)
+            rd_strip = Signal(len(copy_strip))
+            copied = Signal(1)
+            copied_col = Signal(col_bits)
+
+            with m.If(self.copy):
+                comb += [
+                    rd_col.eq(0),
+                    rd_strip.eq(Mux(self.copy_rst, 0, copy_strip)),
+                ]
+                sync += [
+                    copying.eq(1),
+                    copy_col.eq(1),
+                    copy_strip.eq(rd_strip + 1),
+                ]
             with m.Else():
-                with m.If(self.wadr == 0):
-                    sync += col0b[8:16].eq(self.dat_i)
-                with m.Elif(self.wadr == 1):
-                    sync += col1b[8:16].eq(self.dat_i)
-                with m.Elif(self.wadr == 2):
-                    sync += col2b[8:16].eq(self.dat_i)
-                with m.Else():
-                    sync += col3b[8:16].eq(self.dat_i)
+                comb += [
+                    rd_col.eq(copy_col),
+                    rd_strip.eq(copy_strip - 1),
+                ]
+                with m.If(copying):
+                    sync += copy_col.eq(copy_col + 1)
+                    with m.If(copy_col == strip_width - 1):
+                        sync += copying.eq(0)
 
-        if platform == 'formal':
             comb += [
-                self.fv_col0a.eq(col0a),
-                self.fv_col1a.eq(col1a),
-                self.fv_col2a.eq(col2a),
-                self.fv_col3a.eq(col3a),
-                self.fv_col0b.eq(col0b),
-                self.fv_col1b.eq(col1b),
-                self.fv_col2b.eq(col2b),
-                self.fv_col3b.eq(col3b),
-                self.fv_ab.eq(ab),
+                line_rd.addr.eq(Cat(rd_col, rd_strip, self.shalf)),
+                self.copy_done.eq(~self.copy & ~copying & ~copied),
+            ]
+            sync += [
+                copied.eq(self.copy | copying),
+                copied_col.eq(rd_col),
             ]
 
+            with m.If(copied):
+                store_fill(copied_col, line_rd.data)
+
+        if platform == 'formal':
+            if self.strip_ram:
+                # Each column gets a read port of its own, for inspection.
+                cols_a = []
+                cols_b = []
+                for i in range(2 * strip_width):
+                    port = strips.read_port(domain="comb")
+                    m.submodules["strips_fv{}".format(i)] = port
+                    comb += port.addr.eq(i)
+                    (cols_a if i < strip_width else cols_b).append(port.data)
+            for fv_col, col in zip(self.fv_cols_a + self.fv_cols_b, cols_a + cols_b):
+                comb += fv_col.eq(col)
+            comb += self.fv_ab.eq(ab)
+
         return m
@@ -2,6 +2,7 @@ from nmigen.test.utils import FHDLTestCase
 from nmigen import (
     Elaboratable,
     Module,
+    Mux,
     Signal,
 )
 
@@ -60,6 +61,10 @@ class SyncGen(Elaboratable):
 
     - rastclken -- Raster Clock Enable.  When asserted it grants the next
       sync generator permission to count.
+
+    - xden_next -- Display Enable Next.  Asserted during the last unit
+      (dot or line) before xden rises, so a vertical sync generator tells
+      us a line ahead that the playfield is about to begin.
     """
 
     def __init__(self, **kw_args):
@@ -158,6 +163,19 @@ class SyncGen(Elaboratable):
             self.xden.eq((xdctr != 0) & ~adj),
         ]
 
+        # xdctr is reloaded at the end of the last unit of the total, and
+        # the display is enabled then, or once the total adjust has run out.
+        next_xdctr = Signal(len(xdctr))
+
+        comb += [
+            next_xdctr.eq(Mux(xclken & xtotal, self.xd, xdctr)),
+            self.xden_next.eq((next_xdctr != 0) & Mux(
+                adj,
+                adjctr == 1,
+                xclken & xtotal & (self.xta == 0),
+            )),
+        ]
+
         with m.If(self.dotclken):
             with m.If(xclken & xtotal):
                 sync += xdctr.eq(self.xd)
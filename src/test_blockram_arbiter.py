@@ -15,15 +15,25 @@ from nmigen.hdl.ast import (
     Stable,
 )
 
+from nmigen.back.pysim import Settle, Simulator
+
 from interfaces import create_blockram_arbiter_interface
 
 from blockram_arbiter import BlockRamArbiter
+from ram import RAM
+from video_fetch import VideoFetch
 
 
 class BlockRamArbiterFormal(Elaboratable):
-    def __init__(self):
+    def __init__(self, dual_port=False, deadline=False, wide=False, latency=1):
         super().__init__()
-        create_blockram_arbiter_interface(self, platform="formal", asize=16)
+        self.dual_port = dual_port
+        self.deadline = deadline
+        self.wide = wide
+        self.latency = latency
+        create_blockram_arbiter_interface(
+            self, platform="formal", asize=16, wide=wide
+        )
 
     def elaborate(self, platform):
         m = Module()
@@ -37,7 +47,10 @@ class BlockRamArbiterFormal(Elaboratable):
         z_past_valid = Signal(1, reset=0)
         sync += z_past_valid.eq(1)
 
-        dut = BlockRamArbiter(platform=platform, asize=16)
+        dut = BlockRamArbiter(
+            platform=platform, asize=16, dual_port=self.dual_port,
+            deadline=self.deadline, wide=self.wide, latency=self.latency,
+        )
         m.submodules.dut = dut
         rst = ResetSignal()
 
@@ -55,8 +68,14 @@ class BlockRamArbiterFormal(Elaboratable):
             self.mpe_stall_o.eq(dut.mpe_stall_o),
 
             self.adr_o.eq(dut.adr_o),
+            self.wadr_o.eq(dut.wadr_o),
             self.dat_o.eq(dut.dat_o),
             self.we_o.eq(dut.we_o),
+
+            self.pc_vfe.eq(dut.pc_vfe),
+            self.pc_mpe.eq(dut.pc_mpe),
+            self.pc_stall.eq(dut.pc_stall),
+            self.pc_idle.eq(dut.pc_idle),
         ]
 
         # Connect DUT inputs.  These will be driven by the formal verifier
@@ -74,9 +93,23 @@ class BlockRamArbiterFormal(Elaboratable):
             dut.mpe_stb_i.eq(self.mpe_stb_i),
             dut.mpe_we_i.eq(self.mpe_we_i),
 
+            dut.vfe_left_i.eq(self.vfe_left_i),
+            dut.vfe_slack_i.eq(self.vfe_slack_i),
+
             dut.dat_i.eq(self.dat_i),
         ]
 
+        # With wide, the RAM is addressed by words.  Byte writes enable the
+        # lane picked by the low address bit, and carry the byte on both.
+        def word(adr):
+            return adr[1:] if self.wide else adr
+
+        def lanes(adr, we):
+            return Cat(we & ~adr[0], we & adr[0]) if self.wide else we
+
+        def lanes_dat(dat):
+            return Cat(dat, dat) if self.wide else dat
+
         # As long as the video fetch engine (VFE) isn't trying to access
         # video RAM, then the Memory Port Engine (MPE) has free reign over
         # video RAM.  Otherwise, all hands on deck for the VFE.
@@ -84,36 +117,186 @@ class BlockRamArbiterFormal(Elaboratable):
             with m.If(self.mpe_cyc_i):
                 comb += [
                     Assert(self.vfe_stall_o),
-                    Assert(self.adr_o == self.mpe_adr_i),
-                    Assert(self.we_o == self.mpe_we_i),
-                    Assert(self.dat_o == self.mpe_dat_i),
+                    Assert(self.adr_o == word(self.mpe_adr_i)),
+                    Assert(self.we_o == lanes(self.mpe_adr_i, self.mpe_we_i)),
+                    Assert(self.dat_o == lanes_dat(self.mpe_dat_i)),
                 ]
 
-        with m.If(self.vfe_cyc_i):
+        # With dual_port, an MPE write shares the cycle with a VFE read:
+        # the VFE reads through the read port while the MPE writes
+        # through the write port.  With deadline, the VFE defers to an MPE
+        # strobe while it has more slack than work left.  Everything else
+        # waits for the VFE.
+        share = Signal(1)
+        if self.dual_port:
+            comb += share.eq(self.mpe_we_i & ~self.vfe_we_i)
+
+        defer = Signal(1)
+        if self.deadline:
+            comb += defer.eq(
+                self.mpe_stb_i & ~share & (self.vfe_slack_i > self.vfe_left_i)
+            )
+
+        with m.If(self.vfe_cyc_i & self.mpe_cyc_i & share):
+            comb += [
+                Assert(~self.mpe_stall_o),
+                Assert(~self.vfe_stall_o),
+                Assert(self.adr_o == word(self.vfe_adr_i)),
+                Assert(self.wadr_o == word(self.mpe_adr_i)),
+                Assert(self.we_o == lanes(self.mpe_adr_i, self.mpe_stb_i)),
+                Assert(self.dat_o == lanes_dat(self.mpe_dat_i)),
+            ]
+        with m.Elif(self.vfe_cyc_i & self.mpe_cyc_i & defer):
+            comb += [
+                Assert(~self.mpe_stall_o),
+                Assert(self.vfe_stall_o),
+                Assert(self.adr_o == word(self.mpe_adr_i)),
+                Assert(self.wadr_o == word(self.mpe_adr_i)),
+                Assert(self.we_o == lanes(self.mpe_adr_i, self.mpe_we_i)),
+                Assert(self.dat_o == lanes_dat(self.mpe_dat_i)),
+            ]
+        with m.Elif(self.vfe_cyc_i):
             comb += [
                 Assert(self.mpe_stall_o),
-                Assert(self.adr_o == self.vfe_adr_i),
-                Assert(self.we_o == self.vfe_we_i),
-                Assert(self.dat_o == self.vfe_dat_i),
+                Assert(self.adr_o == word(self.vfe_adr_i)),
+                Assert(self.wadr_o == word(self.vfe_adr_i)),
+                Assert(self.we_o == lanes(self.vfe_adr_i, self.vfe_we_i)),
+                Assert(self.dat_o == lanes_dat(self.vfe_dat_i)),
+            ]
+        with m.Else():
+            comb += Assert(self.wadr_o == self.adr_o)
+
+        # The VFE is only ever held off while it has slack to spare, and
+        # only for an access the MPE actually strobes for; not while the
+        # MPE merely holds its cycle open, waiting.
+        with m.If(self.vfe_cyc_i & self.vfe_stall_o):
+            comb += [
+                Assert(self.vfe_slack_i > self.vfe_left_i),
+                Assert(self.mpe_stb_i),
+            ]
+
+        # Block RAM is trusted to be synchronous, with a fixed read latency.
+        # Thus, the ACK for a given STB will occur latency clocks later, along
+        # with the corresponding data (if the transaction was a read).  With
+        # wide, the VFE gets the word with the addressed byte in the low lane,
+        # and the MPE gets the addressed byte.
+        latency = self.latency
+
+        def issued(sig):
+            return Past(sig, latency)
+
+        ack_valid = past_valid
+        for i in range(1, latency):
+            ack_valid = ack_valid & Past(past_valid, i)
+
+        vfe_dat = Signal(len(self.vfe_dat_o))
+        mpe_dat = Signal(len(self.mpe_dat_o))
+        if self.wide:
+            with m.If(issued(self.vfe_adr_i)[0]):
+                comb += vfe_dat.eq(Cat(self.dat_i[8:16], self.dat_i[0:8]))
+            with m.Else():
+                comb += vfe_dat.eq(self.dat_i)
+            with m.If(issued(self.mpe_adr_i)[0]):
+                comb += mpe_dat.eq(self.dat_i[8:16])
+            with m.Else():
+                comb += mpe_dat.eq(self.dat_i[0:8])
+        else:
+            comb += [
+                vfe_dat.eq(self.dat_i),
+                mpe_dat.eq(self.dat_i),
             ]
 
-        # Block RAM is trusted to be synchronous.  Thus, the ACK for a given
-        # STB will occur one clock later, along with the corresponding data
-        # (if the transaction was a read).
-        with m.If(past_valid & Past(self.vfe_cyc_i) & Past(self.vfe_stb_i)):
-            sync += [
+        with m.If(ack_valid & issued(self.vfe_cyc_i) & issued(self.vfe_stb_i) &
+                  ~issued(self.vfe_stall_o)):
+            comb += [
                 Assert(self.vfe_ack_o),
-                Assert(~self.mpe_ack_o),
-                Assert(self.vfe_dat_o == self.dat_i),
+                Assert(self.vfe_dat_o == vfe_dat),
             ]
 
-        with m.If(past_valid & ~Past(self.vfe_cyc_i) & Past(self.mpe_cyc_i) & Past(self.mpe_stb_i)):
-            sync += [
+        with m.If(ack_valid & ~issued(self.vfe_cyc_i) & issued(self.mpe_cyc_i) &
+                  issued(self.mpe_stb_i)):
+            comb += [
                 Assert(self.mpe_ack_o),
                 Assert(~self.vfe_ack_o),
-                Assert(self.mpe_dat_o == self.dat_i),
+                Assert(self.mpe_dat_o == mpe_dat),
             ]
 
+        with m.If(ack_valid & issued(self.vfe_cyc_i) & issued(self.mpe_cyc_i) &
+                  issued(self.mpe_stb_i) & issued(share)):
+            comb += Assert(self.mpe_ack_o)
+
+        with m.If(ack_valid & issued(self.vfe_cyc_i) & issued(self.mpe_cyc_i) &
+                  issued(self.mpe_stb_i) & issued(defer)):
+            comb += [
+                Assert(self.mpe_ack_o),
+                Assert(~self.vfe_ack_o),
+            ]
+
+        with m.If(ack_valid & issued(self.vfe_cyc_i) & ~issued(share) &
+                  ~issued(defer)):
+            comb += Assert(~self.mpe_ack_o)
+
+        # Nothing is acknowledged that wasn't accepted latency clocks ago.
+        with m.If(ack_valid & ~(issued(self.vfe_cyc_i) & issued(self.vfe_stb_i) &
+                                ~issued(self.vfe_stall_o))):
+            comb += Assert(~self.vfe_ack_o)
+        with m.If(ack_valid & ~(issued(self.mpe_cyc_i) & issued(self.mpe_stb_i) &
+                                ~issued(self.mpe_stall_o))):
+            comb += Assert(~self.mpe_ack_o)
+
+        # Each clock counts as a VFE access, an MPE access, or neither.  The
+        # MPE can be stalled while the VFE accesses the RAM.
+        with m.If(past_valid):
+            vfe_access = Past(self.vfe_cyc_i) & Past(self.vfe_stb_i) & ~Past(self.vfe_stall_o)
+            mpe_access = Past(self.mpe_cyc_i) & Past(self.mpe_stb_i) & ~Past(self.mpe_stall_o)
+            comb += [
+                Assert(self.pc_vfe == (Past(self.pc_vfe) + vfe_access)[0:24]),
+                Assert(self.pc_mpe == (Past(self.pc_mpe) + mpe_access)[0:24]),
+                Assert(self.pc_idle == (Past(self.pc_idle) + (~vfe_access & ~mpe_access))[0:24]),
+                Assert(self.pc_stall == (Past(self.pc_stall) +
+                       (Past(self.mpe_stb_i) & Past(self.mpe_stall_o)))[0:24]),
+            ]
+
+        if self.deadline:
+            # The slack counter starts out at zero, then either stays at
+            # zero (no deadline known) or is loaded with the clocks left
+            # to the next strip swap, and counts down one per clock.
+            with m.If(~past_valid):
+                comb += Assume(self.vfe_slack_i == 0)
+            with m.Elif(Past(self.vfe_slack_i) != 0):
+                comb += Assume(self.vfe_slack_i == Past(self.vfe_slack_i) - 1)
+
+            # The VFE only starts a fetch when a new deadline is set, and
+            # the fetch fits in one strip period.  vfe_left_i never grows
+            # while a fetch is in progress, and shrinks every clock the
+            # VFE is not stalled.  It is nonzero whenever the VFE wants
+            # the bus, but may also be nonzero while the VFE works
+            # without it, recalling pairs from its row cache.
+            # VideoFetchDeadlineFormal proves all of this of cycles_left,
+            # except where a fetch is chained on before the last one is
+            # done; VDC2 only does that with a line buffer, where the
+            # slack stays at zero.
+            with m.If(self.vfe_cyc_i):
+                comb += Assume(self.vfe_left_i != 0)
+            with m.If(past_valid & (Past(self.vfe_slack_i) == 0) &
+                      (self.vfe_slack_i != 0)):
+                comb += Assume(self.vfe_left_i <= self.vfe_slack_i)
+            with m.If(past_valid & (Past(self.vfe_slack_i) != 0)):
+                comb += Assume(self.vfe_left_i <= Past(self.vfe_left_i))
+            with m.If(past_valid & (Past(self.vfe_left_i) != 0) &
+                      ~(Past(self.vfe_cyc_i) & Past(self.vfe_stall_o))):
+                comb += Assume(self.vfe_left_i < Past(self.vfe_left_i))
+
+            # Then the VFE never falls behind its deadline, and it is
+            # always finished by the time the strips are swapped.
+            with m.If(past_valid & (Past(self.vfe_slack_i) != 0)):
+                comb += Assert(self.vfe_left_i <= self.vfe_slack_i)
+            with m.If(past_valid & (Past(self.vfe_slack_i) == 1)):
+                comb += [
+                    Assert(~self.vfe_cyc_i),
+                    Assert(self.vfe_left_i == 0),
+                ]
+
         return m
 
 
@@ -121,3 +304,283 @@ class BlockRamArbiterTestCase(FHDLTestCase):
     def test_blockram_arbiter(self):
         self.assertFormal(BlockRamArbiterFormal(), mode='bmc', depth=100)
         self.assertFormal(BlockRamArbiterFormal(), mode='prove', depth=100)
+
+    def test_blockram_arbiter_dual_port(self):
+        dut = BlockRamArbiterFormal(dual_port=True)
+        self.assertFormal(dut, mode='bmc', depth=100)
+        self.assertFormal(dut, mode='prove', depth=100)
+
+    def test_blockram_arbiter_deadline(self):
+        dut = BlockRamArbiterFormal(deadline=True)
+        self.assertFormal(dut, mode='bmc', depth=100)
+        self.assertFormal(dut, mode='prove', depth=100)
+        dut = BlockRamArbiterFormal(dual_port=True, deadline=True)
+        self.assertFormal(dut, mode='bmc', depth=100)
+        self.assertFormal(dut, mode='prove', depth=100)
+
+    def test_blockram_arbiter_wide(self):
+        dut = BlockRamArbiterFormal(dual_port=True, deadline=True, wide=True)
+        self.assertFormal(dut, mode='bmc', depth=100)
+        self.assertFormal(dut, mode='prove', depth=100)
+
+    def test_blockram_arbiter_pipelined(self):
+        dut = BlockRamArbiterFormal(dual_port=True, latency=2)
+        self.assertFormal(dut, mode='bmc', depth=100)
+        self.assertFormal(dut, mode='prove', depth=100)
+        dut = BlockRamArbiterFormal(dual_port=True, wide=True, latency=3)
+        self.assertFormal(dut, mode='bmc', depth=100)
+        self.assertFormal(dut, mode='prove', depth=100)
+
+    def test_read_during_write(self):
+        m = Module()
+        arb = m.submodules.arb = BlockRamArbiter(asize=8, dual_port=True)
+        ram = m.submodules.ram = RAM(abus_width=8)
+        ram.mem.init = list(range(256))
+
+        m.d.comb += [
+            ram.adr_i.eq(arb.adr_o),
+            ram.wadr_i.eq(arb.wadr_o),
+            ram.we_i.eq(arb.we_o),
+            ram.dat_i.eq(arb.dat_o),
+            arb.dat_i.eq(ram.dat_o),
+        ]
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+
+        def process():
+            # The VFE reads while the MPE writes, both in one cycle.
+            yield arb.vfe_cyc_i.eq(1)
+            yield arb.vfe_stb_i.eq(1)
+            yield arb.mpe_cyc_i.eq(1)
+            yield arb.mpe_stb_i.eq(1)
+            yield arb.mpe_we_i.eq(1)
+            for vfe_adr, mpe_adr, byte in ((0x10, 0x20, 0xAA), (0x30, 0x30, 0xBB)):
+                yield arb.vfe_adr_i.eq(vfe_adr)
+                yield arb.mpe_adr_i.eq(mpe_adr)
+                yield arb.mpe_dat_i.eq(byte)
+                yield
+                self.assertFalse((yield arb.mpe_stall_o))
+                self.assertFalse((yield arb.vfe_stall_o))
+            yield Settle()
+            self.assertTrue((yield arb.vfe_ack_o))
+            self.assertTrue((yield arb.mpe_ack_o))
+
+            # Reading the byte being written returns the new byte.
+            self.assertEqual((yield arb.vfe_dat_o), 0xBB)
+            yield arb.mpe_cyc_i.eq(0)
+            yield arb.mpe_stb_i.eq(0)
+            yield
+            self.assertEqual((yield ram.mem[0x20]), 0xAA)
+            self.assertEqual((yield ram.mem[0x30]), 0xBB)
+
+            # An MPE read still waits for the VFE.
+            yield arb.mpe_cyc_i.eq(1)
+            yield arb.mpe_stb_i.eq(1)
+            yield arb.mpe_we_i.eq(0)
+            yield
+            self.assertTrue((yield arb.mpe_stall_o))
+
+        sim.add_sync_process(process)
+        sim.run()
+
+
+    def test_read_during_write_wide(self):
+        m = Module()
+        arb = m.submodules.arb = BlockRamArbiter(asize=8, dual_port=True, wide=True)
+        ram = m.submodules.ram = RAM(abus_width=8, wide=True)
+        ram.mem.init = [0x1100 + i for i in range(128)]
+
+        m.d.comb += [
+            ram.adr_i.eq(arb.adr_o),
+            ram.wadr_i.eq(arb.wadr_o),
+            ram.we_i.eq(arb.we_o),
+            ram.dat_i.eq(arb.dat_o),
+            arb.dat_i.eq(ram.dat_o),
+        ]
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+
+        def process():
+            # The VFE reads a pair while the MPE writes its attribute.
+            yield arb.vfe_cyc_i.eq(1)
+            yield arb.vfe_stb_i.eq(1)
+            yield arb.mpe_cyc_i.eq(1)
+            yield arb.mpe_stb_i.eq(1)
+            yield arb.mpe_we_i.eq(1)
+            yield arb.vfe_adr_i.eq(0x30)
+            yield arb.mpe_adr_i.eq(0x31)
+            yield arb.mpe_dat_i.eq(0xBB)
+            yield
+            self.assertEqual((yield arb.we_o), 0b10)
+            yield Settle()
+
+            # Only the written lane changes.
+            self.assertEqual((yield arb.vfe_dat_o), 0xBB18)
+            yield arb.mpe_cyc_i.eq(0)
+            yield arb.mpe_stb_i.eq(0)
+            yield
+            self.assertEqual((yield ram.mem[0x18]), 0xBB18)
+
+            # An odd address presents its byte in the low lane.
+            yield arb.vfe_adr_i.eq(0x31)
+            yield
+            yield Settle()
+            self.assertEqual((yield arb.vfe_dat_o), 0x18BB)
+
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_pipelined(self):
+        # With a read latency of two, both masters keep strobing on every
+        # clock they're granted, and their acknowledgements come back two
+        # clocks later, in order, each with its own data.
+        m = Module()
+        arb = m.submodules.arb = BlockRamArbiter(asize=8, dual_port=True, latency=2)
+        ram = m.submodules.ram = RAM(abus_width=8, latency=2)
+        ram.mem.init = [i ^ 0x5A for i in range(256)]
+
+        m.d.comb += [
+            ram.adr_i.eq(arb.adr_o),
+            ram.wadr_i.eq(arb.wadr_o),
+            ram.we_i.eq(arb.we_o),
+            ram.dat_i.eq(arb.dat_o),
+            arb.dat_i.eq(ram.dat_o),
+        ]
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+
+        def process():
+            vfe_todo = [0x10, 0x11, 0x12, 0x13]
+            mpe_todo = [0x40, 0x41, 0x42]
+            vfe_issued = []
+            mpe_issued = []
+            vfe_got = []
+            mpe_got = []
+            for clock in range(12):
+                yield arb.vfe_cyc_i.eq(len(vfe_got) != 4)
+                yield arb.vfe_stb_i.eq(len(vfe_todo) != 0)
+                yield arb.vfe_adr_i.eq(vfe_todo[0] if vfe_todo else 0)
+                yield arb.mpe_cyc_i.eq(len(mpe_got) != 3)
+                yield arb.mpe_stb_i.eq(len(mpe_todo) != 0)
+                yield arb.mpe_adr_i.eq(mpe_todo[0] if mpe_todo else 0)
+                yield Settle()
+                if (yield arb.vfe_ack_o):
+                    vfe_got.append(((yield arb.vfe_dat_o), clock))
+                if (yield arb.mpe_ack_o):
+                    mpe_got.append(((yield arb.mpe_dat_o), clock))
+                if vfe_todo and not (yield arb.vfe_stall_o):
+                    vfe_issued.append(clock)
+                    vfe_todo.pop(0)
+                elif mpe_todo and not (yield arb.mpe_stall_o):
+                    mpe_issued.append(clock)
+                    mpe_todo.pop(0)
+                yield
+
+            # The VFE streams its four reads back to back.  The MPE waits
+            # until the VFE has collected its last byte and released the
+            # bus, then streams its own.
+            self.assertEqual(vfe_issued, [0, 1, 2, 3])
+            self.assertEqual(mpe_issued, [6, 7, 8])
+            self.assertEqual(vfe_got, [
+                (adr ^ 0x5A, clock + 2)
+                for adr, clock in zip((0x10, 0x11, 0x12, 0x13), vfe_issued)
+            ])
+            self.assertEqual(mpe_got, [
+                (adr ^ 0x5A, clock + 2)
+                for adr, clock in zip((0x40, 0x41, 0x42), mpe_issued)
+            ])
+
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_deadline(self):
+        for hct, attr_enable, bitmap_mode, latency in (
+            (7, 1, 0, 1), (3, 1, 0, 1), (3, 0, 1, 1), (15, 1, 0, 1),
+            (7, 1, 0, 2), (3, 0, 0, 2),
+        ):
+            with self.subTest(hct=hct, attr_enable=attr_enable,
+                              bitmap_mode=bitmap_mode, latency=latency):
+                self.deadline_run(hct, attr_enable, bitmap_mode, latency)
+
+    def test_deadline_mpe_waiting(self):
+        # An MPE holding its cycle open while it waits, without strobing,
+        # doesn't hold the VFE off.
+        self.deadline_run(7, 1, 0, mpe_strobes=False)
+
+    def deadline_run(self, hct, attr_enable, bitmap_mode, latency=1,
+                     mpe_strobes=True):
+        m = Module()
+        arb = m.submodules.arb = BlockRamArbiter(
+            asize=8, deadline=True, latency=latency
+        )
+        ram = m.submodules.ram = RAM(abus_width=8, latency=latency)
+        vfe = m.submodules.vfe = VideoFetch(latency=latency)
+
+        m.d.comb += [
+            ram.adr_i.eq(arb.adr_o),
+            ram.wadr_i.eq(arb.wadr_o),
+            ram.we_i.eq(arb.we_o),
+            ram.dat_i.eq(arb.dat_o),
+            arb.dat_i.eq(ram.dat_o),
+
+            arb.vfe_adr_i.eq(vfe.adr_o),
+            arb.vfe_cyc_i.eq(vfe.cyc_o),
+            arb.vfe_stb_i.eq(vfe.stb_o),
+            arb.vfe_left_i.eq(vfe.cycles_left),
+            vfe.ack_i.eq(arb.vfe_ack_o),
+            vfe.stall_i.eq(arb.vfe_stall_o),
+
+            # The MPE wants the bus all the time, or holds it while it
+            # waits, without strobing.
+            arb.mpe_cyc_i.eq(1),
+            arb.mpe_stb_i.eq(mpe_strobes),
+        ]
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        period = 4 * (hct + 1)
+        fetches = 4 * (1 + attr_enable + (1 - bitmap_mode))
+        needed = fetches + latency + (1 - bitmap_mode) * latency
+
+        def process():
+            yield vfe.attr_enable.eq(attr_enable)
+            yield vfe.bitmap_mode.eq(bitmap_mode)
+            for strip in range(4):
+                # Strip swap: kick off the next fetch.  The slack counter
+                # reads zero on this cycle, like the shifter's.
+                yield vfe.go_i.eq(1)
+                yield arb.vfe_slack_i.eq(0)
+                yield
+                yield vfe.go_i.eq(0)
+                writes = 0
+                lent = 0
+                left = needed
+                for slack in range(period - 1, 0, -1):
+                    yield arb.vfe_slack_i.eq(slack)
+                    yield Settle()
+                    self.assertLessEqual((yield vfe.cycles_left), slack)
+                    self.assertLessEqual((yield vfe.cycles_left), left)
+                    left = yield vfe.cycles_left
+                    writes += (yield vfe.awe) + (yield vfe.cwe)
+                    if (yield vfe.cyc_o) and (yield arb.mpe_ack_o):
+                        lent += 1
+                    if (yield vfe.cyc_o) and not mpe_strobes:
+                        self.assertFalse((yield arb.vfe_stall_o))
+                    yield
+
+                # The fetch is complete by the time of the next swap.
+                yield arb.vfe_slack_i.eq(0)
+                yield Settle()
+                self.assertFalse((yield vfe.cyc_o))
+                self.assertEqual((yield vfe.cycles_left), 0)
+                self.assertEqual(writes, fetches)
+
+                # The MPE only gets in while the VFE is busy when the
+                # strip period leaves room to spare.
+                self.assertEqual(lent > 0, mpe_strobes and period - 1 > needed)
+
+        sim.add_sync_process(process)
+        sim.run()
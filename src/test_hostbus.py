@@ -1,5 +1,5 @@
 from nmigen.test.utils import FHDLTestCase
-from nmigen.back.pysim import Simulator
+from nmigen.back.pysim import Delay, Passive, Settle, Simulator
 
 from nmigen import (
     Elaboratable,
@@ -21,8 +21,10 @@ from hostbus import HostBus
 
 
 class HostBusFormal(Elaboratable):
-    def __init__(self):
+    def __init__(self, sync_stages=2, early_writes=False):
         super().__init__()
+        self.sync_stages = sync_stages
+        self.early_writes = early_writes
         create_hostbus_interface(self, platform="formal")
 
     def elaborate(self, platform=''):
@@ -37,7 +39,11 @@ class HostBusFormal(Elaboratable):
         z_past_valid = Signal(1, reset=0)
         sync += z_past_valid.eq(1)
 
-        dut = HostBus(platform=platform)
+        dut = HostBus(
+            platform=platform,
+            sync_stages=self.sync_stages,
+            early_writes=self.early_writes,
+        )
         m.submodules.dut = dut
         rst = ResetSignal()
 
@@ -48,6 +54,7 @@ class HostBusFormal(Elaboratable):
         comb += [
             self.q.eq(dut.q),
             self.qoe.eq(dut.qoe),
+            self.wait.eq(dut.wait),
             self.adr_o.eq(dut.adr_o),
             self.we_o.eq(dut.we_o),
             self.rd_o.eq(dut.rd_o),
@@ -55,6 +62,9 @@ class HostBusFormal(Elaboratable):
             self.fv_old_cssync.eq(dut.fv_old_cssync),
             self.fv_cssync.eq(dut.fv_cssync),
             self.fv_rdsync.eq(dut.fv_rdsync),
+            self.fv_old_rdsync.eq(dut.fv_old_rdsync),
+            self.fv_wdone.eq(dut.fv_wdone),
+            self.fv_autoinc.eq(dut.fv_autoinc),
             self.fv_we_ports.eq(dut.fv_we_ports),
             self.fv_rd_ports.eq(dut.fv_rd_ports),
             self.fv_async.eq(dut.fv_async),
@@ -69,6 +79,7 @@ class HostBusFormal(Elaboratable):
             dut.rd.eq(self.rd),
             dut.a.eq(self.a),
             dut.ready_i.eq(self.ready_i),
+            dut.stale_i.eq(self.stale_i),
             dut.vblank_i.eq(self.vblank_i),
             dut.lp_i.eq(self.lp_i),
             dut.dat_i.eq(self.dat_i),
@@ -86,12 +97,48 @@ class HostBusFormal(Elaboratable):
         with m.If(~self.rd):
             comb += Assert(~self.qoe)
 
-        # I/O port write enable pulses only when a write cycle concludes.
-        with m.If(~self.fv_old_cssync & self.fv_cssync & ~self.fv_rdsync):
-            comb += Assert(self.fv_we_ports)
-
-        with m.If(~self.fv_old_cssync & ~self.fv_cssync & ~self.fv_rdsync):
-            comb += Assert(~self.fv_we_ports)
+        # Host cycles to the data port are stretched for as long as the
+        # register set is not ready, and reads of R31 for as long as the
+        # CPU Data register is stale; nothing else ever waits.
+        comb += Assert(self.wait == (self.cs & self.a & (
+            ~self.ready_i |
+            (self.rd & (self.adr_o == 31) & self.stale_i)
+        )))
+
+        # I/O port write enable pulses only when a write cycle concludes,
+        # or, with early writes, once per cycle as soon as it is known not
+        # to be a read, and data port writes are ready to be taken.  A
+        # write not taken early is taken when the cycle concludes.
+        if self.early_writes:
+            with m.If(self.fv_old_cssync & self.fv_cssync &
+                      ~self.fv_old_rdsync & ~self.fv_rdsync & ~self.fv_wdone &
+                      (self.ready_i | ~self.fv_async)):
+                comb += Assert(self.fv_we_ports)
+
+            with m.If(~self.fv_old_cssync & self.fv_cssync &
+                      ~self.fv_rdsync & ~self.fv_wdone):
+                comb += Assert(self.fv_we_ports)
+
+            with m.If(~self.fv_cssync | self.fv_wdone |
+                      (self.fv_old_cssync & self.fv_old_rdsync)):
+                comb += Assert(~self.fv_we_ports)
+
+            with m.If(self.fv_old_cssync & self.fv_async & ~self.ready_i):
+                comb += Assert(~self.fv_we_ports)
+
+            with m.If(past_valid & Past(self.fv_we_ports)):
+                sync += Assert(self.fv_wdone)
+
+            with m.If(past_valid & ~Past(self.fv_cssync)):
+                sync += Assert(~self.fv_wdone)
+        else:
+            with m.If(~self.fv_old_cssync & self.fv_cssync & ~self.fv_rdsync):
+                comb += Assert(self.fv_we_ports)
+
+            with m.If(~self.fv_old_cssync & ~self.fv_cssync & ~self.fv_rdsync):
+                comb += Assert(~self.fv_we_ports)
+
+            comb += Assert(~self.fv_wdone)
 
         with m.If(self.fv_rdsync):
             comb += Assert(~self.fv_we_ports)
@@ -115,8 +162,26 @@ class HostBusFormal(Elaboratable):
             sync += Assert(~self.fv_rd_ports)
 
         # Register Select port must take on a new value when written.
+        # Bit 7 of the value written enables auto-increment.
         with m.If(past_valid & Past(self.fv_we_ports) & ~Past(self.fv_async)):
-            sync += Assert(self.adr_o == Past(self.fv_dsync)[0:6])
+            sync += [
+                Assert(self.adr_o == Past(self.fv_dsync)[0:6]),
+                Assert(self.fv_autoinc == Past(self.fv_dsync)[7]),
+            ]
+
+        # In auto-increment mode, every data port write moves on to the
+        # next register.  Otherwise, the register select stays put.
+        with m.If(past_valid & Past(self.we_o)):
+            with m.If(Past(self.fv_autoinc)):
+                sync += Assert(self.adr_o == (Past(self.adr_o) + 1)[0:6])
+            with m.Else():
+                sync += Assert(Stable(self.adr_o))
+
+        with m.If(past_valid & ~Past(self.fv_we_ports)):
+            sync += [
+                Assert(Stable(self.adr_o)),
+                Assert(Stable(self.fv_autoinc)),
+            ]
 
         # The register set write enable pulse should only assert when
         # the host processor is writing to the data port.
@@ -162,6 +227,12 @@ class HostBusTestCase(FHDLTestCase):
         self.assertFormal(HostBusFormal(), mode='bmc', depth=100)
         self.assertFormal(HostBusFormal(), mode='prove', depth=100)
 
+    def test_hostbus_early_writes(self):
+        for sync_stages in (1, 2):
+            dut = HostBusFormal(sync_stages=sync_stages, early_writes=True)
+            self.assertFormal(dut, mode='bmc', depth=100)
+            self.assertFormal(dut, mode='prove', depth=100)
+
     def write_addr_port(self, m, byte):
         yield m.a.eq(0)
         yield m.cs.eq(1)
@@ -269,3 +340,334 @@ class HostBusTestCase(FHDLTestCase):
 
             sim.add_sync_process(process)
             sim.run()
+
+    def z80_io(self, m, port, byte=None, mhz=12):
+        """
+        Performs one Z80 I/O cycle (T1, T2, automatic wait state, T3)
+        against port 0 (status/register select) or 1 (data), writing
+        byte if given, or else reading and returning the byte the Z80
+        would latch.  I/O cycles are spaced seven T-states apart, as for
+        back to back OUT (C),r instructions.  If m has a wait signal, it is
+        sampled on the falling edge of each wait state, as the Z80 does.
+        """
+        t = 1e-6 / mhz
+        # T1: the address is valid on the rising edge, write data half a
+        # T-state later.
+        yield m.a.eq(port)
+        yield Delay(t / 2)
+        if byte is not None:
+            yield m.db.eq(byte)
+        yield Delay(t / 2)
+
+        # T2: IORQ, and RD for reads, assert on the rising edge and stay
+        # asserted through the wait state, until T3's falling edge.
+        yield m.cs.eq(1)
+        yield m.rd.eq(byte is None)
+        yield Delay(t * 1.5)
+        while (yield getattr(m, "wait", Const(0))):
+            yield Delay(t)
+        yield Delay(t)
+        yield Settle()
+        if byte is None:
+            self.assertEqual((yield m.qoe), 1)
+            result = yield m.q
+        else:
+            result = None
+        yield m.cs.eq(0)
+        yield m.rd.eq(0)
+        yield Delay(t / 2)
+
+        # The rest of the next instruction.
+        yield Delay(t * 7)
+        return result
+
+    def test_z80_timing(self):
+        from regset8bit import RegSet8Bit
+
+        cases = [
+            # mhz, sync_stages, early_writes
+            (8, 2, False),
+            (10, 2, True),
+            (12, 2, True),
+            (12, 1, True),
+            (12, 1, False),
+        ]
+        for mhz, sync_stages, early_writes in cases:
+            with self.subTest(mhz=mhz, sync_stages=sync_stages,
+                              early_writes=early_writes):
+                m = Module()
+
+                m.a = Signal(1)
+                m.db = Signal(8)
+                m.cs = Signal(1)
+                m.rd = Signal(1)
+                m.q = Signal(8)
+                m.qoe = Signal(1)
+
+                hb = m.submodules.hb = HostBus(
+                    sync_stages=sync_stages, early_writes=early_writes,
+                )
+                rs = m.submodules.rs = RegSet8Bit()
+
+                m.d.comb += [
+                    hb.a.eq(m.a),
+                    hb.d.eq(m.db),
+                    hb.cs.eq(m.cs),
+                    hb.rd.eq(m.rd),
+                    hb.ready_i.eq(1),
+
+                    m.q.eq(hb.q),
+                    m.qoe.eq(hb.qoe),
+
+                    rs.dat_i.eq(hb.dat_o),
+                    rs.adr_i.eq(hb.adr_o),
+                    rs.we_i.eq(hb.we_o),
+                    rs.rd_i.eq(hb.rd_o),
+                    hb.dat_i.eq(rs.dat_o),
+                ]
+
+                writes = [(12, 0x12), (13, 0x34), (20, 0x56), (21, 0x78),
+                          (26, 0x9A), (47, 0x03)]
+                early = []
+                done = []
+
+                sim = Simulator(m)
+                sim.add_clock(1 / 25.145e6)
+
+                def z80():
+                    yield Delay(1e-6)
+                    for reg, byte in writes:
+                        yield from self.z80_io(m, 0, reg, mhz=mhz)
+                        yield from self.z80_io(m, 1, byte, mhz=mhz)
+                    for reg, byte in writes:
+                        yield from self.z80_io(m, 0, reg, mhz=mhz)
+                        got = yield from self.z80_io(m, 1, mhz=mhz)
+                        self.assertEqual(got, byte, "R{}".format(reg))
+                    status = yield from self.z80_io(m, 0, mhz=mhz)
+                    self.assertEqual(status & 0x87, 0x80 | VDC_VERSION)
+                    done.append(True)
+
+                def monitor():
+                    # Note writes which land while the host cycle that
+                    # made them is still in progress.
+                    yield Passive()
+                    while True:
+                        yield
+                        if (yield hb.we_o) and (yield m.cs):
+                            early.append(True)
+
+                sim.add_process(z80)
+                sim.add_sync_process(monitor)
+                sim.run()
+
+                self.assertEqual(done, [True])
+
+                # Early writes complete during the host cycle itself.
+                if early_writes:
+                    self.assertEqual(len(early), len(writes))
+                else:
+                    self.assertEqual(early, [])
+
+    def mpe_system(self, early_writes=True):
+        """
+        A host bus in front of an MPESystem, with the Z80's WAIT input
+        wired up.
+        """
+        from test_mpe import MPESystem
+
+        m = Module()
+
+        m.a = Signal(1)
+        m.db = Signal(8)
+        m.cs = Signal(1)
+        m.rd = Signal(1)
+        m.q = Signal(8)
+        m.qoe = Signal(1)
+        m.wait = Signal(1)
+
+        hb = m.submodules.hb = HostBus(early_writes=early_writes)
+        s = m.submodules.s = MPESystem()
+
+        m.d.comb += [
+            hb.a.eq(m.a),
+            hb.d.eq(m.db),
+            hb.cs.eq(m.cs),
+            hb.rd.eq(m.rd),
+            hb.ready_i.eq(s.mpe.ready),
+            hb.stale_i.eq(s.mpe.cpudatar_stale),
+
+            m.q.eq(hb.q),
+            m.qoe.eq(hb.qoe),
+            m.wait.eq(hb.wait),
+
+            s.regset.dat_i.eq(hb.dat_o),
+            s.regset.adr_i.eq(hb.adr_o),
+            s.regset.we_i.eq(hb.we_o),
+            s.regset.rd_i.eq(hb.rd_o),
+            hb.dat_i.eq(s.regset.dat_o),
+        ]
+        return m, hb, s
+
+    def test_read_after_posted_writes(self):
+        # INIR right after OTIR: the reads must wait for the posted writes
+        # to drain and the CPU Data register to be refetched, even though
+        # the MPE stays ready all along.
+        m, hb, s = self.mpe_system()
+        s.vram.mem.init = [0] * 0x43 + [0x30 + i for i in range(8)]
+
+        done = []
+        holding = []
+
+        sim = Simulator(m)
+        sim.add_clock(1 / 25.145e6)
+
+        def vfe():
+            # Keep the MPE off video memory from the first write until the
+            # reads begin, so the writes are still queued when the first
+            # read arrives.
+            yield Passive()
+            while True:
+                yield s.vfe_busy.eq(len(holding) == 1)
+                yield
+
+        def z80():
+            yield Delay(1e-6)
+            yield from self.z80_io(m, 0, 18)
+            yield from self.z80_io(m, 1, 0x00)
+            yield from self.z80_io(m, 0, 19)
+            yield from self.z80_io(m, 1, 0x40)
+
+            yield from self.z80_io(m, 0, 31)
+            while not ((yield from self.z80_io(m, 0)) & 0x80):
+                pass
+            holding.append(True)
+            for i in range(3):
+                yield from self.z80_io(m, 1, 0x80 + i)
+            holding.append(False)
+            got = []
+            for i in range(8):
+                got.append((yield from self.z80_io(m, 1)))
+            self.assertEqual(got, [0x30 + i for i in range(8)])
+            for i in range(3):
+                self.assertEqual((yield s.vram.mem[0x40 + i]), 0x80 + i)
+            done.append(True)
+
+        sim.add_sync_process(vfe)
+        sim.add_process(z80)
+        sim.run()
+        self.assertEqual(done, [True])
+
+    def test_write_queue_overflow(self):
+        # OTIR into R31 while the VFE holds video memory: the write queue
+        # fills, and the rest of the bytes must wait for WAIT to release
+        # rather than being dropped.
+        for early_writes in (False, True):
+            with self.subTest(early_writes=early_writes):
+                m, hb, s = self.mpe_system(early_writes=early_writes)
+                s.vram.mem.init = [0] * 256
+
+                done = []
+                holding = []
+
+                sim = Simulator(m)
+                sim.add_clock(1 / 25.145e6)
+
+                def vfe():
+                    yield Passive()
+                    while not holding:
+                        yield
+                    yield s.vfe_busy.eq(1)
+                    for _ in range(400):
+                        yield
+                    yield s.vfe_busy.eq(0)
+
+                def z80():
+                    yield Delay(1e-6)
+                    yield from self.z80_io(m, 0, 18)
+                    yield from self.z80_io(m, 1, 0x00)
+                    yield from self.z80_io(m, 0, 19)
+                    yield from self.z80_io(m, 1, 0x40)
+
+                    yield from self.z80_io(m, 0, 31)
+                    while not ((yield from self.z80_io(m, 0)) & 0x80):
+                        pass
+                    holding.append(True)
+                    for i in range(8):
+                        yield from self.z80_io(m, 1, 0x80 + i)
+                    while not ((yield from self.z80_io(m, 0)) & 0x80):
+                        pass
+                    yield Delay(1e-6)
+                    got = []
+                    for i in range(9):
+                        got.append((yield s.vram.mem[0x40 + i]))
+                    self.assertEqual(got, [0x80 + i for i in range(8)] + [0])
+                    self.assertEqual((yield s.regset.update_location), 0x48)
+                    done.append(True)
+
+                sim.add_sync_process(vfe)
+                sim.add_process(z80)
+                sim.run()
+                self.assertEqual(done, [True])
+
+    def test_autoincrement(self):
+        from regset8bit import RegSet8Bit
+
+        m = Module()
+
+        m.a = Signal(1)
+        m.db = Signal(8)
+        m.cs = Signal(1)
+        m.rd = Signal(1)
+        m.q = Signal(8)
+        m.qoe = Signal(1)
+
+        hb = m.submodules.hb = HostBus(early_writes=True)
+        rs = m.submodules.rs = RegSet8Bit()
+
+        m.d.comb += [
+            hb.a.eq(m.a),
+            hb.d.eq(m.db),
+            hb.cs.eq(m.cs),
+            hb.rd.eq(m.rd),
+            hb.ready_i.eq(1),
+
+            m.q.eq(hb.q),
+            m.qoe.eq(hb.qoe),
+
+            rs.dat_i.eq(hb.dat_o),
+            rs.adr_i.eq(hb.adr_o),
+            rs.we_i.eq(hb.we_o),
+            rs.rd_i.eq(hb.rd_o),
+            hb.dat_i.eq(rs.dat_o),
+        ]
+
+        table = [0x0C, 0x00, 0x78]
+        done = []
+
+        sim = Simulator(m)
+        sim.add_clock(1 / 25.145e6)
+
+        def z80():
+            yield Delay(1e-6)
+            # One register select, then a stream of data bytes for R20
+            # through R22, as OTIR would send them.
+            yield from self.z80_io(m, 0, 0x80 | 20)
+            for byte in table:
+                yield from self.z80_io(m, 1, byte)
+
+            # Reads don't advance the register select.
+            yield from self.z80_io(m, 1)
+            self.assertEqual((yield hb.adr_o), 23)
+
+            # Selecting a register without bit 7 turns the mode off.
+            for i, byte in enumerate(table):
+                yield from self.z80_io(m, 0, 20 + i)
+                got = yield from self.z80_io(m, 1)
+                self.assertEqual(got, byte, "R{}".format(20 + i))
+                self.assertEqual((yield hb.adr_o), 20 + i)
+            done.append(True)
+
+        sim.add_process(z80)
+        sim.run()
+        self.assertEqual(done, [True])
+
@@ -1,4 +1,5 @@
 from nmigen.test.utils import FHDLTestCase
+from nmigen.back.pysim import Passive, Settle, Simulator
 from nmigen import (
     Cat,
     Const,
@@ -16,9 +17,26 @@ from nmigen.hdl.ast import (
 )
 
 
-from interfaces import create_mpe_interface
+from interfaces import (
+    DESC_SIZE,
+    ROP_AND,
+    ROP_OR,
+    ROP_SRC,
+    ROP_XOR,
+    INT_MPE,
+    PC_IDLE,
+    PC_MPE_GRANTS,
+    PC_MPE_OPS,
+    PC_MPE_STALLS,
+    PC_VFE_GRANTS,
+    create_mpe_interface,
+)
 
+from blockram_arbiter import BlockRamArbiter
 from mpe import MPE
+from ram import RAM
+from regset8bit import RegSet8Bit
+from write_queue import WriteQueue
 
 
 class MPEFormal(Elaboratable):
@@ -48,10 +66,22 @@ class MPEFormal(Elaboratable):
         # Connect DUT outputs
         comb += [
             self.ready.eq(dut.ready),
+            self.idle.eq(dut.idle),
             self.cpudatar.eq(dut.cpudatar),
             self.incr_updloc.eq(dut.incr_updloc),
             self.incr_copysrc.eq(dut.incr_copysrc),
+            self.decr_updloc.eq(dut.decr_updloc),
+            self.decr_copysrc.eq(dut.decr_copysrc),
             self.decr_bytecnt.eq(dut.decr_bytecnt),
+            self.next_row.eq(dut.next_row),
+            self.ld_desc.eq(dut.ld_desc),
+            self.desc_dst.eq(dut.desc_dst),
+            self.desc_src.eq(dut.desc_src),
+            self.desc_len.eq(dut.desc_len),
+            self.list_done.eq(dut.list_done),
+
+            self.wq_pop.eq(dut.wq_pop),
+            self.cpudatar_stale.eq(dut.cpudatar_stale),
 
             self.mem_cyc_o.eq(dut.mem_cyc_o),
             self.mem_stb_o.eq(dut.mem_stb_o),
@@ -59,6 +89,21 @@ class MPEFormal(Elaboratable):
             self.mem_we_o.eq(dut.mem_we_o),
             self.mem_dat_o.eq(dut.mem_dat_o),
 
+            self.fv_idle.eq(dut.fv_idle),
+            self.fv_pend_prefetch.eq(dut.fv_pend_prefetch),
+            self.fv_pend_block.eq(dut.fv_pend_block),
+            self.fv_stale.eq(dut.fv_stale),
+            self.fv_refreshing.eq(dut.fv_refreshing),
+            self.fv_ra_adr.eq(dut.fv_ra_adr),
+            self.fv_ra_stride.eq(dut.fv_ra_stride),
+            self.fv_plane.eq(dut.fv_plane),
+            self.fv_store_off.eq(dut.fv_store_off),
+            self.fv_store_last.eq(dut.fv_store_last),
+            self.fv_ra_count.eq(dut.fv_ra_count),
+            self.fv_ra_head.eq(dut.fv_ra_head),
+            self.fv_ra_hit.eq(dut.fv_ra_hit),
+            self.fv_readahead_0.eq(dut.fv_readahead_0),
+            self.fv_readahead_1.eq(dut.fv_readahead_1),
             self.fv_prefetch_0.eq(dut.fv_prefetch_0),
             self.fv_prefetch_1.eq(dut.fv_prefetch_1),
             self.fv_store_0.eq(dut.fv_store_0),
@@ -67,6 +112,13 @@ class MPEFormal(Elaboratable):
             self.fv_block_1.eq(dut.fv_block_1),
             self.fv_block_2.eq(dut.fv_block_2),
             self.fv_block_3.eq(dut.fv_block_3),
+            self.fv_block_4.eq(dut.fv_block_4),
+            self.fv_block_5.eq(dut.fv_block_5),
+            self.fv_list_0.eq(dut.fv_list_0),
+            self.fv_list_1.eq(dut.fv_list_1),
+            self.fv_list_2.eq(dut.fv_list_2),
+            self.fv_listing.eq(dut.fv_listing),
+            self.fv_pend_list.eq(dut.fv_pend_list),
         ]
 
         # Connect DUT inputs.  These will be driven by the formal verifier
@@ -78,13 +130,32 @@ class MPEFormal(Elaboratable):
 
             dut.go_wr_updloc.eq(self.go_wr_updloc),
             dut.go_rd_cpudatar.eq(self.go_rd_cpudatar),
-            dut.go_wr_cpudataw.eq(self.go_wr_cpudataw),
             dut.go_wr_bytecnt.eq(self.go_wr_bytecnt),
+            dut.go_wr_listptr.eq(self.go_wr_listptr),
             dut.update_location.eq(self.update_location),
             dut.cpudataw.eq(self.cpudataw),
             dut.block_copy.eq(self.block_copy),
             dut.copysrc.eq(self.copysrc),
             dut.bytecnt.eq(self.bytecnt),
+            dut.rows.eq(self.rows),
+            dut.rop.eq(self.rop),
+            dut.wrmask.eq(self.wrmask),
+            dut.descending.eq(self.descending),
+            dut.stride.eq(self.stride),
+            dut.dualplane.eq(self.dualplane),
+            dut.attrfill.eq(self.attrfill),
+            dut.chrbase.eq(self.chrbase),
+            dut.atrbase.eq(self.atrbase),
+            dut.listptr.eq(self.listptr),
+
+            dut.wq_adr.eq(self.wq_adr),
+            dut.wq_dat.eq(self.wq_dat),
+            dut.wq_stride.eq(self.wq_stride),
+            dut.wq_repeat.eq(self.wq_repeat),
+            dut.wq_dual.eq(self.wq_dual),
+            dut.wq_attr.eq(self.wq_attr),
+            dut.wq_empty.eq(self.wq_empty),
+            dut.wq_full.eq(self.wq_full),
         ]
 
         # Establish some interface assumptions.
@@ -96,30 +167,109 @@ class MPEFormal(Elaboratable):
         with m.If(self.go_wr_updloc):
             comb += [
                 Assume(~self.go_rd_cpudatar),
-                Assume(~self.go_wr_cpudataw),
                 Assume(~self.go_wr_bytecnt),
+                Assume(~self.go_wr_listptr),
             ]
 
         with m.If(self.go_rd_cpudatar):
             comb += [
                 Assume(~self.go_wr_updloc),
-                Assume(~self.go_wr_cpudataw),
                 Assume(~self.go_wr_bytecnt),
+                Assume(~self.go_wr_listptr),
             ]
 
-        with m.If(self.go_wr_cpudataw):
+        with m.If(self.go_wr_bytecnt):
+            comb += [
+                Assume(~self.go_wr_updloc),
+                Assume(~self.go_rd_cpudatar),
+                Assume(~self.go_wr_listptr),
+            ]
+
+        with m.If(self.go_wr_listptr):
             comb += [
                 Assume(~self.go_wr_updloc),
                 Assume(~self.go_rd_cpudatar),
                 Assume(~self.go_wr_bytecnt),
             ]
 
-        with m.If(self.go_wr_bytecnt):
+        # The host waits for the MPE to report ready before issuing
+        # another command.
+        with m.If(~self.ready):
             comb += [
                 Assume(~self.go_wr_updloc),
                 Assume(~self.go_rd_cpudatar),
-                Assume(~self.go_wr_cpudataw),
+                Assume(~self.go_wr_bytecnt),
+                Assume(~self.go_wr_listptr),
+            ]
+
+        # Writes to R31 are posted to a write queue, which the MPE drains
+        # whenever it is otherwise idle.  Commands which arrive while the
+        # queue is still draining are remembered, and carried out once
+        # the queue is empty.  The host is told the MPE is not ready while
+        # any such command is outstanding, or while the queue is full.
+        #
+        # The queue holds on to the byte being stored until the MPE pops it.
+        with m.If(self.fv_store_0):
+            comb += Assume(~self.wq_empty)
+        with m.If(past_valid & Past(self.fv_store_0) & ~Past(self.wq_pop)):
+            comb += [
+                Assume(Stable(self.wq_adr)),
+                Assume(Stable(self.wq_dat)),
+                Assume(Stable(self.wq_stride)),
+                Assume(Stable(self.wq_repeat)),
+                Assume(Stable(self.wq_dual)),
+                Assume(Stable(self.wq_attr)),
+            ]
+
+        idle_now = Signal(1)
+        comb += idle_now.eq(self.fv_idle & self.wq_empty)
+
+        # Idle means nothing is left in the queue and no command is
+        # outstanding, and sitting in IDLE with nothing to do is idle.
+        no_pend = Signal(1)
+        comb += no_pend.eq(
+            ~self.fv_pend_prefetch & ~self.fv_pend_block & ~self.fv_pend_list
+        )
+        with m.If(self.idle):
+            comb += [
+                Assert(self.wq_empty),
+                Assert(no_pend),
+            ]
+        with m.If(idle_now & no_pend):
+            comb += Assert(self.idle)
+
+        # Block operations step the pointers up, or down if descending
+        # (R43 bit 3) is set; never both ways at once.
+        step_updloc = Signal(1)
+        step_copysrc = Signal(1)
+        comb += [
+            step_updloc.eq(self.incr_updloc | self.decr_updloc),
+            step_copysrc.eq(self.incr_copysrc | self.decr_copysrc),
+        ]
+
+        with m.If(self.descending & ~self.fv_listing):
+            comb += [
+                Assert(~self.incr_updloc),
+                Assert(~self.incr_copysrc),
             ]
+        with m.Elif(~self.fv_listing):
+            comb += [
+                Assert(~self.decr_updloc),
+                Assert(~self.decr_copysrc),
+            ]
+
+        with m.If(self.fv_pend_prefetch | self.fv_pend_block | self.fv_pend_list | self.wq_full):
+            comb += Assert(~self.ready)
+
+        with m.If(self.fv_idle):
+            comb += Assert(~self.mem_cyc_o)
+
+        with m.If(past_valid & ~Past(idle_now) &
+                  (Past(self.go_wr_updloc) | (Past(self.go_rd_cpudatar) & ~Past(self.fv_ra_hit)))):
+            sync += Assert(self.fv_pend_prefetch)
+
+        with m.If(past_valid & Past(self.go_wr_bytecnt) & ~(Past(idle_now) & ~Past(self.fv_pend_prefetch))):
+            sync += Assert(self.fv_pend_block)
 
         # When the host processor writes to the Update Location registers
         # (either R18 or R19), we want to commence a prefetch operation
@@ -135,7 +285,7 @@ class MPEFormal(Elaboratable):
         ## Any write to R18 or R19 will trigger a prefetch operation.
         ## The register file is responsible for asserting go_wr_updloc
         ## when a write to these registers happens.
-        with m.If(past_valid & Past(self.ready) & Past(self.go_wr_updloc)):
+        with m.If(past_valid & Past(idle_now) & Past(self.go_wr_updloc)):
             sync += [
                 Assert(~self.ready),
                 Assert(self.fv_prefetch_0),
@@ -147,13 +297,12 @@ class MPEFormal(Elaboratable):
                 Assert(~self.mem_we_o),
             ]
 
-        with m.If(past_valid & ~Past(self.ready) & Past(self.fv_prefetch_0)):
+        with m.If(past_valid & Past(self.fv_prefetch_0)):
             ## If the Wishbone interconnect is not ready for the access cycle
             ## (for example, if video refresh is currently in progress), then
             ## we must wait for when it is ready.
             with m.If(Past(self.mem_stall_i)):
                 sync += [
-                    Assert(~self.ready),
                     Assert(self.fv_prefetch_0),
                     Assert(~self.fv_prefetch_1),
 
@@ -168,7 +317,6 @@ class MPEFormal(Elaboratable):
             ## also deliver the requested data).
             with m.Else():
                 sync += [
-                    Assert(~self.ready),
                     Assert(~self.fv_prefetch_0),
                     Assert(self.fv_prefetch_1),
 
@@ -178,10 +326,9 @@ class MPEFormal(Elaboratable):
 
         ## After receiving acknowledgement and data, update the CpuDataR register
         ## and return to being idle.
-        with m.If(past_valid & ~Past(self.ready) & Past(self.fv_prefetch_1)):
+        with m.If(past_valid & Past(self.fv_prefetch_1)):
             with m.If(~Past(self.mem_ack_i)):
                 sync += [
-                    Assert(~self.ready),
                     Assert(~self.fv_prefetch_0),
                     Assert(self.fv_prefetch_1),
 
@@ -190,7 +337,7 @@ class MPEFormal(Elaboratable):
                 ]
             with m.Else():
                 sync += [
-                    Assert(self.ready),
+                    Assert(self.fv_idle),
                     Assert(~self.fv_prefetch_0),
                     Assert(~self.fv_prefetch_1),
 
@@ -198,194 +345,1574 @@ class MPEFormal(Elaboratable):
                     Assert(~self.mem_stb_o),
 
                     Assert(self.cpudatar == Past(self.mem_dat_i)),
+                    Assert(~self.fv_stale),
                 ]
 
         # Any read from R31 ("CPU Data") will auto-increment the update
         # location pointer, thus requiring another prefetch operation.
-        with m.If(past_valid & Past(self.ready) & Past(self.go_rd_cpudatar)):
+        # That is, unless the byte has already been fetched ahead.
+        with m.If(past_valid & Past(idle_now) & Past(self.go_rd_cpudatar) & ~Past(self.fv_ra_hit)):
             sync += [
                 Assert(~self.ready),
                 Assert(self.fv_prefetch_0),
             ]
 
-        # Any write to R31 will *not* auto-increment the update location
-        # pointer, allowing the MPE the opportunity to use its current value
-        # for writing data to video memory.  However, the MPE is responsible
-        # for incrementing the pointer and commencing another prefetch
-        # operation.
-        with m.If(past_valid & Past(self.ready) & Past(self.go_wr_cpudataw)):
-            sync += [
-                Assert(~self.ready),
-                Assert(self.fv_store_0),
-            ]
+        # While otherwise idle, the MPE reads ahead of the update location
+        # so that sequential reads through R31 can be served at once.
+        # Buffered bytes lie one stride (R47) apart.
+        abus_width = len(self.mem_adr_o)
+        ra_span = Signal(abus_width)
+        comb += [
+            ra_span.eq(self.fv_ra_count * self.fv_ra_stride),
+            Assert(self.fv_ra_count <= 4),
+        ]
 
-        ## When writing a value to R31, the MPE must commence a write cycle
-        ## to video RAM.  We must wait for any stalls.
-        with m.If(self.fv_store_0):
+        with m.If(self.fv_readahead_0 | self.fv_readahead_1):
+            comb += Assert(self.fv_ra_count < 4)
+
+        with m.If(self.fv_readahead_0):
             comb += [
                 Assert(self.mem_cyc_o),
                 Assert(self.mem_stb_o),
-                Assert(self.mem_adr_o == self.update_location[0:len(self.mem_adr_o)]),
-                Assert(self.mem_we_o),
-                Assert(self.mem_dat_o == self.cpudataw),
+                Assert(self.mem_adr_o == (self.fv_ra_adr + ra_span)[0:abus_width]),
+                Assert(~self.mem_we_o),
+                Assert(~step_updloc),
+                Assert(~self.decr_bytecnt),
             ]
 
-        with m.If(past_valid & Past(self.fv_store_0)):
+        with m.If(self.fv_readahead_1):
+            comb += [
+                Assert(self.mem_cyc_o),
+                Assert(~self.mem_stb_o),
+            ]
+
+        with m.If(past_valid & Past(self.fv_readahead_0)):
             with m.If(Past(self.mem_stall_i)):
-                sync += Assert(self.fv_store_0)
+                sync += Assert(self.fv_readahead_0)
             with m.Else():
-                sync += Assert(self.fv_store_1)
+                sync += Assert(self.fv_readahead_1)
 
-        ## When receiving a store acknowledgement, we must remember to increment
-        ## the update location, so that we prefetch from the next address.
-        with m.If(self.fv_store_1):
+        with m.If(past_valid & Past(self.fv_readahead_1)):
+            with m.If(Past(self.mem_ack_i)):
+                sync += Assert(self.fv_idle)
+            with m.Else():
+                sync += Assert(self.fv_readahead_1)
+
+        ## A read hits when the next byte is already buffered and the CPU
+        ## Data register is current.  The host need not wait at all.
+        with m.If(self.fv_ra_hit):
+            comb += [
+                Assert(self.go_rd_cpudatar),
+                Assert(~self.cpudatar_stale),
+                Assert(self.fv_ra_count != 0),
+                Assert(self.fv_ra_stride == self.stride),
+                Assert(self.fv_ra_adr == (self.update_location + self.stride)[0:abus_width]),
+            ]
+
+        with m.If(past_valid & Past(self.fv_ra_hit)):
+            sync += [
+                Assert(self.cpudatar == Past(self.fv_ra_head)),
+                Assert(self.fv_ra_adr == (Past(self.fv_ra_adr) + Past(self.fv_ra_stride))[0:abus_width]),
+                Assert(~self.fv_pend_prefetch),
+            ]
+
+        ## A read which missed can still be served from the buffer, if the
+        ## byte it wants arrived in the meantime.
+        with m.If(past_valid & Past(idle_now) & Past(self.fv_pend_prefetch) &
+                  ~Past(self.fv_stale) & (Past(self.fv_ra_count) != 0) &
+                  (Past(self.fv_ra_stride) == Past(self.stride)) &
+                  (Past(self.fv_ra_adr) == Past(self.update_location)[0:abus_width])):
+            sync += [
+                Assert(self.fv_idle),
+                Assert(self.cpudatar == Past(self.fv_ra_head)),
+                Assert(~self.fv_pend_prefetch),
+            ]
+
+        ## Moving the update location, or starting a block operation,
+        ## discards the buffer.
+        with m.If(past_valid & Past(self.go_wr_updloc)):
+            sync += Assert(self.fv_ra_count == 0)
+
+        with m.If(past_valid & Past(self.fv_idle) & Past(self.wq_empty) &
+                  ~Past(self.fv_pend_prefetch) &
+                  (Past(self.go_wr_bytecnt) | Past(self.fv_pend_block))):
+            sync += Assert(self.fv_ra_count == 0)
+
+        ## A store cuts the buffer short at the address it writes.
+        with m.If(past_valid & Past(self.fv_store_0) & Past(self.mem_stb_o) & ~Past(self.mem_stall_i)):
+            sync += Assert(((Past(self.mem_adr_o) - self.fv_ra_adr)[0:abus_width]) >= ra_span)
+
+        # Any write to R31 also auto-increments the update location
+        # pointer, but the register set posts the byte to the write queue
+        # along with the address it was written to.  The MPE stores posted
+        # writes whenever it is idle, ahead of any other work.
+        with m.If(past_valid & Past(self.fv_idle) & ~Past(self.wq_empty)):
+            sync += Assert(self.fv_store_0)
+
+        ## A store writes the oldest posted byte to video RAM R49 times,
+        ## one stride apart, and removes it from the queue once the
+        ## interconnect accepts the last copy.  We must wait for any stalls.
+        ## In dual-plane mode, each copy is followed by the attribute fill
+        ## byte, stored in the attribute plane.
+        with m.If(self.fv_store_0):
             comb += [
                 Assert(self.mem_cyc_o),
-                Assert(~self.mem_stb_o),
+                Assert(self.mem_we_o),
+                Assert(self.wq_pop == (
+                    self.mem_stb_o & ~self.mem_stall_i & self.fv_store_last &
+                    (~self.wq_dual | self.fv_plane)
+                )),
+            ]
+            with m.If(self.fv_plane):
+                comb += [
+                    Assert(self.wq_dual),
+                    Assert(self.mem_adr_o == (
+                        self.wq_adr + self.fv_store_off + self.atrbase - self.chrbase
+                    )[0:abus_width]),
+                    Assert(self.mem_dat_o == self.wq_attr),
+                ]
+            with m.Else():
+                comb += [
+                    Assert(self.mem_adr_o == (self.wq_adr + self.fv_store_off)[0:abus_width]),
+                    Assert(self.mem_dat_o == self.wq_dat),
+                ]
+        with m.Else():
+            comb += [
+                Assert(~self.wq_pop),
+                Assert(self.fv_store_off == 0),
             ]
 
-        with m.If(past_valid & Past(self.fv_store_1)):
-            with m.If(~Past(self.mem_ack_i)):
+        with m.If(past_valid & Past(self.fv_store_0)):
+            with m.If(~Past(self.mem_stb_o) | Past(self.mem_stall_i)):
                 sync += [
-                    Assert(self.fv_store_1),
-                    Assert(~Past(self.incr_updloc)),
+                    Assert(self.fv_store_0),
+                    Assert(Stable(self.fv_store_off)),
+                ]
+            with m.Elif(Past(self.wq_dual) & ~Past(self.fv_plane)):
+                sync += [
+                    Assert(self.fv_store_0),
+                    Assert(self.fv_plane),
+                    Assert(Stable(self.fv_store_off)),
+                    Assert(self.fv_stale),
+                ]
+            with m.Elif(~Past(self.fv_store_last)):
+                sync += [
+                    Assert(self.fv_store_0),
+                    Assert(~self.fv_plane),
+                    Assert(self.fv_store_off == (Past(self.fv_store_off) + Past(self.wq_stride))[0:16]),
+                    Assert(self.fv_stale),
                 ]
             with m.Else():
                 sync += [
-                    Assert(self.fv_prefetch_0),
-                    Assert(Past(self.incr_updloc)),
+                    Assert(self.fv_store_1),
+                    Assert(self.fv_stale),
                 ]
 
+        ## Once every copy is acknowledged, we return to idle.  The update
+        ## location was advanced when the byte was posted.
+        with m.If(self.fv_store_1):
+            comb += [
+                Assert(self.mem_cyc_o),
+                Assert(~self.mem_stb_o),
+                Assert(~step_updloc),
+            ]
+
+        ## A store leaves the CPU Data register out of date until it is
+        ## refreshed from video memory.  Software can observe this through
+        ## R38 before reading R31.
+        comb += Assert(self.cpudatar_stale == (self.fv_stale | ~self.wq_empty))
+
+        ## While that refresh is underway, the CPU Data register remains
+        ## out of date.
+        with m.If(self.fv_refreshing & (self.fv_prefetch_0 | self.fv_prefetch_1)):
+            comb += Assert(self.fv_stale)
+
+        with m.If(past_valid & Past(idle_now) & Past(self.fv_stale) &
+                  ~Past(self.fv_pend_block) & ~Past(self.go_wr_bytecnt)):
+            sync += Assert(self.fv_prefetch_0)
+
         # When the CPU writes a value into the Byte Count register (R30),
         # we must commence a block copy or block write operation, depending
         # upon the state of the Block Copy flag bit (R24, bit 7).
         #
-        # In this version of the MPE, both block write and block copy use
-        # the same basic algorithm.  Block copy mode takes four cycles to
-        # copy one byte of data.  Block write takes three.
+        # Both block write and block copy are pipelined: a new memory access
+        # is issued on every clock the interconnect will accept one, without
+        # waiting for earlier accesses to be acknowledged.  Pointer registers
+        # are stepped as each access is issued.
         #
-        # The following table illustrates what happens each iteration of the
-        # write-loop.
+        # The following table illustrates what each state is responsible for.
         #
-        # Cycle  Copy Task                          Write Task
-        #   0    Drive source address               Copy cpudataw to cpudatar
-        #   1    Wait for data                      (skipped)
-        #   2    Drive destination address, data    Drive destination address, data
-        #   3    Wait for ack.  Decrement bytecnt.  Wait for ack.  Decrement bytecnt.
+        # State    Copy Task                          Write Task
+        # BLOCK_0  Size the next read burst           Copy cpudataw to cpudatar
+        # BLOCK_1  Issue source reads                 (skipped)
+        # BLOCK_2  Issue destination writes           Issue destination writes
+        # BLOCK_3  Wait for outstanding acks          Wait for outstanding acks
+        # BLOCK_4  Advance to the next row            Advance to the next row
+        # BLOCK_5  Read destination bytes             Read destination bytes
         #
-        # This loop iterates for as long as Byte Count register is non-zero.
-        with m.If(past_valid & Past(self.ready) & Past(self.go_wr_bytecnt)):
+        # Copies alternate between BLOCK_1 and BLOCK_2 (via BLOCK_0) for as
+        # long as the Byte Count register is non-zero.  Rectangular
+        # operations pass through BLOCK_4 between rows.  Raster operations
+        # which need the destination byte read it in BLOCK_5, after any
+        # source reads; such fills then proceed in bursts like copies.
+        need_dst = Signal(1)
+        dual = Signal(1)
+        comb += [
+            need_dst.eq((self.rop[0:2] != ROP_SRC) | (self.wrmask != 0xFF)),
+            dual.eq(self.dualplane & ~self.block_copy & ~need_dst),
+        ]
+
+        with m.If(past_valid & Past(idle_now) & ~Past(self.fv_pend_prefetch) &
+                  (Past(self.go_wr_bytecnt) | Past(self.fv_pend_block))):
             sync += [
                 Assert(self.fv_block_0),
                 Assert(~self.ready),
             ]
 
-        ## If we're performing a block copy...
-        with m.If(self.fv_block_0 & self.block_copy):
-            ### and we haven't reached the end of the loop yet,
-            ### the first cycle must drive the source address onto the memory bus.
-            with m.If(self.bytecnt != 0):
-                comb += [
-                    Assert(self.mem_cyc_o),
-                    Assert(self.mem_stb_o),
-                    Assert(self.mem_adr_o == self.copysrc[0:len(self.mem_adr_o)]),
-                    Assert(~self.mem_we_o),
-                ]
-            with m.Else():
-                comb += Assert(~self.mem_cyc_o)
+        ## State 0 never touches the bus; it only decides what to do next.
+        with m.If(self.fv_block_0):
+            comb += [
+                Assert(~self.mem_stb_o),
+                Assert(~step_updloc),
+                Assert(~step_copysrc),
+                Assert(~self.decr_bytecnt),
+            ]
 
         with m.If(past_valid & Past(self.fv_block_0)):
-            ### For Block Copy operations...
-            with m.If(Past(self.block_copy)):
-                ### Wait for bus stalls when driving the source address.
-                with m.If(Past(self.bytecnt) != 0):
-                    with m.If(Past(self.mem_stall_i)):
-                        sync += Assert(self.fv_block_0)
-                    with m.Else():
-                        sync += Assert(self.fv_block_1)
-
-                ### When we reach the end of the copy loop, which could have
-                ### altered the update location pointer, we drop into the prefetch
-                ### state so that we reset the CPU Data register with an up-to-date
-                ### view of video memory.
-                with m.Else():
-                    sync += Assert(self.fv_prefetch_0)
+            with m.If(Past(self.bytecnt) != 0):
+                ### For Block Copy operations, start reading source data.
+                with m.If(Past(self.block_copy)):
+                    sync += Assert(self.fv_block_1)
 
-            ### For Block Write operations, we just use a constant byte value
-            ### set by the programmer by storing a byte to R31.  As usual, if/when
-            ### we reach the end, begin a prefetch operation.
-            with m.Else():
-                with m.If(Past(self.bytecnt) != 0):
+                ### For Block Write operations, we just use a constant byte
+                ### value set by the programmer by storing a byte to R31.
+                with m.Elif(Past(need_dst)):
                     sync += [
                         Assert(self.cpudatar == Past(self.cpudataw)),
-                        Assert(self.fv_block_2),
+                        Assert(self.fv_block_5),
                     ]
                 with m.Else():
-                    sync += Assert(self.fv_prefetch_0)
+                    sync += [
+                        Assert(self.cpudatar == Past(self.cpudataw)),
+                        Assert(self.fv_block_2),
+                    ]
+
+            ### When we reach the end of the loop, which could have altered
+            ### the update location pointer, we wait for the bus to settle and
+            ### then drop into the prefetch state so that we reset the CPU Data
+            ### register with an up-to-date view of video memory.
+            with m.Else():
+                sync += Assert(self.fv_block_3)
 
         ### State 1 is reachable only if we're doing a block copy.
-        ### Here, we wait for acknowledgement and source data.
+        ### Here, we read source data, advancing the source pointer with every
+        ### read the interconnect accepts.  (Reads are held back only if the
+        ### MPE cannot track any more outstanding accesses.)
         with m.If(self.fv_block_1):
             comb += [
                 Assert(self.mem_cyc_o),
-                Assert(~self.mem_stb_o),
+                Assert(self.mem_adr_o == self.copysrc[0:len(self.mem_adr_o)]),
+                Assert(~self.mem_we_o),
+                Assert(step_copysrc == (self.mem_stb_o & ~self.mem_stall_i)),
+                Assert(~step_updloc),
+                Assert(~self.decr_bytecnt),
             ]
 
         with m.If(past_valid & Past(self.fv_block_1)):
-            with m.If(Past(self.mem_ack_i)):
-                sync += [
-                    Assert(self.fv_block_2),
-                    Assert(self.cpudatar == Past(self.mem_dat_i)),
-                ]
+            with m.If(Past(need_dst)):
+                sync += Assert(self.fv_block_1 | self.fv_block_5)
+            with m.Else():
+                sync += Assert(self.fv_block_1 | self.fv_block_2)
 
-        ### State 2 always appears; it is what stores the byte into video memory.
-        with m.If(self.fv_block_2):
+        ### State 5 reads the destination bytes a raster operation combines
+        ### with its source.  Nothing is written, and no pointer moves.
+        with m.If(self.fv_block_5):
             comb += [
                 Assert(self.mem_cyc_o),
-                Assert(self.mem_stb_o),
-                Assert(self.mem_adr_o == self.update_location[0:len(self.mem_adr_o)]),
-                Assert(self.mem_we_o),
-                Assert(self.mem_dat_o == self.cpudatar),
+                Assert(~self.mem_we_o),
+                Assert(~step_updloc),
+                Assert(~step_copysrc),
+                Assert(~self.decr_bytecnt),
             ]
 
-        with m.If(past_valid & Past(self.fv_block_2)):
-            with m.If(Past(self.mem_stall_i)):
-                sync += Assert(self.fv_block_2)
-            with m.Else():
-                sync += Assert(self.fv_block_3)
+        with m.If(past_valid & Past(self.fv_block_5)):
+            sync += Assert(self.fv_block_5 | self.fv_block_2)
 
-        ### State3 always appears; this concludes the write access.  It is also
-        ### responsible for incrementing the pointer registers as well.
-        with m.If(self.fv_block_3):
+        ### State 2 always appears; it is what stores bytes into video memory,
+        ### advancing the destination pointer and byte count with every write
+        ### the interconnect accepts.  Dual-plane fills first store the
+        ### character byte, then the attribute byte, and only then step.
+        with m.If(self.fv_block_2):
             comb += [
                 Assert(self.mem_cyc_o),
-                Assert(~self.mem_stb_o),
+                Assert(self.mem_we_o),
+                Assert(~step_copysrc),
             ]
 
-            with m.If(self.mem_ack_i):
+            with m.If(self.fv_plane):
                 comb += [
-                    Assert(self.incr_updloc),
+                    Assert(dual),
+                    Assert(self.mem_adr_o == (self.update_location + self.atrbase - self.chrbase)[0:len(self.mem_adr_o)]),
+                    Assert(self.mem_dat_o == self.attrfill),
+                ]
+            with m.Else():
+                comb += Assert(self.mem_adr_o == self.update_location[0:len(self.mem_adr_o)])
+
+            with m.If(self.mem_stb_o & ~self.mem_stall_i & (~dual | self.fv_plane)):
+                comb += [
+                    Assert(step_updloc),
                     Assert(self.decr_bytecnt),
                 ]
-                with m.If(self.block_copy):
-                    comb += Assert(self.incr_copysrc)
-                with m.Else():
-                    comb += Assert(~self.incr_copysrc)
             with m.Else():
                 comb += [
-                    Assert(~self.incr_updloc),
-                    Assert(~self.incr_copysrc),
+                    Assert(~step_updloc),
                     Assert(~self.decr_bytecnt),
                 ]
 
+            with m.If(~self.block_copy & (self.rop == ROP_SRC) & (self.wrmask == 0xFF) & ~self.fv_plane):
+                comb += Assert(self.mem_dat_o == self.cpudatar)
+
+        with m.If(past_valid & Past(self.fv_block_2) & Past(dual) & ~Past(self.fv_plane) &
+                  Past(self.mem_stb_o) & ~Past(self.mem_stall_i)):
+            sync += [
+                Assert(self.fv_block_2),
+                Assert(self.fv_plane),
+            ]
+
+        ### The last byte of the last row concludes the write loop.  The
+        ### last byte of any other row moves on to the next row.
+        with m.If(past_valid & Past(self.fv_block_2) & Past(self.decr_bytecnt) & (Past(self.bytecnt) == 1)):
+            with m.If(Past(self.rows) > 1):
+                sync += Assert(self.fv_block_4)
+            with m.Else():
+                sync += Assert(self.fv_block_3)
+
+        ### Only State 4 asks the register set to step to the next row, and
+        ### it starts no accesses of its own.
+        comb += Assert(self.next_row == self.fv_block_4)
+
+        with m.If(self.fv_block_4):
+            comb += [
+                Assert(~self.mem_stb_o),
+                Assert(~step_updloc),
+                Assert(~step_copysrc),
+                Assert(~self.decr_bytecnt),
+            ]
+
+        with m.If(past_valid & Past(self.fv_block_4)):
+            sync += Assert(self.fv_block_0)
+
+        ### State 3 concludes the operation; no new accesses are started.
+        with m.If(self.fv_block_3):
+            comb += [
+                Assert(self.mem_cyc_o),
+                Assert(~self.mem_stb_o),
+                Assert(~step_updloc),
+                Assert(~step_copysrc),
+                Assert(~self.decr_bytecnt),
+            ]
+
         with m.If(past_valid & Past(self.fv_block_3)):
-            with m.If(Past(self.mem_ack_i)):
-                sync += Assert(self.fv_block_0)
+            with m.If(Past(self.fv_listing)):
+                sync += Assert(self.fv_block_3 | self.fv_list_0 | self.fv_prefetch_0)
+            with m.Else():
+                sync += Assert(self.fv_block_3 | self.fv_prefetch_0)
+
+        # Writing the low byte of the command list pointer (R46) starts a
+        # chain of block operations described in video memory.  The host
+        # is held off until the whole chain completes, at which point the
+        # MPE raises list_done.
+        with m.If(past_valid & Past(self.go_wr_listptr)):
+            sync += Assert(~self.list_done)
+
+        with m.If(past_valid & Past(idle_now) & ~Past(self.fv_pend_prefetch) &
+                  ~Past(self.fv_pend_block) & ~Past(self.go_wr_bytecnt) &
+                  (Past(self.go_wr_listptr) | Past(self.fv_pend_list))):
+            sync += [
+                Assert(self.fv_list_0),
+                Assert(self.fv_listing),
+                Assert(~self.ready),
+            ]
+
+        with m.If(self.fv_list_0 | self.fv_list_1 | self.fv_list_2):
+            comb += [
+                Assert(self.fv_listing),
+                Assert(~self.ready),
+            ]
+
+        ## Descriptors are only ever read.
+        with m.If(self.fv_list_0 | self.fv_list_1):
+            comb += [
+                Assert(self.mem_cyc_o),
+                Assert(~self.mem_we_o),
+                Assert(~step_updloc),
+                Assert(~step_copysrc),
+                Assert(~self.decr_bytecnt),
+            ]
+
+        with m.If(self.fv_list_1):
+            comb += Assert(~self.mem_stb_o)
+
+        with m.If(past_valid & Past(self.fv_list_0)):
+            sync += Assert(self.fv_list_0 | self.fv_list_1)
+
+        with m.If(past_valid & Past(self.fv_list_1)):
+            sync += Assert(self.fv_list_1 | self.fv_list_2)
+
+        ## Once fetched, a descriptor is loaded into the register set, and
+        ## run as a block operation.
+        comb += Assert(self.ld_desc == self.fv_list_2)
+
+        with m.If(past_valid & Past(self.fv_list_2)):
+            sync += Assert(self.fv_block_0)
+
+        return m
+
+
+class MPESystem(Elaboratable):
+    """
+    A register set, write queue, MPE, arbiter, and a small video RAM,
+    wired together the same way VDC2 wires them.  The VFE port of the
+    arbiter is driven by vfe_busy, so tests can create memory contention.
+    The VFE reads vfe_adr.  latency sets the read latency of video RAM.
+    """
+
+    def __init__(self, abus_width=8, dual_port=False, wide=False, latency=1):
+        super().__init__()
+        self.wide = wide
+        self.regset = RegSet8Bit()
+        self.wq = WriteQueue(abus_width=abus_width)
+        self.mpe = MPE(abus_width=abus_width)
+        self.arb = BlockRamArbiter(
+            asize=abus_width, dual_port=dual_port, wide=wide, latency=latency
+        )
+        self.vram = RAM(abus_width=abus_width, wide=wide, latency=latency)
+
+        self.vfe_busy = Signal(1)
+        self.vfe_adr = Signal(abus_width)
+
+    def load(self, image):
+        """Preloads video RAM with a list of bytes."""
+        if self.wide:
+            image = [
+                image[i] | (image[i + 1] << 8) for i in range(0, len(image), 2)
+            ]
+        self.vram.mem.init = image
+
+    def peek(self, adr):
+        """Returns the byte at adr in video RAM; for use in simulations."""
+        if self.wide:
+            word = yield self.vram.mem[adr >> 1]
+            return (word >> (8 * (adr & 1))) & 0xFF
+        return (yield self.vram.mem[adr])
+
+    def elaborate(self, platform):
+        m = Module()
+        comb = m.d.comb
+
+        regset = m.submodules.regset = self.regset
+        wq = m.submodules.wq = self.wq
+        mpe = m.submodules.mpe = self.mpe
+        arb = m.submodules.arb = self.arb
+        vram = m.submodules.vram = self.vram
+
+        comb += [
+            regset.cpudatar.eq(mpe.cpudatar),
+            regset.incr_updloc.eq(mpe.incr_updloc),
+            regset.incr_copysrc.eq(mpe.incr_copysrc),
+            regset.decr_updloc.eq(mpe.decr_updloc),
+            regset.decr_copysrc.eq(mpe.decr_copysrc),
+            regset.decr_bytecnt.eq(mpe.decr_bytecnt),
+            regset.next_row.eq(mpe.next_row),
+            regset.ld_desc.eq(mpe.ld_desc),
+            regset.desc_dst.eq(mpe.desc_dst),
+            regset.desc_src.eq(mpe.desc_src),
+            regset.desc_len.eq(mpe.desc_len),
+            regset.list_done.eq(mpe.list_done),
+
+            mpe.go_wr_updloc.eq(regset.go_wr_updloc),
+            mpe.go_rd_cpudatar.eq(regset.go_rd_cpudatar),
+            mpe.go_wr_bytecnt.eq(regset.go_wr_bytecnt),
+            mpe.go_wr_listptr.eq(regset.go_wr_listptr),
+            mpe.update_location.eq(regset.update_location),
+            mpe.cpudataw.eq(regset.cpudataw),
+            mpe.block_copy.eq(regset.block_copy),
+            mpe.copysrc.eq(regset.copysrc),
+            mpe.bytecnt.eq(regset.bytecnt),
+            mpe.rows.eq(regset.rows),
+            mpe.rop.eq(regset.rop),
+            mpe.wrmask.eq(regset.wrmask),
+            mpe.descending.eq(regset.descending),
+            mpe.stride.eq(regset.stride),
+            mpe.dualplane.eq(regset.dualplane),
+            mpe.attrfill.eq(regset.attrfill),
+            mpe.chrbase.eq(regset.chrbase),
+            mpe.atrbase.eq(regset.atrbase),
+            mpe.listptr.eq(regset.listptr),
+
+            regset.cpudatar_stale.eq(mpe.cpudatar_stale),
+            regset.wq_level.eq(wq.posted),
+            regset.int_mpe.eq(mpe.idle),
+            regset.pc_vfe.eq(arb.pc_vfe),
+            regset.pc_mpe.eq(arb.pc_mpe),
+            regset.pc_stall.eq(arb.pc_stall),
+            regset.pc_idle.eq(arb.pc_idle),
+            regset.pc_ops.eq(mpe.pc_ops),
+
+            wq.push.eq(regset.go_wr_cpudataw),
+            wq.adr_i.eq(regset.update_location),
+            wq.dat_i.eq(regset.cpudataw),
+            wq.stride_i.eq(regset.stride),
+            wq.repeat_i.eq(regset.wrrepeat),
+            wq.dual_i.eq(regset.dualplane),
+            wq.attr_i.eq(regset.attrfill),
+            wq.pop.eq(mpe.wq_pop),
+            mpe.wq_adr.eq(wq.adr_o),
+            mpe.wq_dat.eq(wq.dat_o),
+            mpe.wq_stride.eq(wq.stride_o),
+            mpe.wq_repeat.eq(wq.repeat_o),
+            mpe.wq_dual.eq(wq.dual_o),
+            mpe.wq_attr.eq(wq.attr_o),
+            mpe.wq_empty.eq(wq.empty),
+            mpe.wq_full.eq(wq.full),
+
+            arb.mpe_cyc_i.eq(mpe.mem_cyc_o),
+            arb.mpe_stb_i.eq(mpe.mem_stb_o),
+            arb.mpe_adr_i.eq(mpe.mem_adr_o),
+            arb.mpe_we_i.eq(mpe.mem_we_o),
+            arb.mpe_dat_i.eq(mpe.mem_dat_o),
+            mpe.mem_stall_i.eq(arb.mpe_stall_o),
+            mpe.mem_ack_i.eq(arb.mpe_ack_o),
+            mpe.mem_dat_i.eq(arb.mpe_dat_o),
+
+            arb.vfe_cyc_i.eq(self.vfe_busy),
+            arb.vfe_stb_i.eq(self.vfe_busy),
+            arb.vfe_adr_i.eq(self.vfe_adr),
+
+            vram.adr_i.eq(arb.adr_o),
+            vram.wadr_i.eq(arb.wadr_o),
+            vram.we_i.eq(arb.we_o),
+            vram.dat_i.eq(arb.dat_o),
+            arb.dat_i.eq(vram.dat_o),
+        ]
 
         return m
 
 
+def vfe_contention(s, busy, period=8):
+    """
+    Returns a process that has the VFE hold the bus of an MPESystem for
+    busy clocks out of every period.
+    """
+    def vfe():
+        yield Passive()
+        phase = 0
+        while True:
+            yield s.vfe_busy.eq(phase < busy)
+            yield
+            phase = (phase + 1) % period
+    return vfe
+
+
 class MPETestCase(FHDLTestCase):
     def test_mpe(self):
         self.assertFormal(MPEFormal(), mode='bmc', depth=100)
         self.assertFormal(MPEFormal(), mode='prove', depth=100)
+
+    def write_reg(self, s, reg, byte):
+        yield s.regset.adr_i.eq(reg)
+        yield s.regset.dat_i.eq(byte)
+        yield s.regset.we_i.eq(1)
+        yield
+        yield s.regset.we_i.eq(0)
+        yield
+
+    def wait_ready(self, s):
+        for _ in range(4096):
+            if (yield s.mpe.ready):
+                return
+            yield
+        self.fail("MPE never became ready")
+
+    def block_op(self, init, dst, src, count, copy, fill=0, contention=0,
+                 rows=0, dststride=0, srcstride=0, rop=ROP_SRC, wrmask=0xFF,
+                 descending=False, stride=1, dual_port=False, wide=False,
+                 latency=1):
+        """
+        Runs one block operation against a RAM preloaded with init,
+        and returns the resulting RAM contents.  With contention, the
+        VFE holds the bus for that many clocks out of every eight; with
+        dual_port, MPE writes proceed alongside VFE reads.
+        With rows, the operation covers a rectangle of rows runs of
+        count bytes each.  rop and wrmask select a raster operation.
+        Descending operations start at the last byte of dst and src.
+        Pointers step by stride.  With wide, video RAM is 16 bits wide.
+        latency sets the read latency of video RAM.
+        """
+        s = MPESystem(abus_width=(len(init) - 1).bit_length(),
+                      dual_port=dual_port, wide=wide, latency=latency)
+        s.load(init)
+        result = []
+
+        sim = Simulator(s)
+        sim.add_clock(1e-6)
+
+        vfe = vfe_contention(s, contention)
+
+        def host():
+            yield from self.write_reg(s, 24, 0x80 if copy else 0x00)
+            yield from self.write_reg(s, 43, rop | (8 if descending else 0))
+            yield from self.write_reg(s, 47, stride)
+            yield from self.write_reg(s, 44, wrmask)
+            yield from self.write_reg(s, 18, dst >> 8)
+            yield from self.write_reg(s, 19, dst & 0xFF)
+            yield from self.wait_ready(s)
+            if not copy:
+                # As on the C128, a fill stores its first byte through R31,
+                # and the block operation supplies the rest.
+                yield from self.write_reg(s, 31, fill)
+                yield from self.wait_ready(s)
+                if rows:
+                    # Rectangles start at the first byte of each row.
+                    yield from self.write_reg(s, 18, dst >> 8)
+                    yield from self.write_reg(s, 19, dst & 0xFF)
+                    yield from self.wait_ready(s)
+            yield from self.write_reg(s, 32, src >> 8)
+            yield from self.write_reg(s, 33, src & 0xFF)
+            if rows:
+                yield from self.write_reg(s, 40, rows)
+                yield from self.write_reg(s, 41, dststride & 0xFF)
+                yield from self.write_reg(s, 42, srcstride & 0xFF)
+                if dststride > 0xFF:
+                    yield from self.write_reg(s, 59, dststride >> 8)
+                if srcstride > 0xFF:
+                    yield from self.write_reg(s, 60, srcstride >> 8)
+            if count > 0xFF:
+                yield from self.write_reg(s, 39, count >> 8)
+            yield from self.write_reg(s, 30, count & 0xFF)
+            yield from self.wait_ready(s)
+
+            if descending:
+                end = dst - max(rows - 1, 0) * dststride - count * stride
+                src_end = src - max(rows - 1, 0) * srcstride - count * stride
+            elif rows:
+                end = dst + (rows - 1) * dststride + count * stride
+                src_end = src + (rows - 1) * srcstride + count * stride
+            else:
+                end = dst + (count + (0 if copy else 1)) * stride
+                src_end = src + count * stride
+            self.assertEqual((yield s.regset.bytecnt), 0)
+            self.assertEqual((yield s.regset.update_location), end & 0xFFFF)
+            if copy:
+                self.assertEqual((yield s.regset.copysrc), src_end & 0xFFFF)
+            self.assertEqual((yield s.mpe.cpudatar), (yield from s.peek(end)))
+            for i in range(len(init)):
+                result.append((yield from s.peek(i)))
+
+        sim.add_sync_process(vfe)
+        sim.add_sync_process(host)
+        sim.run()
+        return result
+
+    def reference_copy(self, init, dst, src, count):
+        # Byte-at-a-time forward copy; overlapping copies smear.
+        mem = list(init)
+        for i in range(count):
+            mem[dst + i] = mem[src + i]
+        return mem
+
+    def reference_rect(self, init, dst, src, count, rows, dststride, srcstride):
+        mem = list(init)
+        for row in range(rows):
+            for i in range(count):
+                mem[dst + row * dststride + i] = mem[src + row * srcstride + i]
+        return mem
+
+    def reference_rop(self, src, dst, rop, wrmask):
+        if rop & 4:
+            src = ~src & 0xFF
+        fn = [
+            src,
+            src & dst,
+            src | dst,
+            src ^ dst,
+        ][rop & 3]
+        return (fn & wrmask) | (dst & ~wrmask & 0xFF)
+
+    def test_block_fill(self):
+        init = list(range(256))
+        for contention in (0, 3, 6):
+            mem = self.block_op(init, 0x20, 0, 99, copy=False, fill=0xA5,
+                                contention=contention)
+            expected = init[0:0x20] + [0xA5] * 100 + init[0x20+100:]
+            self.assertEqual(mem, expected)
+
+    def test_block_copy(self):
+        init = [(i * 7) & 0xFF for i in range(256)]
+        cases = [
+            (0x80, 0x10, 50),   # disjoint
+            (0x11, 0x10, 50),   # destination one byte above source: smear
+            (0x13, 0x10, 50),   # destination within one burst of source
+            (0x10, 0x13, 50),   # destination below source
+            (0x40, 0x10, 1),    # single byte
+        ]
+        for dst, src, count in cases:
+            for contention in (0, 5):
+                with self.subTest(dst=dst, src=src, contention=contention):
+                    mem = self.block_op(init, dst, src, count, copy=True,
+                                        contention=contention)
+                    self.assertEqual(mem, self.reference_copy(init, dst, src, count))
+
+    def test_block_extended(self):
+        # Loading R39 extends the byte count past 255.
+        init = [(i * 5) & 0xFF for i in range(1024)]
+        mem = self.block_op(init, 0x100, 0, 700, copy=False, fill=0x3C)
+        expected = init[0:0x100] + [0x3C] * 701 + init[0x100+701:]
+        self.assertEqual(mem, expected)
+
+        mem = self.block_op(init, 0x120, 0x10, 600, copy=True)
+        self.assertEqual(mem, self.reference_copy(init, 0x120, 0x10, 600))
+
+    def test_block_dual_port(self):
+        init = [(i * 13 + 5) & 0xFF for i in range(256)]
+
+        # Fills only write, so they stream even while the VFE holds the
+        # read port on all but one clock in eight.
+        for contention in (0, 6, 7):
+            with self.subTest(copy=False, contention=contention):
+                mem = self.block_op(init, 0x20, 0, 100, copy=False, fill=0xA5,
+                                    contention=contention, dual_port=True)
+                expected = list(init)
+                expected[0x20:0x20 + 101] = [0xA5] * 101
+                self.assertEqual(mem, expected)
+
+        for contention in (0, 6):
+            with self.subTest(copy=True, contention=contention):
+                mem = self.block_op(init, 0x80, 0x10, 60, copy=True,
+                                    contention=contention, dual_port=True)
+                self.assertEqual(mem, self.reference_copy(init, 0x80, 0x10, 60))
+
+    def test_block_wide(self):
+        # Byte fills and copies land in the right byte lane of a 16-bit
+        # video RAM, whatever the alignment, with or without contention.
+        init = [(i * 13 + 5) & 0xFF for i in range(256)]
+        for dst, src, count in ((0x10, 0x80, 16), (0x11, 0x80, 15), (0x10, 0x81, 17)):
+            for contention, dual_port in ((0, False), (4, False), (4, True)):
+                with self.subTest(dst=dst, src=src, count=count,
+                                  contention=contention, dual_port=dual_port):
+                    result = self.block_op(init, dst, src, count, copy=True,
+                                           contention=contention,
+                                           dual_port=dual_port, wide=True)
+                    self.assertEqual(result, self.reference_copy(init, dst, src, count))
+
+                    result = self.block_op(init, dst, src, count, copy=False,
+                                           fill=0xA5, contention=contention,
+                                           dual_port=dual_port, wide=True)
+                    expected = list(init)
+                    for i in range(count + 1):
+                        expected[dst + i] = 0xA5
+                    self.assertEqual(result, expected)
+
+    def test_block_pipelined(self):
+        # The MPE keeps several accesses in flight, so a longer read
+        # latency only delays the results.
+        init = [(i * 29 + 3) & 0xFF for i in range(256)]
+        for latency in (2, 3):
+            for contention, dual_port, wide in ((0, False, False), (3, True, False),
+                                                (3, True, True)):
+                with self.subTest(latency=latency, contention=contention,
+                                  dual_port=dual_port, wide=wide):
+                    result = self.block_op(init, 0x11, 0x80, 21, copy=True,
+                                           contention=contention,
+                                           dual_port=dual_port, wide=wide,
+                                           latency=latency)
+                    self.assertEqual(result, self.reference_copy(init, 0x11, 0x80, 21))
+
+                    result = self.block_op(init, 0x40, 0, 9, copy=False,
+                                           fill=0x3C, contention=contention,
+                                           dual_port=dual_port, wide=wide,
+                                           latency=latency)
+                    expected = list(init)
+                    for i in range(10):
+                        expected[0x40 + i] = 0x3C
+                    self.assertEqual(result, expected)
+
+    def test_block_rect(self):
+        init = [(i * 11) & 0xFF for i in range(256)]
+
+        # Fill a 5x6 window inside a 16-byte wide screen.
+        for contention in (0, 5):
+            with self.subTest(contention=contention, fill=True):
+                mem = self.block_op(init, 0x23, 0, 5, copy=False, fill=0x5A,
+                                    contention=contention,
+                                    rows=6, dststride=16)
+                expected = list(init)
+                for row in range(6):
+                    for col in range(5):
+                        expected[0x23 + row * 16 + col] = 0x5A
+                self.assertEqual(mem, expected)
+
+        cases = [
+            # dst, src, width, rows, dststride, srcstride
+            (0x80, 0x10, 6, 4, 16, 16),    # move a window
+            (0x10, 0x20, 16, 8, 16, 16),   # scroll a region up one row
+            (0xC0, 0x08, 3, 5, 3, 16),     # gather a glyph into a strip
+        ]
+        for dst, src, width, rows, dststride, srcstride in cases:
+            for contention in (0, 5):
+                with self.subTest(dst=dst, src=src, contention=contention):
+                    mem = self.block_op(init, dst, src, width, copy=True,
+                                        contention=contention, rows=rows,
+                                        dststride=dststride, srcstride=srcstride)
+                    self.assertEqual(mem, self.reference_rect(
+                        init, dst, src, width, rows, dststride, srcstride
+                    ))
+
+        # R59 and R60 extend the strides past 255 bytes, for screens wider
+        # than that.
+        init = [(i * 11) & 0xFF for i in range(1024)]
+        with self.subTest(wide_stride=True, fill=True):
+            mem = self.block_op(init, 0x23, 0, 4, copy=False, fill=0x5A,
+                                rows=3, dststride=320)
+            expected = list(init)
+            for row in range(3):
+                for col in range(4):
+                    expected[0x23 + row * 320 + col] = 0x5A
+            self.assertEqual(mem, expected)
+        with self.subTest(wide_stride=True, fill=False):
+            mem = self.block_op(init, 0x10, 0x140, 4, copy=True,
+                                rows=3, dststride=320, srcstride=0x110)
+            self.assertEqual(mem, self.reference_rect(
+                init, 0x10, 0x140, 4, 3, 320, 0x110
+            ))
+
+    def test_block_rop(self):
+        init = [(i * 37 + 3) & 0xFF for i in range(256)]
+        ops = [
+            (ROP_AND, 0xFF),
+            (ROP_OR, 0xFF),
+            (ROP_XOR, 0xFF),
+            (ROP_SRC | 4, 0xFF),    # NOT
+            (ROP_SRC, 0x0F),        # masked store
+            (ROP_XOR | 4, 0x3C),
+        ]
+        for rop, wrmask in ops:
+            for contention in (0, 5):
+                with self.subTest(rop=rop, wrmask=wrmask, contention=contention):
+                    # A fill applies the raster operation to every byte
+                    # after the one stored through R31.
+                    mem = self.block_op(init, 0x20, 0, 21, copy=False,
+                                        fill=0x96, contention=contention,
+                                        rop=rop, wrmask=wrmask)
+                    expected = list(init)
+                    expected[0x20] = 0x96
+                    for i in range(0x21, 0x21 + 21):
+                        expected[i] = self.reference_rop(0x96, init[i], rop, wrmask)
+                    self.assertEqual(mem, expected)
+
+                    cases = [
+                        (0x80, 0x10, 30),   # disjoint
+                        (0x12, 0x10, 30),   # destination within one burst
+                        (0x10, 0x13, 30),   # destination below source
+                    ]
+                    for dst, src, count in cases:
+                        mem = self.block_op(init, dst, src, count, copy=True,
+                                            contention=contention,
+                                            rop=rop, wrmask=wrmask)
+                        expected = list(init)
+                        for i in range(count):
+                            expected[dst + i] = self.reference_rop(
+                                expected[src + i], expected[dst + i], rop, wrmask
+                            )
+                        self.assertEqual(mem, expected, (dst, src))
+
+    def test_command_list(self):
+        init = [(i * 29 + 1) & 0xFF for i in range(1024)]
+        # opcode, destination, source, length, fill
+        cmds = [
+            (0x00, 0x100, 0, 300, 0x20),            # clear
+            (0x00, 0x100, 0, 16, 0xCD),             # border
+            (0x80, 0x180, 0x010, 40, 0),            # copy a region
+            (0x80 | ROP_XOR, 0x1C0, 0x030, 8, 0),   # XOR stamp
+            (0x80, 0x200, 0x100, 0, 0),             # empty
+            (0x00, 0x210, 0, 1, 0x77),
+        ]
+        descs = [0x340, 0x360, 0x300, 0x3F0, 0x320, 0x380]
+        mem = list(init)
+        for i, (op, dst, src, length, fill) in enumerate(cmds):
+            nxt = descs[i + 1] if i + 1 < len(descs) else 0
+            mem[descs[i]:descs[i] + DESC_SIZE] = [
+                op, dst >> 8, dst & 0xFF, src >> 8, src & 0xFF,
+                length >> 8, length & 0xFF, fill, nxt >> 8, nxt & 0xFF,
+            ]
+        init = mem
+
+        expected = list(init)
+        expected[0x3E0] = 0x99
+        for op, dst, src, length, fill in cmds:
+            for i in range(length):
+                if op & 0x80:
+                    expected[dst + i] = self.reference_rop(
+                        expected[src + i], expected[dst + i], op & 7, 0xFF
+                    )
+                else:
+                    expected[dst + i] = fill
+
+        for contention in (0, 5):
+            with self.subTest(contention=contention):
+                s = MPESystem(abus_width=10)
+                s.vram.mem.init = init
+                result = []
+
+                sim = Simulator(s)
+                sim.add_clock(1e-6)
+
+                vfe = vfe_contention(s, contention)
+
+                def read_reg(reg):
+                    yield s.regset.adr_i.eq(reg)
+                    yield
+                    return (yield s.regset.dat_o)
+
+                def host():
+                    # Settings the host has programmed for its own block
+                    # operations, none of which the descriptors use.
+                    yield from self.write_reg(s, 18, 0x03)
+                    yield from self.write_reg(s, 19, 0xE0)
+                    yield from self.wait_ready(s)
+                    yield from self.write_reg(s, 31, 0x99)
+                    yield from self.wait_ready(s)
+                    for reg, value in ((24, 0x80), (40, 3), (43, 0x1B), (48, 0x66)):
+                        yield from self.write_reg(s, reg, value)
+
+                    yield from self.write_reg(s, 45, descs[0] >> 8)
+                    yield from self.write_reg(s, 46, descs[0] & 0xFF)
+                    yield s.regset.adr_i.eq(38)
+                    yield
+                    self.assertFalse((yield s.regset.dat_o) & 0x40)
+                    yield from self.wait_ready(s)
+
+                    # The list leaves them as they were.
+                    self.assertEqual((yield from read_reg(24)) & 0x80, 0x80)
+                    self.assertEqual((yield from read_reg(40)), 3)
+                    self.assertEqual((yield from read_reg(43)) & 0x1F, 0x1B)
+                    self.assertEqual((yield from read_reg(48)), 0x66)
+                    self.assertEqual((yield s.regset.cpudataw), 0x99)
+
+                    # The whole chain ran from one kick, and R38 says so.
+                    yield s.regset.adr_i.eq(38)
+                    yield
+                    self.assertTrue((yield s.regset.dat_o) & 0x40)
+                    self.assertEqual((yield s.regset.update_location), 0x211)
+                    self.assertEqual((yield s.mpe.cpudatar), expected[0x211])
+                    for i in range(len(init)):
+                        result.append((yield s.vram.mem[i]))
+
+                sim.add_sync_process(vfe)
+                sim.add_sync_process(host)
+                sim.run()
+                self.assertEqual(result, expected)
+
+    def test_block_descending(self):
+        init = [(i * 7 + 2) & 0xFF for i in range(256)]
+        cases = [
+            (0x90, 0x40, 50),   # disjoint
+            (0x51, 0x50, 50),   # destination one byte above source
+            (0x53, 0x50, 50),   # destination within one burst, above
+            (0x50, 0x53, 50),   # destination within one burst, below: smear
+            (0x40, 0x20, 1),    # single byte
+        ]
+        for dst, src, count in cases:
+            for contention in (0, 5):
+                with self.subTest(dst=dst, src=src, contention=contention):
+                    mem = self.block_op(init, dst, src, count, copy=True,
+                                        contention=contention, descending=True)
+                    expected = list(init)
+                    for i in range(count):
+                        expected[dst - i] = expected[src - i]
+                    self.assertEqual(mem, expected)
+
+        # Scroll a 6x5 window inside a 16-byte wide screen down one row,
+        # starting from its bottom right corner.
+        mem = self.block_op(init, 0x75, 0x65, 6, copy=True, rows=5,
+                            dststride=16, srcstride=16, descending=True)
+        expected = list(init)
+        for row in range(5):
+            for col in range(6):
+                expected[0x75 - row * 16 - col] = init[0x65 - row * 16 - col]
+        self.assertEqual(mem, expected)
+
+    def test_block_stride(self):
+        init = [(i * 19 + 4) & 0xFF for i in range(256)]
+
+        # Fill a column of a 16-byte wide screen.
+        mem = self.block_op(init, 0x03, 0, 10, copy=False, fill=0x7E, stride=16)
+        expected = list(init)
+        for i in range(11):
+            expected[0x03 + i * 16] = 0x7E
+        self.assertEqual(mem, expected)
+
+        cases = [
+            (0x05, 0x02, 12, 16, False),    # copy a column
+            (0x12, 0x10, 30, 2, False),     # overlapping, within a burst
+            (0xF0, 0xE0, 14, 8, True),      # descending
+        ]
+        for dst, src, count, stride, descending in cases:
+            for contention in (0, 5):
+                with self.subTest(dst=dst, src=src, stride=stride,
+                                  contention=contention):
+                    mem = self.block_op(init, dst, src, count, copy=True,
+                                        contention=contention, stride=stride,
+                                        descending=descending)
+                    step = -stride if descending else stride
+                    expected = list(init)
+                    for i in range(count):
+                        expected[dst + i * step] = expected[src + i * step]
+                    self.assertEqual(mem, expected)
+
+    def test_cpudata_stride(self):
+        init = [(i * 13 + 5) & 0xFF for i in range(256)]
+        s = MPESystem()
+        s.vram.mem.init = init
+
+        sim = Simulator(s)
+        sim.add_clock(1e-6)
+
+        def host():
+            # Draw a vertical line down a 16-byte wide screen, then read
+            # back the column next to it.
+            yield from self.write_reg(s, 47, 16)
+            yield from self.write_reg(s, 18, 0x00)
+            yield from self.write_reg(s, 19, 0x04)
+            yield from self.wait_ready(s)
+            for i in range(12):
+                yield from self.write_reg(s, 31, 0xB3)
+                yield from self.wait_ready(s)
+            self.assertEqual((yield s.regset.update_location), 0x04 + 12 * 16)
+
+            yield from self.write_reg(s, 19, 0x05)
+            yield from self.wait_ready(s)
+            for i in range(12):
+                for _ in range(8):
+                    yield
+                yield from self.wait_ready(s)
+                byte = yield from self.read_cpudata(s)
+                self.assertEqual(byte, init[0x05 + i * 16], "read {}".format(i))
+
+            for i in range(12):
+                self.assertEqual((yield s.vram.mem[0x04 + i * 16]), 0xB3)
+                self.assertEqual((yield s.vram.mem[0x03 + i * 16]), init[0x03 + i * 16])
+
+        sim.add_sync_process(host)
+        sim.run()
+
+    def test_block_dualplane(self):
+        init = [(i * 13 + 5) & 0xFF for i in range(256)]
+        for contention in (0, 6):
+            with self.subTest(contention=contention):
+                s = MPESystem()
+                s.vram.mem.init = init
+
+                sim = Simulator(s)
+                sim.add_clock(1e-6)
+
+                vfe = vfe_contention(s, contention)
+
+                def host():
+                    # Screen at 0x20, attributes at 0x90.  The first
+                    # character goes through R31 as usual, taking its
+                    # attribute along in dual-plane mode; the fill then
+                    # stores characters and attributes together.
+                    yield from self.write_reg(s, 12, 0x00)
+                    yield from self.write_reg(s, 13, 0x20)
+                    yield from self.write_reg(s, 20, 0x00)
+                    yield from self.write_reg(s, 21, 0x90)
+                    yield from self.write_reg(s, 43, 0x10)
+                    yield from self.write_reg(s, 48, 0x5A)
+                    yield from self.write_reg(s, 18, 0x00)
+                    yield from self.write_reg(s, 19, 0x28)
+                    yield from self.wait_ready(s)
+                    yield from self.write_reg(s, 31, 0x20)
+                    yield from self.wait_ready(s)
+                    yield from self.write_reg(s, 30, 20)
+                    yield from self.wait_ready(s)
+
+                    self.assertEqual((yield s.regset.update_location), 0x28 + 21)
+                    for i in range(256):
+                        if 0x28 <= i < 0x29 + 20:
+                            expected = 0x20
+                        elif 0x98 <= i < 0x99 + 20:
+                            expected = 0x5A
+                        else:
+                            expected = init[i]
+                        self.assertEqual((yield s.vram.mem[i]), expected, hex(i))
+
+                sim.add_sync_process(vfe)
+                sim.add_sync_process(host)
+                sim.run()
+
+    def test_repeated_writes(self):
+        init = [(i * 13 + 5) & 0xFF for i in range(256)]
+        glyph = [0x18, 0x3C, 0x66, 0x7E, 0x66, 0x66, 0x66, 0x00]
+        for repeat, stride in ((2, 1), (4, 1), (2, 8)):
+            with self.subTest(repeat=repeat, stride=stride):
+                s = MPESystem()
+                s.vram.mem.init = init
+
+                sim = Simulator(s)
+                sim.add_clock(1e-6)
+
+                def host():
+                    # Upload an 8x8 glyph into a taller glyph slot, one
+                    # host write per glyph row.
+                    yield from self.write_reg(s, 47, stride)
+                    yield from self.write_reg(s, 49, repeat)
+                    yield from self.write_reg(s, 18, 0x00)
+                    yield from self.write_reg(s, 19, 0x01)
+                    yield from self.wait_ready(s)
+                    for byte in glyph:
+                        yield from self.write_reg(s, 31, byte)
+                        yield from self.wait_ready(s)
+
+                    end = 0x01 + len(glyph) * repeat * stride
+                    self.assertEqual((yield s.regset.update_location), end)
+                    for _ in range(64):
+                        yield
+                    self.assertEqual((yield s.mpe.cpudatar), init[end])
+
+                    model = list(init)
+                    for i, byte in enumerate(glyph):
+                        for j in range(repeat):
+                            model[0x01 + (i * repeat + j) * stride] = byte
+                    for i in range(256):
+                        self.assertEqual((yield s.vram.mem[i]), model[i], hex(i))
+
+                sim.add_sync_process(host)
+                sim.run()
+
+    def test_dualplane_writes(self):
+        # In dual-plane mode, each byte written to R31 takes the attribute
+        # fill byte along to the attribute plane, as it was when written.
+        init = [(i * 13 + 5) & 0xFF for i in range(256)]
+        text = [0x48, 0x45, 0x4C, 0x4C, 0x4F]
+        for contention in (0, 6):
+            with self.subTest(contention=contention):
+                s = MPESystem()
+                s.vram.mem.init = init
+
+                sim = Simulator(s)
+                sim.add_clock(1e-6)
+
+                vfe = vfe_contention(s, contention)
+
+                def host():
+                    yield from self.write_reg(s, 12, 0x00)
+                    yield from self.write_reg(s, 13, 0x20)
+                    yield from self.write_reg(s, 20, 0x00)
+                    yield from self.write_reg(s, 21, 0x90)
+                    yield from self.write_reg(s, 43, 0x10)
+                    yield from self.write_reg(s, 18, 0x00)
+                    yield from self.write_reg(s, 19, 0x30)
+                    yield from self.wait_ready(s)
+                    for i, byte in enumerate(text):
+                        yield from self.write_reg(s, 48, 0x11 if i < 3 else 0x22)
+                        if not (yield s.mpe.ready):
+                            yield from self.wait_ready(s)
+                        yield from self.write_reg(s, 31, byte)
+                    yield from self.write_reg(s, 43, 0x00)
+                    yield from self.wait_ready(s)
+                    for _ in range(64):
+                        yield
+
+                    model = list(init)
+                    for i, byte in enumerate(text):
+                        model[0x30 + i] = byte
+                        model[0xA0 + i] = 0x11 if i < 3 else 0x22
+                    for i in range(256):
+                        self.assertEqual((yield s.vram.mem[i]), model[i], hex(i))
+
+                sim.add_sync_process(vfe)
+                sim.add_sync_process(host)
+                sim.run()
+
+    def test_repeat_change_while_posted(self):
+        # As the font loader does, store a run of bytes twice each, then
+        # set R49 (and R47) back without waiting for the queue to drain.
+        # Bytes still queued are stored as they were written.
+        init = [0] * 256
+        glyph = list(range(1, 9))
+        for contention in (0, 3):
+            with self.subTest(contention=contention):
+                s = MPESystem()
+                s.vram.mem.init = init
+
+                sim = Simulator(s)
+                sim.add_clock(1e-6)
+
+                vfe = vfe_contention(s, contention)
+
+                def host():
+                    yield from self.write_reg(s, 49, 2)
+                    yield from self.write_reg(s, 18, 0x00)
+                    yield from self.write_reg(s, 19, 0x40)
+                    yield from self.wait_ready(s)
+                    for byte in glyph:
+                        if not (yield s.mpe.ready):
+                            yield from self.wait_ready(s)
+                        yield from self.write_reg(s, 31, byte)
+                        yield
+                    self.assertNotEqual((yield s.wq.level), 0)
+                    yield from self.write_reg(s, 49, 1)
+                    yield from self.write_reg(s, 47, 3)
+
+                    for _ in range(256):
+                        yield
+                    model = list(init)
+                    for i, byte in enumerate(glyph):
+                        model[0x40 + 2 * i] = byte
+                        model[0x41 + 2 * i] = byte
+                    for i in range(256):
+                        self.assertEqual((yield s.vram.mem[i]), model[i], hex(i))
+
+                sim.add_sync_process(vfe)
+                sim.add_sync_process(host)
+                sim.run()
+
+    def test_interrupt_status_after_reset(self):
+        # The MPE is idle and the raster matches R52:R53 from reset, but
+        # neither is an event.
+        s = MPESystem()
+        s.vram.mem.init = [0] * 256
+
+        sim = Simulator(s)
+        sim.add_clock(1e-6)
+
+        def host():
+            yield s.regset.adr_i.eq(51)
+            for _ in range(8):
+                yield
+                yield Settle()
+                self.assertEqual((yield s.regset.dat_o) & 0x07, 0)
+            self.assertFalse((yield s.regset.irq))
+
+        sim.add_sync_process(host)
+        sim.run()
+
+    def test_interrupt(self):
+        s = MPESystem()
+        s.vram.mem.init = [0] * 256
+
+        sim = Simulator(s)
+        sim.add_clock(1e-6)
+
+        def host():
+            yield from self.write_reg(s, 50, INT_MPE)
+            yield from self.write_reg(s, 51, 0xFF)
+            self.assertFalse((yield s.regset.irq))
+
+            # A long fill keeps the MPE busy; the interrupt arrives once it
+            # is done, without the host polling for ready.
+            yield from self.write_reg(s, 18, 0x00)
+            yield from self.write_reg(s, 19, 0x10)
+            yield from self.wait_ready(s)
+            yield from self.write_reg(s, 31, 0x55)
+            yield from self.wait_ready(s)
+            yield from self.write_reg(s, 51, INT_MPE)
+            yield from self.write_reg(s, 30, 100)
+            self.assertFalse((yield s.regset.irq))
+            for _ in range(1000):
+                yield
+                if (yield s.regset.irq):
+                    break
+            else:
+                self.fail("no interrupt")
+            self.assertTrue((yield s.mpe.ready))
+            self.assertEqual((yield s.vram.mem[0x10 + 100]), 0x55)
+
+            # Acknowledging the event withdraws the request.
+            yield s.regset.adr_i.eq(51)
+            yield
+            self.assertEqual((yield s.regset.dat_o) & INT_MPE, INT_MPE)
+            yield from self.write_reg(s, 51, INT_MPE)
+            yield
+            self.assertFalse((yield s.regset.irq))
+
+            # Events are still recorded while disabled, but request nothing.
+            yield from self.write_reg(s, 50, 0)
+            yield from self.write_reg(s, 30, 4)
+            yield from self.wait_ready(s)
+            yield
+            yield
+            self.assertFalse((yield s.regset.irq))
+            yield from self.write_reg(s, 50, INT_MPE)
+            yield
+            self.assertTrue((yield s.regset.irq))
+
+        sim.add_sync_process(host)
+        sim.run()
+
+    def test_interrupt_streaming(self):
+        # While the host streams bytes to R31 faster than the MPE can
+        # store them, ready comes and goes as the write queue fills and
+        # drains.  None of that is the MPE finishing its work, so the
+        # interrupt must wait until the last byte is stored.
+        s = MPESystem()
+        s.vram.mem.init = [0] * 256
+        stalls = []
+
+        sim = Simulator(s)
+        sim.add_clock(1e-6)
+
+        vfe = vfe_contention(s, 6)
+
+        def host():
+            yield from self.write_reg(s, 50, INT_MPE)
+            yield from self.write_reg(s, 18, 0x00)
+            yield from self.write_reg(s, 19, 0x40)
+            yield from self.wait_ready(s)
+            yield from self.write_reg(s, 51, 0xFF)
+            self.assertFalse((yield s.regset.irq))
+
+            for i in range(16):
+                if not (yield s.mpe.ready):
+                    stalls.append(i)
+                    yield from self.wait_ready(s)
+                yield from self.write_reg(s, 31, 0x80 + i)
+                yield
+                self.assertFalse((yield s.regset.irq))
+
+            for _ in range(1000):
+                yield
+                if (yield s.regset.irq):
+                    break
+            else:
+                self.fail("no interrupt")
+            self.assertEqual((yield s.wq.level), 0)
+            for i in range(16):
+                self.assertEqual((yield s.vram.mem[0x40 + i]), 0x80 + i)
+
+        sim.add_sync_process(vfe)
+        sim.add_sync_process(host)
+        sim.run()
+
+        # The queue did fill, so ready did toggle.
+        self.assertNotEqual(stalls, [])
+
+    def read_counter(self, s, counter):
+        yield from self.write_reg(s, 54, counter)
+        value = 0
+        for reg in (55, 56, 57):
+            yield s.regset.adr_i.eq(reg)
+            yield s.regset.rd_i.eq(1)
+            yield Settle()
+            value = (value << 8) | (yield s.regset.dat_o)
+            yield
+            yield s.regset.rd_i.eq(0)
+        return value
+
+    def test_perf_counters(self):
+        s = MPESystem()
+        s.vram.mem.init = [0] * 256
+
+        sim = Simulator(s)
+        sim.add_clock(1e-6)
+
+        vfe = vfe_contention(s, 4)
+
+        clocks = [0]
+        pulses = []
+
+        def clock():
+            yield Passive()
+            while True:
+                yield
+                clocks[0] += 1
+
+        def vsync():
+            pulses.append(clocks[0])
+            yield s.regset.int_vsync.eq(1)
+            yield
+            yield s.regset.int_vsync.eq(0)
+            yield
+
+        def host():
+            # A live reading falls between direct reads of the counter
+            # taken before and after it.
+            before = yield s.arb.pc_idle
+            idle = yield from self.read_counter(s, PC_IDLE)
+            after = yield s.arb.pc_idle
+            self.assertTrue(before <= idle <= after)
+
+            # The reading is captured when R54 is written, so R55-R57 agree
+            # with one another however slowly the host reads them.
+            for _ in range(100):
+                yield
+            before = yield s.arb.pc_idle
+            yield from self.write_reg(s, 54, PC_IDLE)
+            after = yield s.arb.pc_idle
+            held = 0
+            for reg in (55, 56, 57):
+                for _ in range(100):
+                    yield
+                yield s.regset.adr_i.eq(reg)
+                yield Settle()
+                held = (held << 8) | (yield s.regset.dat_o)
+            self.assertTrue(before <= held <= after)
+
+            # A fill under contention: one op for the byte written through
+            # R31, and one for the block operation.
+            yield from self.write_reg(s, 18, 0x00)
+            yield from self.write_reg(s, 19, 0x10)
+            yield from self.wait_ready(s)
+            ops = yield from self.read_counter(s, PC_MPE_OPS)
+            grants = yield from self.read_counter(s, PC_MPE_GRANTS)
+            stalls = yield from self.read_counter(s, PC_MPE_STALLS)
+            yield from self.write_reg(s, 31, 0x55)
+            yield from self.wait_ready(s)
+            yield from self.write_reg(s, 30, 100)
+            yield from self.wait_ready(s)
+            self.assertEqual((yield from self.read_counter(s, PC_MPE_OPS)) - ops, 2)
+            self.assertGreaterEqual(
+                (yield from self.read_counter(s, PC_MPE_GRANTS)) - grants, 101
+            )
+            self.assertGreater(
+                (yield from self.read_counter(s, PC_MPE_STALLS)) - stalls, 0
+            )
+
+            # With snapshots selected, readings hold still between vertical
+            # syncs, and every clock between two of them is counted once as
+            # a VFE grant, an MPE grant, or an idle cycle.
+            yield from self.write_reg(s, 58, 0x1F)
+            yield from vsync()
+            first = []
+            for counter in (PC_VFE_GRANTS, PC_MPE_GRANTS, PC_IDLE):
+                first.append((yield from self.read_counter(s, counter)))
+            self.assertEqual((yield from self.read_counter(s, PC_IDLE)), first[2])
+            yield from self.write_reg(s, 30, 50)
+            yield from self.wait_ready(s)
+            yield from vsync()
+            second = []
+            for counter in (PC_VFE_GRANTS, PC_MPE_GRANTS, PC_IDLE):
+                second.append((yield from self.read_counter(s, counter)))
+            elapsed = sum(b - a for a, b in zip(first, second))
+            self.assertEqual(elapsed, pulses[1] - pulses[0])
+
+        sim.add_sync_process(clock)
+        sim.add_sync_process(vfe)
+        sim.add_sync_process(host)
+        sim.run()
+
+    def test_posted_writes(self):
+        init = [0] * 256
+        for contention in (0, 6):
+            with self.subTest(contention=contention):
+                s = MPESystem()
+                s.vram.mem.init = init
+                stalls = []
+
+                sim = Simulator(s)
+                sim.add_clock(1e-6)
+
+                vfe = vfe_contention(s, contention)
+
+                def host():
+                    yield from self.write_reg(s, 18, 0x00)
+                    yield from self.write_reg(s, 19, 0x40)
+                    yield from self.wait_ready(s)
+
+                    # Write a run of bytes as fast as the host bus allows,
+                    # polling ready only as the firmware would.
+                    for i in range(16):
+                        if not (yield s.mpe.ready):
+                            stalls.append(i)
+                            yield from self.wait_ready(s)
+                        yield from self.write_reg(s, 31, 0x80 + i)
+                        yield
+
+                    self.assertEqual((yield s.regset.update_location), 0x50)
+
+                    # Wait for the queue to drain and the CPU Data register
+                    # to catch up, as reported through R38.
+                    for _ in range(256):
+                        yield s.regset.adr_i.eq(38)
+                        yield
+                        if not ((yield s.regset.dat_o) & 0x80):
+                            break
+                    else:
+                        self.fail("CPU Data register never refreshed")
+
+                    self.assertEqual((yield s.wq.level), 0)
+                    self.assertEqual((yield s.mpe.cpudatar), (yield s.vram.mem[0x50]))
+                    for i in range(16):
+                        self.assertEqual((yield s.vram.mem[0x40 + i]), 0x80 + i)
+
+                sim.add_sync_process(vfe)
+                sim.add_sync_process(host)
+                sim.run()
+
+                # Without contention, the MPE keeps up with the host.
+                if contention == 0:
+                    self.assertEqual(stalls, [])
+
+    def read_cpudata(self, s):
+        yield s.regset.adr_i.eq(31)
+        yield
+        byte = yield s.regset.dat_o
+        yield s.regset.rd_i.eq(1)
+        yield
+        yield s.regset.rd_i.eq(0)
+        return byte
+
+    def test_read_ahead(self):
+        init = [(i * 13 + 5) & 0xFF for i in range(256)]
+        # Reads (None) and writes interleaved, so that some writes land
+        # inside the read-ahead buffer.
+        ops = [None] * 12 + [0x11, 0x22, None, None, 0x33] + [None] * 8
+        for contention in (0, 6):
+            with self.subTest(contention=contention):
+                s = MPESystem()
+                s.vram.mem.init = init
+                waits = []
+
+                sim = Simulator(s)
+                sim.add_clock(1e-6)
+
+                vfe = vfe_contention(s, contention)
+
+                def host():
+                    model = list(init)
+                    loc = 0x30
+                    yield from self.write_reg(s, 18, 0x00)
+                    yield from self.write_reg(s, 19, loc)
+                    yield from self.wait_ready(s)
+
+                    for i, op in enumerate(ops):
+                        # Give the MPE roughly the time a host bus cycle
+                        # would, then act as the firmware does.
+                        for _ in range(8):
+                            yield
+                        if op is None:
+                            for _ in range(256):
+                                yield s.regset.adr_i.eq(38)
+                                yield
+                                if not ((yield s.regset.dat_o) & 0x80):
+                                    break
+                            yield from self.wait_ready(s)
+                            byte = yield from self.read_cpudata(s)
+                            self.assertEqual(byte, model[loc], "read {}".format(i))
+                            yield
+                            if not (yield s.mpe.ready):
+                                waits.append(i)
+                        else:
+                            yield from self.write_reg(s, 31, op)
+                            model[loc] = op
+                        loc += 1
+
+                sim.add_sync_process(vfe)
+                sim.add_sync_process(host)
+                sim.run()
+
+                # Without contention, sequential reads are served from the
+                # read-ahead buffer, and never make the host wait.
+                if contention == 0:
+                    self.assertEqual(waits, [])
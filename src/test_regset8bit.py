@@ -15,7 +15,7 @@ from nmigen.hdl.ast import (
 )
 
 
-from interfaces import create_regset8bit_interface
+from interfaces import PC_MPE_OPS, PC_VFE_GRANTS, create_regset8bit_interface
 from regset8bit import RegSet8Bit
 
 
@@ -79,11 +79,23 @@ class RegSet8BitFormal(Elaboratable):
 
             self.update_location.eq(dut.update_location),
             self.copysrc.eq(dut.copysrc),
+            self.cpudataw.eq(dut.cpudataw),
             self.bytecnt.eq(dut.bytecnt),
+            self.rows.eq(dut.rows),
+            self.rop.eq(dut.rop),
+            self.wrmask.eq(dut.wrmask),
+            self.descending.eq(dut.descending),
+            self.stride.eq(dut.stride),
+            self.dualplane.eq(dut.dualplane),
+            self.attrfill.eq(dut.attrfill),
+            self.wrrepeat.eq(dut.wrrepeat),
+            self.listptr.eq(dut.listptr),
             self.go_wr_updloc.eq(dut.go_wr_updloc),
             self.go_rd_cpudatar.eq(dut.go_rd_cpudatar),
             self.go_wr_cpudataw.eq(dut.go_wr_cpudataw),
             self.go_wr_bytecnt.eq(dut.go_wr_bytecnt),
+            self.go_wr_listptr.eq(dut.go_wr_listptr),
+            self.irq.eq(dut.irq),
         ]
 
         # Connect DUT inputs.  These will be driven by the formal verifier
@@ -97,9 +109,56 @@ class RegSet8BitFormal(Elaboratable):
             dut.cpudatar.eq(self.cpudatar),
             dut.incr_updloc.eq(self.incr_updloc),
             dut.incr_copysrc.eq(self.incr_copysrc),
+            dut.decr_updloc.eq(self.decr_updloc),
+            dut.decr_copysrc.eq(self.decr_copysrc),
             dut.decr_bytecnt.eq(self.decr_bytecnt),
+            dut.next_row.eq(self.next_row),
+            dut.ld_desc.eq(self.ld_desc),
+            dut.desc_dst.eq(self.desc_dst),
+            dut.desc_src.eq(self.desc_src),
+            dut.desc_len.eq(self.desc_len),
+            dut.list_done.eq(self.list_done),
+            dut.cpudatar_stale.eq(self.cpudatar_stale),
+            dut.wq_level.eq(self.wq_level),
+
+            dut.int_mpe.eq(self.int_mpe),
+            dut.int_vsync.eq(self.int_vsync),
+            dut.rasterline.eq(self.rasterline),
+
+            dut.pc_vfe.eq(self.pc_vfe),
+            dut.pc_mpe.eq(self.pc_mpe),
+            dut.pc_stall.eq(self.pc_stall),
+            dut.pc_idle.eq(self.pc_idle),
+            dut.pc_ops.eq(self.pc_ops),
         ]
 
+        # The MPE steps to the next row of a rectangular block operation
+        # only between accesses, while holding the host off.
+        with m.If(self.next_row):
+            comb += [
+                Assume(~self.incr_updloc),
+                Assume(~self.incr_copysrc),
+                Assume(~self.decr_updloc),
+                Assume(~self.decr_copysrc),
+                Assume(~self.decr_bytecnt),
+                Assume(~self.we_i),
+                Assume(~self.rd_i),
+            ]
+
+        # Likewise, command list descriptors are loaded while the MPE holds
+        # the host off and steps no pointers.
+        with m.If(self.ld_desc):
+            comb += [
+                Assume(~self.incr_updloc),
+                Assume(~self.incr_copysrc),
+                Assume(~self.decr_updloc),
+                Assume(~self.decr_copysrc),
+                Assume(~self.decr_bytecnt),
+                Assume(~self.next_row),
+                Assume(~self.we_i),
+                Assume(~self.rd_i),
+            ]
+
         # When the register selected is valid, only that register's results
         # are offered on the dat_o bus.  Otherwise, dat_o must be 0xFF.
 
@@ -187,7 +246,7 @@ class RegSet8BitFormal(Elaboratable):
             comb += Assert(self.dat_o[5:8] == self.fontbase)
 
         with m.If(self.adr_i == 30):
-            comb += Assert(self.dat_o == self.bytecnt)
+            comb += Assert(self.dat_o == self.bytecnt[0:8])
 
         with m.If(self.adr_i == 31):
             comb += Assert(self.dat_o == self.cpudatar)
@@ -203,6 +262,45 @@ class RegSet8BitFormal(Elaboratable):
         with m.If(self.adr_i == 37):
             comb += Assert(self.dat_o == Cat(Const(-1, 6), self.vsync_xor, self.hsync_xor))
 
+        with m.If(self.adr_i == 38):
+            comb += Assert(self.dat_o == Cat(
+                self.wq_level,
+                Const(0, 2),
+                self.list_done,
+                self.cpudatar_stale,
+            ))
+
+        with m.If(self.adr_i == 39):
+            comb += Assert(self.dat_o == self.bytecnt[8:16])
+
+        with m.If(self.adr_i == 40):
+            comb += Assert(self.dat_o == self.rows)
+
+        with m.If(self.adr_i == 43):
+            comb += Assert(self.dat_o == Cat(self.rop, self.descending, self.dualplane, Const(-1, 3)))
+
+        with m.If(self.adr_i == 44):
+            comb += Assert(self.dat_o == self.wrmask)
+
+        with m.If(self.adr_i == 45):
+            comb += Assert(self.dat_o == self.listptr[8:16])
+
+        with m.If(self.adr_i == 46):
+            comb += Assert(self.dat_o == self.listptr[0:8])
+            with m.If(self.we_i):
+                comb += Assert(self.go_wr_listptr)
+
+        with m.If(self.adr_i == 47):
+            comb += Assert(self.dat_o == self.stride)
+        with m.If(self.adr_i == 48):
+            comb += Assert(self.dat_o == self.attrfill)
+        with m.If(self.adr_i == 49):
+            comb += Assert(self.dat_o == Cat(self.wrrepeat, Const(-1, 4)))
+
+        ## Negative Tests
+        with m.If((self.adr_i != 46) | ~self.we_i):
+            comb += Assert(~self.go_wr_listptr)
+
         with m.If(self.adr_i == 63):
             comb += Assert(self.dat_o == Const(-1, len(self.dat_o)))
 
@@ -217,26 +315,165 @@ class RegSet8BitFormal(Elaboratable):
                 Assert(self.vsync_xor == 1),
             ]
 
-        # After reading from the CPU Data port,
-        # the pointer must auto-increment.
+        # After reset, block operations store their source bytes unchanged.
+        with m.If(Past(rst) & ~rst):
+            sync += [
+                Assert(self.rop == 0),
+                Assert(self.wrmask == 0xFF),
+                Assert(self.stride == 1),
+            ]
+
+        # After reading from or writing to the CPU Data port,
+        # the pointer must advance by the stride in R47.  Writes are posted to the write
+        # queue with the address they were made to, and step past every
+        # copy R49 asks the MPE to store.
         with m.If(past_valid & (Past(self.adr_i) == 31)):
-            with m.If(Past(self.rd_i)):
-                sync += Assert(self.update_location == (Past(self.update_location) + 1)[0:16])
+            with m.If(Past(self.we_i) & (Past(self.wrrepeat) > 1)):
+                sync += Assert(self.update_location == (Past(self.update_location) + Past(self.stride) * Past(self.wrrepeat))[0:16])
+            with m.Elif(Past(self.rd_i) | Past(self.we_i)):
+                sync += Assert(self.update_location == (Past(self.update_location) + Past(self.stride))[0:16])
 
-            with m.If(Past(self.we_i) & ~Past(self.rd_i) & ~Past(self.incr_updloc)):
-                sync += Assert(Stable(self.update_location))
+            with m.If(Past(self.we_i)):
+                sync += Assert(Past(self.go_wr_cpudataw))
 
-        # Pointers must also increment when instructed by the MPE.
+        # Pointers must also advance when instructed by the MPE.
         with m.If(past_valid & Past(self.incr_updloc)):
-            sync += Assert(self.update_location == (Past(self.update_location) + 1)[0:16])
+            sync += Assert(self.update_location == (Past(self.update_location) + Past(self.stride))[0:16])
 
         with m.If(past_valid & Past(self.incr_copysrc)):
-            sync += Assert(self.copysrc == (Past(self.copysrc) + 1)[0:16])
+            sync += Assert(self.copysrc == (Past(self.copysrc) + Past(self.stride))[0:16])
+
+        # Descending block operations step them down instead.  The MPE
+        # never steps a pointer both ways at once, and the host is held
+        # off while it steps them down.
+        with m.If(self.decr_updloc):
+            comb += [
+                Assume(~self.incr_updloc),
+                Assume(~self.we_i),
+                Assume(~self.rd_i),
+            ]
+        with m.If(self.decr_copysrc):
+            comb += Assume(~self.incr_copysrc)
+
+        with m.If(past_valid & Past(self.decr_updloc)):
+            sync += Assert(self.update_location == (Past(self.update_location) - Past(self.stride))[0:16])
+
+        with m.If(past_valid & Past(self.decr_copysrc)):
+            sync += Assert(self.copysrc == (Past(self.copysrc) - Past(self.stride))[0:16])
 
         # The byte counter is the only register which the MPE instructs to decrement.
         # The MPE is responsible for not underflowing the counter.
         with m.If(past_valid & Past(self.decr_bytecnt)):
-            sync += Assert(self.bytecnt == (Past(self.bytecnt) - 1)[0:8])
+            sync += Assert(self.bytecnt == (Past(self.bytecnt) - 1)[0:16])
+
+        # Rectangular block operations count rows down as the MPE steps
+        # from one row to the next.
+        with m.If(past_valid & Past(self.next_row)):
+            sync += Assert(self.rows == (Past(self.rows) - 1)[0:8])
+
+        # A command list descriptor loads the pointers and length of its
+        # block operation, and leaves the host's other settings alone.
+        with m.If(past_valid & Past(self.ld_desc)):
+            sync += [
+                Assert(self.update_location == Past(self.desc_dst)),
+                Assert(self.copysrc == Past(self.desc_src)),
+                Assert(self.bytecnt == Past(self.desc_len)),
+            ]
+        with m.If(past_valid & Past(self.ld_desc) & ~Past(self.we_i)):
+            sync += [
+                Assert(Stable(self.block_copy)),
+                Assert(Stable(self.rop)),
+                Assert(Stable(self.descending)),
+                Assert(Stable(self.dualplane)),
+                Assert(Stable(self.attrfill)),
+                Assert(Stable(self.cpudataw)),
+            ]
+
+        # The byte count's high byte comes up zero, so software unaware of
+        # R39 only ever starts 8-bit block operations.
+        with m.If(Past(rst) & ~rst):
+            sync += Assert(self.bytecnt[8:16] == 0)
+
+        # Interrupt sources latch their status bits (R51) on the clock
+        # after the event, and stay latched until acknowledged.  A level
+        # already high as reset ends is not an event, so R51 reads zero
+        # after reset.
+        with m.If(past_valid & Past(z_past_valid) & (self.adr_i == 51)):
+            with m.If(Past(self.int_mpe) & ~Past(self.int_mpe, 2)):
+                comb += Assert(self.dat_o[0])
+            with m.If(Past(self.int_vsync) & ~Past(self.int_vsync, 2)):
+                comb += Assert(self.dat_o[1])
+
+        with m.If(Past(rst, 2) & ~Past(rst) & ~rst & (self.adr_i == 51)):
+            comb += Assert(self.dat_o[0:3] == 0)
+
+        # Acknowledging an event clears its status bit, unless it happens
+        # again at the same time.
+        with m.If(past_valid & Past(self.we_i) & (Past(self.adr_i) == 51) &
+                  Past(self.dat_i)[0] & ~(Past(self.int_mpe) & ~Past(self.int_mpe, 2)) &
+                  (self.adr_i == 51)):
+            comb += Assert(~self.dat_o[0])
+
+        # No interrupt is requested while every source is disabled.
+        with m.If(past_valid & Past(self.we_i) & (Past(self.adr_i) == 50) &
+                  (Past(self.dat_i)[0:3] == 0)):
+            comb += Assert(~self.irq)
+
+        with m.If(Past(rst) & ~rst):
+            sync += Assert(~self.irq)
+
+        # The high bytes of the row strides (R59, R60) read back what was
+        # written.
+        for reg in (59, 60):
+            with m.If(past_valid & Past(self.we_i) & (Past(self.adr_i) == reg) &
+                      (self.adr_i == reg)):
+                comb += Assert(self.dat_o == Past(self.dat_i))
+
+        # The performance counter select (R54) and snapshot mask (R58)
+        # read back what was written.
+        with m.If(past_valid & Past(self.we_i) & (Past(self.adr_i) == 54) &
+                  (self.adr_i == 54)):
+            comb += Assert(self.dat_o == Cat(Past(self.dat_i)[0:3], Const(-1, 5)))
+        with m.If(past_valid & Past(self.we_i) & (Past(self.adr_i) == 58) &
+                  (self.adr_i == 58)):
+            comb += Assert(self.dat_o == Cat(Past(self.dat_i)[0:5], Const(-1, 3)))
+
+        # With its snapshot bit clear, a counter reads live: writing R54
+        # captures all of it in one clock for R55, R56 and R57.
+        live_vfe = Signal(1)
+        comb += live_vfe.eq(
+            past_valid &
+            Past(self.we_i, 3) & (Past(self.adr_i, 3) == 58) &
+            ~Past(self.dat_i, 3)[PC_VFE_GRANTS] &
+            Past(self.we_i, 2) & (Past(self.adr_i, 2) == 54) &
+            (Past(self.dat_i, 2)[0:3] == PC_VFE_GRANTS) &
+            ~Past(self.we_i)
+        )
+        with m.If(live_vfe):
+            with m.If(self.adr_i == 55):
+                comb += Assert(self.dat_o == Past(self.pc_vfe)[16:24])
+            with m.If(self.adr_i == 56):
+                comb += Assert(self.dat_o == Past(self.pc_vfe)[8:16])
+            with m.If(self.adr_i == 57):
+                comb += Assert(self.dat_o == Past(self.pc_vfe)[0:8])
+
+        # The capture holds still until R54 is written again.
+        with m.If(past_valid & (self.adr_i == Past(self.adr_i)) &
+                  (self.adr_i >= 55) & (self.adr_i <= 57) &
+                  ~(Past(self.we_i, 2) & (Past(self.adr_i, 2) == 54))):
+            comb += Assert(Stable(self.dat_o))
+
+        # With its snapshot bit set, it reads the value it had when vertical
+        # sync last began.
+        with m.If(past_valid &
+                  Past(self.we_i, 3) & (Past(self.adr_i, 3) == 58) &
+                  Past(self.dat_i, 3)[PC_MPE_OPS] &
+                  Past(self.we_i, 2) & (Past(self.adr_i, 2) == 54) &
+                  (Past(self.dat_i, 2)[0:3] == PC_MPE_OPS) &
+                  ~Past(self.we_i) &
+                  Past(self.int_vsync, 2) & ~Past(self.int_vsync, 3) &
+                  (self.adr_i == 55)):
+            comb += Assert(self.dat_o == Past(self.pc_ops, 2)[16:24])
 
         # Font glyphs can be 16 bytes of 32 bytes tall, depending on the
         # setting of R9[0:5].  tallfont is asserted if the glyphs are
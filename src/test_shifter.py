@@ -7,6 +7,7 @@ from nmigen import (
     ResetSignal,
     Signal,
 )
+from nmigen.back.pysim import Simulator
 from nmigen.hdl.ast import (
     Assert,
     Assume,
@@ -21,9 +22,12 @@ from shifter import Shifter
 
 
 class ShifterFormal(Elaboratable):
-    def __init__(self):
+    def __init__(self, strip_width=4):
         super().__init__()
-        create_shifter_interface(self, platform="formal")
+        self.strip_width = strip_width
+        create_shifter_interface(
+            self, platform="formal", strip_width=strip_width
+        )
 
     def elaborate(self, platform):
         m = Module()
@@ -37,7 +41,11 @@ class ShifterFormal(Elaboratable):
         z_past_valid = Signal(1, reset=0)
         sync += z_past_valid.eq(1)
 
-        dut = Shifter(platform=platform)
+        strip_width = self.strip_width
+        columns = self.fv_sbsm_columns
+        last = strip_width - 1
+
+        dut = Shifter(platform=platform, strip_width=strip_width)
         m.submodules.dut = dut
         rst = ResetSignal()
 
@@ -56,10 +64,6 @@ class ShifterFormal(Elaboratable):
             self.fv_sbsm_prefetch.eq(dut.fv_sbsm_prefetch),
             self.fv_sbsm_wait_den.eq(dut.fv_sbsm_wait_den),
             self.fv_lpic.eq(dut.fv_lpic),
-            self.fv_sbsm_column0.eq(dut.fv_sbsm_column0),
-            self.fv_sbsm_column1.eq(dut.fv_sbsm_column1),
-            self.fv_sbsm_column2.eq(dut.fv_sbsm_column2),
-            self.fv_sbsm_column3.eq(dut.fv_sbsm_column3),
             self.fv_pixctr.eq(dut.fv_pixctr),
             self.fv_lastrow.eq(dut.fv_lastrow),
             self.fv_bump_atrptr.eq(dut.fv_bump_atrptr),
@@ -73,7 +77,11 @@ class ShifterFormal(Elaboratable):
             self.atrptr.eq(dut.atrptr),
             self.chrptr.eq(dut.chrptr),
             self.ra.eq(dut.ra),
+            self.first_raster.eq(dut.first_raster),
+            self.swap_ctr.eq(dut.swap_ctr),
         ]
+        for mine, theirs in zip(columns, dut.fv_sbsm_columns):
+            comb += mine.eq(theirs)
 
         # Connect DUT inputs.  These will be driven by the formal verifier
         # for us, based on assertions and assumptions.
@@ -140,6 +148,26 @@ class ShifterFormal(Elaboratable):
         with m.If(self.fv_lastrow):
             comb += Assert(self.ra == self.vct)
 
+        # first_raster is set along with ra for the first raster of a
+        # character row, and only cleared once a raster has been fetched.
+        line_fetched = Signal(1)
+        with m.If(self.go_ldptr):
+            sync += line_fetched.eq(1)
+        with m.Elif(hs1 & ~self.hs):
+            sync += line_fetched.eq(0)
+
+        with m.If(past_valid & ~Past(vden1) & Past(self.vden)):
+            sync += Assert(self.first_raster)
+        with m.Elif(past_valid & Past(hs1) & ~Past(self.hs)):
+            with m.If(Past(self.fv_lastrow)):
+                sync += Assert(self.first_raster)
+            with m.Elif(Past(line_fetched)):
+                sync += Assert(~self.first_raster)
+            with m.Else():
+                sync += Assert(Stable(self.first_raster))
+        with m.Elif(past_valid):
+            sync += Assert(Stable(self.first_raster))
+
         # Attribute pointer is reset to atrbase when starting a new frame
         # starts.  It increments only when displaying the last line of a
         # character row.
@@ -302,69 +330,57 @@ class ShifterFormal(Elaboratable):
                 with m.Else():
                     comb += Assert(Past(self.go_prefetch))
                     with m.If(Past(self.fv_lpic)):
-                        sync += Assert(self.fv_sbsm_column1)
-                    with m.Else():
-                        sync += Assert(self.fv_sbsm_column0)
-
-            with m.If(Past(self.fv_sbsm_column0)):
-                comb += [
-                    Assert(Past(self.padr) == 0),
-                    Assert(~Past(self.go_prefetch)),
-                    Assert(~Past(self.swap_strip)),
-                ]
-                with m.If(~Past(self.den)):
-                    sync += Assert(self.fv_sbsm_wait_hs)
-                with m.Else():
-                    with m.If(~Past(self.fv_lpic)):
-                        sync += Assert(self.fv_sbsm_column0)
-                    with m.Else():
-                        sync += Assert(self.fv_sbsm_column1)
-
-            with m.If(Past(self.fv_sbsm_column1)):
-                comb += [
-                    Assert(Past(self.padr) == 1),
-                    Assert(~Past(self.go_prefetch)),
-                    Assert(~Past(self.swap_strip)),
-                ]
-                with m.If(~Past(self.den)):
-                    sync += Assert(self.fv_sbsm_wait_hs)
-                with m.Else():
-                    with m.If(~Past(self.fv_lpic)):
-                        sync += Assert(self.fv_sbsm_column1)
-                    with m.Else():
-                        sync += Assert(self.fv_sbsm_column2)
-
-            with m.If(Past(self.fv_sbsm_column2)):
-                comb += [
-                    Assert(Past(self.padr) == 2),
-                    Assert(~Past(self.go_prefetch)),
-                    Assert(~Past(self.swap_strip)),
-                ]
-                with m.If(~Past(self.den)):
-                    sync += Assert(self.fv_sbsm_wait_hs)
-                with m.Else():
-                    with m.If(~Past(self.fv_lpic)):
-                        sync += Assert(self.fv_sbsm_column2)
+                        sync += Assert(columns[1])
                     with m.Else():
-                        sync += Assert(self.fv_sbsm_column3)
+                        sync += Assert(columns[0])
 
-            with m.If(Past(self.fv_sbsm_column3)):
-                comb += Assert(Past(self.padr) == 3)
-                with m.If(~Past(self.den)):
-                    sync += Assert(self.fv_sbsm_wait_hs)
-                with m.Else():
-                    with m.If(~Past(self.fv_lpic)):
-                        sync += Assert(self.fv_sbsm_column3)
+            for i, column in enumerate(columns):
+                with m.If(Past(column)):
+                    comb += Assert(Past(self.padr) == i)
+                    if i < last:
                         comb += [
                             Assert(~Past(self.go_prefetch)),
                             Assert(~Past(self.swap_strip)),
                         ]
+                    with m.If(~Past(self.den)):
+                        sync += Assert(self.fv_sbsm_wait_hs)
                     with m.Else():
-                        sync += Assert(self.fv_sbsm_column0)
-                        comb += [
-                            Assert(Past(self.go_prefetch)),
-                            Assert(Past(self.swap_strip)),
-                        ]
+                        with m.If(~Past(self.fv_lpic)):
+                            sync += Assert(column)
+                            if i == last:
+                                comb += [
+                                    Assert(~Past(self.go_prefetch)),
+                                    Assert(~Past(self.swap_strip)),
+                                ]
+                        with m.Else():
+                            if i < last:
+                                sync += Assert(columns[i + 1])
+                            else:
+                                sync += Assert(columns[0])
+                                comb += [
+                                    Assert(Past(self.go_prefetch)),
+                                    Assert(Past(self.swap_strip)),
+                                ]
+
+        # The swap counter is reloaded with the clocks in one strip when
+        # the strips are swapped during active display, and otherwise
+        # counts down to zero.  Outside the display columns, no swap is
+        # scheduled, so it reads zero.
+        in_columns = Signal(1)
+        comb += in_columns.eq(Cat(*columns).any())
+
+        with m.If(~in_columns):
+            comb += Assert(self.swap_ctr == 0)
+
+        with m.If(past_valid & in_columns):
+            with m.If(Past(columns[last]) & Past(self.swap_strip)):
+                sync += Assert(self.swap_ctr == Cat(
+                    Const(last, len(self.padr)), Past(self.hct)
+                ))
+            with m.Elif(Past(self.swap_ctr) != 0):
+                sync += Assert(self.swap_ctr == Past(self.swap_ctr) - 1)
+            with m.Else():
+                sync += Assert(self.swap_ctr == 0)
 
         return m
 
@@ -373,3 +389,158 @@ class ShifterTestCase(FHDLTestCase):
     def test_shifter(self):
         self.assertFormal(ShifterFormal(), mode='bmc', depth=100)
         self.assertFormal(ShifterFormal(), mode='prove', depth=100)
+
+    def test_shifter_strip_widths(self):
+        for strip_width in (8, 16):
+            with self.subTest(strip_width=strip_width):
+                self.assertFormal(
+                    ShifterFormal(strip_width=strip_width),
+                    mode='bmc', depth=100,
+                )
+                self.assertFormal(
+                    ShifterFormal(strip_width=strip_width),
+                    mode='prove', depth=100,
+                )
+
+    def test_line_fetch(self):
+        # With a line buffer, each scanline is fetched whole, one go_fetch
+        # per strip, starting when the previous scanline ends, into
+        # alternating halves of the line buffer.
+        m = Module()
+        dut = m.submodules.dut = Shifter(line_buffer=True)
+
+        # A fetch engine that takes a few clocks per strip.
+        busy = Signal(2)
+        with m.If(dut.fetch_started):
+            m.d.sync += busy.eq(3)
+        with m.Elif(busy != 0):
+            m.d.sync += busy.eq(busy - 1)
+        m.d.comb += [
+            dut.fetch_started.eq(dut.go_fetch & (busy == 0)),
+            dut.done_prefetch.eq(1),
+        ]
+
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+
+        def fetch_line():
+            # Returns the ldptr flags of each strip fetched.
+            ldptrs = []
+            for _ in range(64):
+                if (yield dut.fetch_started):
+                    ldptrs.append((yield dut.fetch_ldptr))
+                yield
+            return ldptrs
+
+        def process():
+            yield dut.hd.eq(8)
+            yield dut.vct.eq(7)
+            yield dut.vscroll.eq(2)
+            yield
+            # The first line of a frame is fetched during the last blanked
+            # one, which vden_next marks.
+            yield dut.vden_next.eq(1)
+            yield
+            self.assertEqual((yield from fetch_line()), [1, 0, 0, 0])
+            self.assertEqual((yield dut.ra), 2)
+            lhalf = (yield dut.lhalf)
+
+            # The line is shown from the half it was fetched into, once
+            # VDEN rises at the end of HSYNC.
+            yield dut.hs.eq(1)
+            yield
+            yield
+            yield dut.hs.eq(0)
+            yield dut.vden_next.eq(0)
+            yield dut.vden.eq(1)
+            for _ in range(4):
+                yield
+            self.assertEqual((yield dut.shalf), lhalf)
+
+            # The end of the displayed line starts the next fetch.
+            yield dut.den.eq(1)
+            for _ in range(8):
+                yield
+            self.assertEqual((yield from fetch_line()), [])
+            yield dut.den.eq(0)
+            yield
+            self.assertEqual((yield from fetch_line()), [1, 0, 0, 0])
+            self.assertEqual((yield dut.ra), 3)
+            self.assertEqual((yield dut.lhalf), 1 - lhalf)
+
+        sim.add_sync_process(process)
+        sim.run()
+
+    def vdc2_frame(self, **kwargs):
+        """
+        Runs a whole VDC2 with a tiny bitmap screen of 8 columns and 3 rows
+        of 2 rasters, and returns one frame of its pixels, a list per line.
+        """
+        from vdc2 import VDC2
+
+        dut = VDC2(abus_width=8, **kwargs)
+        regs = [
+            (0, 19), (1, 8), (2, 12), (3, 0x22), (4, 5), (5, 0), (6, 3),
+            (7, 4), (9, 1), (22, 0x78), (24, 0), (25, 0x80), (26, 0xF0),
+            (37, 0), (12, 0), (13, 0), (18, 0), (19, 0),
+        ]
+        image = [(i * 37 + 0x5A) & 0xFF for i in range(48)]
+        lines = []
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def write_reg(reg, byte):
+            while not (yield dut.ready_o):
+                yield
+            yield dut.adr_i.eq(reg)
+            yield dut.dat_i.eq(byte)
+            yield dut.we_i.eq(1)
+            yield
+            yield dut.we_i.eq(0)
+            yield
+
+        def process():
+            for reg, byte in regs:
+                yield from write_reg(reg, byte)
+            for byte in image:
+                yield from write_reg(31, byte)
+
+            # Let the frame being drawn while the screen was set up go by.
+            for _ in range(2):
+                while not (yield dut.raw_vs):
+                    yield
+                while (yield dut.raw_vs):
+                    yield
+
+            line = []
+            hs_prev = 0
+            for _ in range(12 * 20 * 8):
+                hs = (yield dut.hs)
+                if hs and not hs_prev:
+                    lines.append(line)
+                    line = []
+                hs_prev = hs
+                line.append((yield Cat(dut.i, dut.b, dut.g, dut.r)))
+                yield
+            lines.append(line)
+
+        sim.add_sync_process(process)
+        sim.run()
+        return lines
+
+    def test_line_buffer_first_raster(self):
+        # With a line buffer, the first raster of a frame is fetched during
+        # the last blanked one, and shows like every other.
+        expected = self.vdc2_frame()
+        shown = [line for line in expected if any(line)]
+        self.assertEqual(len(shown), 6)
+
+        for kwargs in (
+            {}, {"strip_width": 8}, {"strip_ram": True}, {"latency": 2},
+            {"row_cache": True},
+        ):
+            with self.subTest(**kwargs):
+                self.assertEqual(
+                    self.vdc2_frame(line_buffer=True, **kwargs), expected
+                )
@@ -21,9 +21,14 @@ from strip_buffer import StripBuffer
 
 
 class StripBufferFormal(Elaboratable):
-    def __init__(self):
+    def __init__(self, wide=False, strip_width=4, strip_ram=False):
         super().__init__()
-        create_strip_buffer_interface(self, platform="formal")
+        self.wide = wide
+        self.strip_width = strip_width
+        self.strip_ram = strip_ram
+        create_strip_buffer_interface(
+            self, platform="formal", wide=wide, strip_width=strip_width
+        )
 
     def elaborate(self, platform):
         m = Module()
@@ -37,23 +42,23 @@ class StripBufferFormal(Elaboratable):
         z_past_valid = Signal(1, reset=0)
         sync += z_past_valid.eq(1)
 
-        dut = StripBuffer(platform=platform)
+        dut = StripBuffer(
+            platform=platform, wide=self.wide, strip_width=self.strip_width,
+            strip_ram=self.strip_ram,
+        )
         m.submodules.dut = dut
         rst = ResetSignal()
 
         past_valid = Signal()
         comb += past_valid.eq(z_past_valid & Stable(rst) & ~rst)
 
+        cols_a = self.fv_cols_a
+        cols_b = self.fv_cols_b
+
         # Connect DUT outputs
+        for mine, theirs in zip(cols_a + cols_b, dut.fv_cols_a + dut.fv_cols_b):
+            comb += mine.eq(theirs)
         comb += [
-            self.fv_col0a.eq(dut.fv_col0a),
-            self.fv_col1a.eq(dut.fv_col1a),
-            self.fv_col2a.eq(dut.fv_col2a),
-            self.fv_col3a.eq(dut.fv_col3a),
-            self.fv_col0b.eq(dut.fv_col0b),
-            self.fv_col1b.eq(dut.fv_col1b),
-            self.fv_col2b.eq(dut.fv_col2b),
-            self.fv_col3b.eq(dut.fv_col3b),
             self.fv_ab.eq(dut.fv_ab),
 
             self.pair.eq(dut.pair),
@@ -67,6 +72,7 @@ class StripBufferFormal(Elaboratable):
             dut.swap.eq(self.swap),
             dut.cwe.eq(self.cwe),
             dut.awe.eq(self.awe),
+            dut.pwe.eq(self.pwe),
             dut.wadr.eq(self.wadr),
             dut.dat_i.eq(self.dat_i),
 
@@ -74,140 +80,72 @@ class StripBufferFormal(Elaboratable):
         ]
 
         # Pair output is selected asynchronously.
-        with m.If(~self.fv_ab):
-            with m.If(self.padr == 0):
-                comb += Assert(self.pair == self.fv_col0a)
-            with m.If(self.padr == 1):
-                comb += Assert(self.pair == self.fv_col1a)
-            with m.If(self.padr == 2):
-                comb += Assert(self.pair == self.fv_col2a)
-            with m.If(self.padr == 3):
-                comb += Assert(self.pair == self.fv_col3a)
-        with m.If(self.fv_ab):
-            with m.If(self.padr == 0):
-                comb += Assert(self.pair == self.fv_col0b)
-            with m.If(self.padr == 1):
-                comb += Assert(self.pair == self.fv_col1b)
-            with m.If(self.padr == 2):
-                comb += Assert(self.pair == self.fv_col2b)
-            with m.If(self.padr == 3):
-                comb += Assert(self.pair == self.fv_col3b)
+        for i, (col_a, col_b) in enumerate(zip(cols_a, cols_b)):
+            with m.If(self.padr == i):
+                with m.If(~self.fv_ab):
+                    comb += Assert(self.pair == col_a)
+                with m.Else():
+                    comb += Assert(self.pair == col_b)
 
         # Shifter pair output is selected asynchronously as well,
         # but always draws from the opposite set of registers.
-        with m.If(~self.fv_ab):
-            with m.If(self.sh_padr == 0):
-                comb += Assert(self.sh_pair == self.fv_col0b)
-            with m.If(self.sh_padr == 1):
-                comb += Assert(self.sh_pair == self.fv_col1b)
-            with m.If(self.sh_padr == 2):
-                comb += Assert(self.sh_pair == self.fv_col2b)
-            with m.If(self.sh_padr == 3):
-                comb += Assert(self.sh_pair == self.fv_col3b)
-        with m.If(self.fv_ab):
-            with m.If(self.sh_padr == 0):
-                comb += Assert(self.sh_pair == self.fv_col0a)
-            with m.If(self.sh_padr == 1):
-                comb += Assert(self.sh_pair == self.fv_col1a)
-            with m.If(self.sh_padr == 2):
-                comb += Assert(self.sh_pair == self.fv_col2a)
-            with m.If(self.sh_padr == 3):
-                comb += Assert(self.sh_pair == self.fv_col3a)
+        for i, (col_a, col_b) in enumerate(zip(cols_a, cols_b)):
+            with m.If(self.sh_padr == i):
+                with m.If(~self.fv_ab):
+                    comb += Assert(self.sh_pair == col_b)
+                with m.Else():
+                    comb += Assert(self.sh_pair == col_a)
 
         # We must swap strips when instructed to by the shifter.
         with m.If(past_valid & Past(self.swap)):
             sync += Assert(self.fv_ab == ~Past(self.fv_ab))
 
         # Character data is recorded in the low 8 bits of a pair.
-        with m.If(past_valid & Past(self.cwe) & ~Past(self.awe)):
-            with m.If(~Past(self.fv_ab)):
-                with m.If(Past(self.wadr) == 0):
-                    sync += [
-                        Assert(Past(self.fv_col0a)[8:16] == self.fv_col0a[8:16]),
-                        Assert(self.fv_col0a[0:8] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 1):
-                    sync += [
-                        Assert(Past(self.fv_col1a)[8:16] == self.fv_col1a[8:16]),
-                        Assert(self.fv_col1a[0:8] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 2):
-                    sync += [
-                        Assert(Past(self.fv_col2a)[8:16] == self.fv_col2a[8:16]),
-                        Assert(self.fv_col2a[0:8] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 3):
-                    sync += [
-                        Assert(Past(self.fv_col3a)[8:16] == self.fv_col3a[8:16]),
-                        Assert(self.fv_col3a[0:8] == Past(self.dat_i)),
-                    ]
-            with m.Else():
-                with m.If(Past(self.wadr) == 0):
-                    sync += [
-                        Assert(Past(self.fv_col0b)[8:16] == self.fv_col0b[8:16]),
-                        Assert(self.fv_col0b[0:8] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 1):
-                    sync += [
-                        Assert(Past(self.fv_col1b)[8:16] == self.fv_col1b[8:16]),
-                        Assert(self.fv_col1b[0:8] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 2):
-                    sync += [
-                        Assert(Past(self.fv_col2b)[8:16] == self.fv_col2b[8:16]),
-                        Assert(self.fv_col2b[0:8] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 3):
-                    sync += [
-                        Assert(Past(self.fv_col3b)[8:16] == self.fv_col3b[8:16]),
-                        Assert(self.fv_col3b[0:8] == Past(self.dat_i)),
-                    ]
-                
+        with m.If(past_valid & Past(self.cwe) & ~Past(self.awe) & ~Past(self.pwe)):
+            for i, (col_a, col_b) in enumerate(zip(cols_a, cols_b)):
+                with m.If(Past(self.wadr) == i):
+                    with m.If(~Past(self.fv_ab)):
+                        sync += [
+                            Assert(Past(col_a)[8:16] == col_a[8:16]),
+                            Assert(col_a[0:8] == Past(self.dat_i)[0:8]),
+                        ]
+                    with m.Else():
+                        sync += [
+                            Assert(Past(col_b)[8:16] == col_b[8:16]),
+                            Assert(col_b[0:8] == Past(self.dat_i)[0:8]),
+                        ]
+
         # Character data is recorded in the upper 8 bits of a pair.
-        with m.If(past_valid & ~Past(self.cwe) & Past(self.awe)):
-            with m.If(~Past(self.fv_ab)):
-                with m.If(Past(self.wadr) == 0):
-                    sync += [
-                        Assert(Past(self.fv_col0a)[0:8] == self.fv_col0a[0:8]),
-                        Assert(self.fv_col0a[8:16] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 1):
-                    sync += [
-                        Assert(Past(self.fv_col1a)[0:8] == self.fv_col1a[0:8]),
-                        Assert(self.fv_col1a[8:16] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 2):
-                    sync += [
-                        Assert(Past(self.fv_col2a)[0:8] == self.fv_col2a[0:8]),
-                        Assert(self.fv_col2a[8:16] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 3):
-                    sync += [
-                        Assert(Past(self.fv_col3a)[0:8] == self.fv_col3a[0:8]),
-                        Assert(self.fv_col3a[8:16] == Past(self.dat_i)),
-                    ]
-            with m.Else():
-                with m.If(Past(self.wadr) == 0):
-                    sync += [
-                        Assert(Past(self.fv_col0b)[0:8] == self.fv_col0b[0:8]),
-                        Assert(self.fv_col0b[8:16] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 1):
-                    sync += [
-                        Assert(Past(self.fv_col1b)[0:8] == self.fv_col1b[0:8]),
-                        Assert(self.fv_col1b[8:16] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 2):
-                    sync += [
-                        Assert(Past(self.fv_col2b)[0:8] == self.fv_col2b[0:8]),
-                        Assert(self.fv_col2b[8:16] == Past(self.dat_i)),
-                    ]
-                with m.If(Past(self.wadr) == 3):
-                    sync += [
-                        Assert(Past(self.fv_col3b)[0:8] == self.fv_col3b[0:8]),
-                        Assert(self.fv_col3b[8:16] == Past(self.dat_i)),
-                    ]
-                
+        with m.If(past_valid & ~Past(self.cwe) & Past(self.awe) & ~Past(self.pwe)):
+            for i, (col_a, col_b) in enumerate(zip(cols_a, cols_b)):
+                with m.If(Past(self.wadr) == i):
+                    with m.If(~Past(self.fv_ab)):
+                        sync += [
+                            Assert(Past(col_a)[0:8] == col_a[0:8]),
+                            Assert(col_a[8:16] == Past(self.dat_i)[0:8]),
+                        ]
+                    with m.Else():
+                        sync += [
+                            Assert(Past(col_b)[0:8] == col_b[0:8]),
+                            Assert(col_b[8:16] == Past(self.dat_i)[0:8]),
+                        ]
+
+        # With a 16-bit video RAM, a whole pair is written at once.
+        if self.wide:
+            with m.If(past_valid & Past(self.pwe) & ~Past(self.cwe) & ~Past(self.awe)):
+                for i, (col_a, col_b) in enumerate(zip(cols_a, cols_b)):
+                    with m.If(Past(self.wadr) == i):
+                        with m.If(~Past(self.fv_ab)):
+                            sync += [
+                                Assert(col_a == Past(self.dat_i)),
+                                Assert(col_b == Past(col_b)),
+                            ]
+                        with m.Else():
+                            sync += [
+                                Assert(col_b == Past(self.dat_i)),
+                                Assert(col_a == Past(col_a)),
+                            ]
+
         return m
 
 
@@ -215,3 +153,31 @@ class StripBufferTestCase(FHDLTestCase):
     def test_strip_buffer(self):
         self.assertFormal(StripBufferFormal(), mode='bmc', depth=100)
         self.assertFormal(StripBufferFormal(), mode='prove', depth=100)
+
+    def test_strip_buffer_wide(self):
+        self.assertFormal(StripBufferFormal(wide=True), mode='bmc', depth=100)
+        self.assertFormal(StripBufferFormal(wide=True), mode='prove', depth=100)
+
+    def test_strip_buffer_strip_widths(self):
+        for strip_width in (8, 16):
+            with self.subTest(strip_width=strip_width):
+                self.assertFormal(
+                    StripBufferFormal(strip_width=strip_width),
+                    mode='bmc', depth=100,
+                )
+                self.assertFormal(
+                    StripBufferFormal(strip_width=strip_width),
+                    mode='prove', depth=100,
+                )
+
+    def test_strip_buffer_ram(self):
+        for wide in (False, True):
+            with self.subTest(wide=wide):
+                self.assertFormal(
+                    StripBufferFormal(wide=wide, strip_ram=True),
+                    mode='bmc', depth=100,
+                )
+                self.assertFormal(
+                    StripBufferFormal(wide=wide, strip_ram=True),
+                    mode='prove', depth=100,
+                )
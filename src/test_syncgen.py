@@ -50,6 +50,7 @@ class SyncGenFormal(Elaboratable):
             self.xs.eq(dut.xs),
             self.xden.eq(dut.xden),
             self.rastclken.eq(dut.rastclken),
+            self.xden_next.eq(dut.xden_next),
 
             self.fv_xdot.eq(dut.fv_xdot),
             self.fv_xchr.eq(dut.fv_xchr),
@@ -237,6 +238,13 @@ class SyncGenFormal(Elaboratable):
             with m.If(Past(self.xclken) & Past(self.fv_xtotal)):
                 sync += Assert(self.fv_xdctr == Past(self.xd))
 
+        # xden_next gives a unit's notice of the display being enabled.
+        with m.If(past_valid & Past(self.dotclken) & Past(self.xden_next)):
+            comb += Assert(self.xden)
+
+        with m.If(past_valid & ~Past(self.xden) & self.xden):
+            comb += Assert(Past(self.dotclken) & Past(self.xden_next))
+
         return m
 
 
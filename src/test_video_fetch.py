@@ -4,6 +4,7 @@ from nmigen import (
     Const,
     Elaboratable,
     Module,
+    Mux,
     ResetSignal,
     Signal,
 )
@@ -15,21 +16,33 @@ from nmigen.hdl.ast import (
     Stable,
 )
 
+from nmigen.back.pysim import Settle, Simulator
+
 from interfaces import create_video_fetch_interface
 
+from blockram_arbiter import BlockRamArbiter
+from ram import RAM
+from strip_buffer import StripBuffer
 from video_fetch import VideoFetch
 
 
 class VideoFetchFormal(Elaboratable):
-    def __init__(self):
+    def __init__(self, latency=1, strip_width=4):
         super().__init__()
-        create_video_fetch_interface(self, platform="formal")
+        self.latency = latency
+        self.strip_width = strip_width
+        create_video_fetch_interface(
+            self, platform="formal", latency=latency, strip_width=strip_width
+        )
 
     def elaborate(self, platform):
         m = Module()
         sync = m.d.sync
         comb = m.d.comb
 
+        strip_width = self.strip_width
+        last = strip_width - 1
+
         # This flag indicates when it's safe to use Past(), Stable(), etc.
         # Required so we can detect the start of simulation and prevent literal
         # edge cases from giving false negatives concerning the behavior of the
@@ -37,7 +50,9 @@ class VideoFetchFormal(Elaboratable):
         z_past_valid = Signal(1, reset=0)
         sync += z_past_valid.eq(1)
 
-        dut = VideoFetch(platform=platform)
+        dut = VideoFetch(
+            platform=platform, latency=self.latency, strip_width=strip_width
+        )
         m.submodules.dut = dut
         rst = ResetSignal()
 
@@ -56,36 +71,25 @@ class VideoFetchFormal(Elaboratable):
             self.cwe.eq(dut.cwe),
 
             self.fv_ag_idle.eq(dut.fv_ag_idle),
-            self.fv_ag_a1.eq(dut.fv_ag_a1),
-            self.fv_ag_a2.eq(dut.fv_ag_a2),
-            self.fv_ag_a3.eq(dut.fv_ag_a3),
-            self.fv_ag_a4.eq(dut.fv_ag_a4),
-            self.fv_ag_c1.eq(dut.fv_ag_c1),
-            self.fv_ag_c2.eq(dut.fv_ag_c2),
-            self.fv_ag_c3.eq(dut.fv_ag_c3),
-            self.fv_ag_c4.eq(dut.fv_ag_c4),
-            self.fv_ag_f1.eq(dut.fv_ag_f1),
-            self.fv_ag_f2.eq(dut.fv_ag_f2),
-            self.fv_ag_f3.eq(dut.fv_ag_f3),
-            self.fv_ag_f4.eq(dut.fv_ag_f4),
             self.fv_ag_go_font.eq(dut.fv_ag_go_font),
             self.fv_atrptr.eq(dut.fv_atrptr),
             self.fv_chrptr.eq(dut.fv_chrptr),
             self.fv_dr_idle.eq(dut.fv_dr_idle),
-            self.fv_dr_a1.eq(dut.fv_dr_a1),
-            self.fv_dr_a2.eq(dut.fv_dr_a2),
-            self.fv_dr_a3.eq(dut.fv_dr_a3),
-            self.fv_dr_a4.eq(dut.fv_dr_a4),
-            self.fv_dr_c1.eq(dut.fv_dr_c1),
-            self.fv_dr_c2.eq(dut.fv_dr_c2),
-            self.fv_dr_c3.eq(dut.fv_dr_c3),
-            self.fv_dr_c4.eq(dut.fv_dr_c4),
-            self.fv_dr_f1.eq(dut.fv_dr_f1),
-            self.fv_dr_f2.eq(dut.fv_dr_f2),
-            self.fv_dr_f3.eq(dut.fv_dr_f3),
-            self.fv_dr_f4.eq(dut.fv_dr_f4),
+            self.fv_dr_idle_state.eq(dut.fv_dr_idle_state),
             self.fv_bitmap_mode.eq(dut.fv_bitmap_mode),
+            self.fv_dr_bitmap_mode.eq(dut.fv_dr_bitmap_mode),
+            self.fv_queued.eq(dut.fv_queued),
+            self.fv_queued_attr.eq(dut.fv_queued_attr),
+            self.fv_queued_bitmap_mode.eq(dut.fv_queued_bitmap_mode),
+            self.cycles_left.eq(dut.cycles_left),
+            self.started_o.eq(dut.started_o),
+            self.done_o.eq(dut.done_o),
         ]
+        for name in (
+            "fv_ag_a", "fv_ag_c", "fv_ag_f", "fv_dr_a", "fv_dr_c", "fv_dr_f",
+        ):
+            for mine, theirs in zip(getattr(self, name), getattr(dut, name)):
+                comb += mine.eq(theirs)
 
         # Connect DUT inputs.  These will be driven by the formal verifier
         # for us, based on assertions and assumptions.
@@ -126,6 +130,23 @@ class VideoFetchFormal(Elaboratable):
                 Assert(self.fv_dr_idle),
             ]
 
+        # A fetch is done only once its last byte has been stored.
+        comb += Assert(self.done_o == (self.fv_ag_idle & self.fv_dr_idle))
+
+        # cycles_left is zero exactly when idle, and never grows while a
+        # fetch is in progress, until the next one starts.  With it, an
+        # arbiter can defer us safely.
+        comb += Assert((self.cycles_left == 0) == ~self.cyc_o)
+        with m.If(past_valid & Past(self.cyc_o) & ~Past(self.started_o)):
+            sync += Assert(self.cycles_left <= Past(self.cycles_left))
+        with m.If(past_valid & Past(self.fv_ag_a[0])):
+            latency = self.latency
+            comb += Assert(Past(self.cycles_left) == Mux(
+                Past(self.fv_bitmap_mode),
+                2 * strip_width + latency,
+                3 * strip_width + 2 * latency,
+            ))
+
         # Video Fetch Unit sits idle until told to do something.  go_i triggers a
         # video fetch sequence.  attr_enable and bitmap_mode parameterize the
         # sequence taken.
@@ -147,16 +168,19 @@ class VideoFetchFormal(Elaboratable):
                     Assert(Stable(self.fv_chrptr)),
                 ]
             with m.If(Past(self.go_i)):
-                sync += Assert(self.fv_bitmap_mode == Past(self.bitmap_mode))
+                sync += [
+                    Assert(self.fv_bitmap_mode == Past(self.bitmap_mode)),
+                    Assert(self.fv_dr_bitmap_mode == Past(self.bitmap_mode)),
+                ]
                 with m.If(~Past(self.attr_enable)):
                     sync += [
-                        Assert(self.fv_ag_c1),
-                        Assert(self.fv_dr_c1),
+                        Assert(self.fv_ag_c[0]),
+                        Assert(self.fv_dr_c[0]),
                     ]
                 with m.Else():
                     sync += [
-                        Assert(self.fv_ag_a1),
-                        Assert(self.fv_dr_a1),
+                        Assert(self.fv_ag_a[0]),
+                        Assert(self.fv_dr_a[0]),
                     ]
 
                 with m.If(Past(self.ldptr)):
@@ -170,141 +194,116 @@ class VideoFetchFormal(Elaboratable):
                         Assert(Stable(self.fv_chrptr)),
                     ]
 
-        ## Ignore go_i unless both FSMs are idle.  That way we don't interrupt a
-        ## memory fetch cycle in progress.
+        ## Ignore go_i while the address generator is busy.  That way we don't
+        ## interrupt a memory fetch cycle in progress.  Once it is idle, a fetch
+        ## may start while the data receiver is still busy with the previous
+        ## one, and is queued for it; unless it loads the pointers, or one is
+        ## queued already.
         with m.If(past_valid & Past(self.fv_ag_idle) & ~Past(self.fv_dr_idle) & Past(self.go_i)):
-            sync += Assert(self.fv_ag_idle)
-
-        with m.If(past_valid & ~Past(self.fv_ag_idle) & Past(self.fv_dr_idle) & Past(self.go_i)):
-            sync += Assert(self.fv_dr_idle)
-
-        # If we're fetching attribute and character code bytes, then we need to
-        # sequence through them as quickly as the Wishbone interface will let
-        # us.
-
-        with m.If(past_valid):
-            with m.If(Past(self.fv_ag_a1)):
+            with m.If(Past(self.ldptr) | Past(self.fv_queued)):
                 sync += [
-                    Assert(Past(self.stb_o)),
-                    Assert(Past(self.cyc_o)),
-                    Assert(Past(self.adr_o) == Past(self.fv_atrptr)),
+                    Assert(~Past(self.started_o)),
+                    Assert(self.fv_ag_idle),
                 ]
-                with m.If(~Past(self.stall_i)):
-                    sync += [
-                        Assert(self.fv_ag_a2),
-                        Assert(self.fv_atrptr == (Past(self.fv_atrptr) + 1)[0:16]),
-                        Assert(Stable(self.fv_chrptr)),
-                    ]
-                with m.Else():
-                    sync += Assert(self.fv_ag_a1)
-
-            with m.If(Past(self.fv_ag_a2)):
+            with m.Else():
                 sync += [
-                    Assert(Past(self.stb_o)),
-                    Assert(Past(self.cyc_o)),
-                    Assert(Past(self.adr_o) == Past(self.fv_atrptr)),
+                    Assert(Past(self.started_o)),
+                    Assert(~self.fv_ag_idle),
                 ]
-                with m.If(~Past(self.stall_i)):
-                    sync += [
-                        Assert(self.fv_ag_a3),
-                        Assert(self.fv_atrptr == (Past(self.fv_atrptr) + 1)[0:16]),
-                        Assert(Stable(self.fv_chrptr)),
-                    ]
-                with m.Else():
-                    sync += Assert(self.fv_ag_a2)
 
-            with m.If(Past(self.fv_ag_a3)):
+        with m.If(past_valid & Past(self.started_o)):
+            with m.If(~Past(self.fv_dr_idle)):
                 sync += [
-                    Assert(Past(self.stb_o)),
-                    Assert(Past(self.cyc_o)),
-                    Assert(Past(self.adr_o) == Past(self.fv_atrptr)),
+                    Assert(self.fv_queued),
+                    Assert(self.fv_queued_bitmap_mode == Past(self.bitmap_mode)),
+                    Assert(self.fv_queued_attr == Past(self.attr_enable)),
                 ]
-                with m.If(~Past(self.stall_i)):
-                    sync += [
-                        Assert(self.fv_ag_a4),
-                        Assert(self.fv_atrptr == (Past(self.fv_atrptr) + 1)[0:16]),
-                        Assert(Stable(self.fv_chrptr)),
-                    ]
-                with m.Else():
-                    sync += Assert(self.fv_ag_a3)
+            with m.If(~Past(self.attr_enable)):
+                sync += Assert(self.fv_ag_c[0])
+            with m.Else():
+                sync += Assert(self.fv_ag_a[0])
+
+        # Fetches are received in the order they were started.  Only one
+        # fetch waits for the data receiver at a time, and the address
+        # generator doesn't fetch its font bytes until the data receiver
+        # has its character codes.  The data receiver doesn't sit idle
+        # while a fetch is queued.
+        comb += Assert(~(self.fv_queued & self.started_o))
+        with m.If(self.fv_queued):
+            comb += [
+                Assert(~self.fv_ag_go_font),
+                Assert(self.cyc_o),
+            ]
 
-            with m.If(Past(self.fv_ag_a4)):
-                sync += [
-                    Assert(Past(self.stb_o)),
-                    Assert(Past(self.cyc_o)),
-                    Assert(Past(self.adr_o) == Past(self.fv_atrptr)),
+        def assert_dr_next():
+            # Having received a fetch, the data receiver takes up the
+            # queued fetch, if any.
+            with m.If(Past(self.fv_queued)):
+                m.d.sync += [
+                    Assert(~self.fv_queued),
+                    Assert(self.fv_dr_bitmap_mode == Past(self.fv_queued_bitmap_mode)),
                 ]
-                with m.If(~Past(self.stall_i)):
-                    sync += [
-                        Assert(self.fv_ag_c1),
-                        Assert(self.fv_atrptr == (Past(self.fv_atrptr) + 1)[0:16]),
-                        Assert(Stable(self.fv_chrptr)),
-                    ]
+                with m.If(Past(self.fv_queued_attr)):
+                    m.d.sync += Assert(self.fv_dr_a[0])
                 with m.Else():
-                    sync += Assert(self.fv_ag_a4)
+                    m.d.sync += Assert(self.fv_dr_c[0])
+            with m.Else():
+                m.d.sync += Assert(self.fv_dr_idle_state)
 
-            with m.If(Past(self.fv_ag_c1)):
-                sync += [
-                    Assert(Past(self.stb_o)),
-                    Assert(Past(self.cyc_o)),
-                    Assert(Past(self.adr_o) == Past(self.fv_chrptr)),
-                ]
-                with m.If(~Past(self.stall_i)):
-                    sync += [
-                        Assert(self.fv_ag_c2),
-                        Assert(self.fv_chrptr == (Past(self.fv_chrptr) + 1)[0:16]),
-                        Assert(Stable(self.fv_atrptr)),
-                    ]
-                with m.Else():
-                    sync += Assert(self.fv_ag_c1)
+        with m.If(past_valid & Past(self.fv_dr_idle_state) & Past(self.fv_queued)):
+            assert_dr_next()
 
-            with m.If(Past(self.fv_ag_c2)):
-                sync += [
-                    Assert(Past(self.stb_o)),
-                    Assert(Past(self.cyc_o)),
-                    Assert(Past(self.adr_o) == Past(self.fv_chrptr)),
-                ]
-                with m.If(~Past(self.stall_i)):
-                    sync += [
-                        Assert(self.fv_ag_c3),
-                        Assert(self.fv_chrptr == (Past(self.fv_chrptr) + 1)[0:16]),
-                        Assert(Stable(self.fv_atrptr)),
-                    ]
-                with m.Else():
-                    sync += Assert(self.fv_ag_c2)
+        def assert_ag_next():
+            # Having issued its last address, the address generator takes up
+            # the next fetch, if started.
+            with m.If(~Past(self.started_o)):
+                m.d.sync += Assert(self.fv_ag_idle)
 
-            with m.If(Past(self.fv_ag_c3)):
-                sync += [
-                    Assert(Past(self.stb_o)),
-                    Assert(Past(self.cyc_o)),
-                    Assert(Past(self.adr_o) == Past(self.fv_chrptr)),
-                ]
-                with m.If(~Past(self.stall_i)):
+        with m.If(past_valid & ~Past(self.fv_ag_idle) & Past(self.fv_dr_idle) & Past(self.go_i)):
+            sync += Assert(self.fv_dr_idle)
+
+        # If we're fetching attribute and character code bytes, then we need to
+        # sequence through them as quickly as the Wishbone interface will let
+        # us.
+
+        with m.If(past_valid):
+            for i, ag_a in enumerate(self.fv_ag_a):
+                with m.If(Past(ag_a)):
                     sync += [
-                        Assert(self.fv_ag_c4),
-                        Assert(self.fv_chrptr == (Past(self.fv_chrptr) + 1)[0:16]),
-                        Assert(Stable(self.fv_atrptr)),
+                        Assert(Past(self.stb_o)),
+                        Assert(Past(self.cyc_o)),
+                        Assert(Past(self.adr_o) == Past(self.fv_atrptr)),
                     ]
-                with m.Else():
-                    sync += Assert(self.fv_ag_c3)
+                    with m.If(~Past(self.stall_i)):
+                        sync += [
+                            Assert(self.fv_ag_a[i + 1] if i < last else self.fv_ag_c[0]),
+                            Assert(self.fv_atrptr == (Past(self.fv_atrptr) + 1)[0:16]),
+                            Assert(Stable(self.fv_chrptr)),
+                        ]
+                    with m.Else():
+                        sync += Assert(ag_a)
 
-            with m.If(Past(self.fv_ag_c4)):
-                sync += [
-                    Assert(Past(self.stb_o)),
-                    Assert(Past(self.cyc_o)),
-                    Assert(Past(self.adr_o) == Past(self.fv_chrptr)),
-                ]
-                with m.If(~Past(self.stall_i)):
+            for i, ag_c in enumerate(self.fv_ag_c):
+                with m.If(Past(ag_c)):
                     sync += [
-                        Assert(self.fv_chrptr == (Past(self.fv_chrptr) + 1)[0:16]),
-                        Assert(Stable(self.fv_atrptr)),
+                        Assert(Past(self.stb_o)),
+                        Assert(Past(self.cyc_o)),
+                        Assert(Past(self.adr_o) == Past(self.fv_chrptr)),
                     ]
-                    with m.If(~Past(self.fv_bitmap_mode)):
-                        sync += Assert(self.fv_ag_f1)
+                    with m.If(~Past(self.stall_i)):
+                        sync += [
+                            Assert(self.fv_chrptr == (Past(self.fv_chrptr) + 1)[0:16]),
+                            Assert(Stable(self.fv_atrptr)),
+                        ]
+                        if i < last:
+                            sync += Assert(self.fv_ag_c[i + 1])
+                        else:
+                            with m.If(~Past(self.fv_bitmap_mode)):
+                                sync += Assert(self.fv_ag_f[0])
+                            with m.Else():
+                                assert_ag_next()
                     with m.Else():
-                        sync += Assert(self.fv_ag_idle)
-                with m.Else():
-                    sync += Assert(self.fv_ag_c4)
+                        sync += Assert(ag_c)
 
             old_ra = Signal(len(self.ra))
             old_fontbase = Signal(len(self.fontbase))
@@ -314,316 +313,184 @@ class VideoFetchFormal(Elaboratable):
                 old_fontbase.eq(self.fontbase),
             ]
 
-            with m.If(Past(self.fv_ag_f1)):
-                with m.If(~Past(self.tallfont)):
-                    sync += Assert(
-                        Past(self.adr_o) == Cat(old_ra[0:4], Past(self.charcode), old_fontbase[0:3])
-                    )
-                with m.Else():
-                    sync += Assert(
-                        Past(self.adr_o) == Cat(old_ra[0:5], Past(self.charcode), old_fontbase[1:3])
-                    )
-                sync += [
-                    Assert(Past(self.padr) == 0),
-                    Assert(Stable(self.fv_atrptr)),
-                    Assert(Stable(self.fv_chrptr)),
-                ]
-                # We don't want to issue an address to fetch until we know that all attributes and
-                # characters have been fetched.  For this reason, we wait until ag_go_font is asserted
-                # by the data receiver before commencing memory operations.
-                with m.If(~Past(self.fv_ag_go_font)):
+            for i, ag_f in enumerate(self.fv_ag_f):
+                with m.If(Past(ag_f)):
+                    with m.If(~Past(self.tallfont)):
+                        sync += Assert(
+                            Past(self.adr_o) == Cat(old_ra[0:4], Past(self.charcode), old_fontbase[0:3])
+                        )
+                    with m.Else():
+                        sync += Assert(
+                            Past(self.adr_o) == Cat(old_ra[0:5], Past(self.charcode), old_fontbase[1:3])
+                        )
                     sync += [
-                        Assert(~Past(self.stb_o)),
-                        Assert(self.fv_ag_f1),
+                        Assert(Past(self.padr) == i),
+                        Assert(Stable(self.fv_atrptr)),
+                        Assert(Stable(self.fv_chrptr)),
                     ]
-                with m.Else():
-                    sync += Assert(Past(self.stb_o))
-                    with m.If(~Past(self.stall_i)):
-                        sync += Assert(self.fv_ag_f2)
-                    with m.Else():
-                        sync += Assert(self.fv_ag_f1)
-
-            with m.If(Past(self.fv_ag_f2)):
-                with m.If(~Past(self.tallfont)):
-                    sync += Assert(
-                        Past(self.adr_o) == Cat(old_ra[0:4], Past(self.charcode), old_fontbase[0:3])
-                    )
-                with m.Else():
-                    sync += Assert(
-                        Past(self.adr_o) == Cat(old_ra[0:5], Past(self.charcode), old_fontbase[1:3])
-                    )
-                sync += [
-                    Assert(Past(self.stb_o)),
-                    Assert(Past(self.padr) == 1),
-                    Assert(Stable(self.fv_atrptr)),
-                    Assert(Stable(self.fv_chrptr)),
-                ]
-                with m.If(~Past(self.stall_i)):
-                    sync += Assert(self.fv_ag_f3)
-                with m.Else():
-                    sync += Assert(self.fv_ag_f2)
-
-            with m.If(Past(self.fv_ag_f3)):
-                with m.If(~Past(self.tallfont)):
-                    sync += Assert(
-                        Past(self.adr_o) == Cat(old_ra[0:4], Past(self.charcode), old_fontbase[0:3])
-                    )
-                with m.Else():
-                    sync += Assert(
-                        Past(self.adr_o) == Cat(old_ra[0:5], Past(self.charcode), old_fontbase[1:3])
-                    )
-                sync += [
-                    Assert(Past(self.stb_o)),
-                    Assert(Past(self.padr) == 2),
-                    Assert(Stable(self.fv_atrptr)),
-                    Assert(Stable(self.fv_chrptr)),
-                ]
-                with m.If(~Past(self.stall_i)):
-                    sync += Assert(self.fv_ag_f4)
-                with m.Else():
-                    sync += Assert(self.fv_ag_f3)
-
-            with m.If(Past(self.fv_ag_f4)):
-                with m.If(~Past(self.tallfont)):
-                    sync += Assert(
-                        Past(self.adr_o) == Cat(old_ra[0:4], Past(self.charcode), old_fontbase[0:3])
-                    )
-                with m.Else():
-                    sync += Assert(
-                        Past(self.adr_o) == Cat(old_ra[0:5], Past(self.charcode), old_fontbase[1:3])
-                    )
-                sync += [
-                    Assert(Past(self.stb_o)),
-                    Assert(Past(self.padr) == 3),
-                    Assert(Stable(self.fv_atrptr)),
-                    Assert(Stable(self.fv_chrptr)),
-                ]
-                with m.If(~Past(self.stall_i)):
-                    sync += Assert(self.fv_ag_idle)
-                with m.Else():
-                    sync += Assert(self.fv_ag_f4)
+                    if i == 0:
+                        # We don't want to issue an address to fetch until we know that all
+                        # attributes and characters have been fetched.  For this reason, we
+                        # wait until ag_go_font is asserted by the data receiver before
+                        # commencing memory operations.
+                        with m.If(~Past(self.fv_ag_go_font)):
+                            sync += [
+                                Assert(~Past(self.stb_o)),
+                                Assert(ag_f),
+                            ]
+                        with m.Else():
+                            sync += Assert(Past(self.stb_o))
+                            with m.If(~Past(self.stall_i)):
+                                sync += Assert(self.fv_ag_f[1])
+                            with m.Else():
+                                sync += Assert(ag_f)
+                    else:
+                        sync += Assert(Past(self.stb_o))
+                        with m.If(~Past(self.stall_i)):
+                            if i < last:
+                                sync += Assert(self.fv_ag_f[i + 1])
+                            else:
+                                assert_ag_next()
+                        with m.Else():
+                            sync += Assert(ag_f)
 
         # Data Receiver is responsible for routing the data which is addressed by the address
         # generator to the appropriate bytes in the current strip buffer.
 
-        with m.If(past_valid & Past(self.fv_dr_a1)):
-            with m.If(~Past(self.ack_i)):
+        for i, dr_a in enumerate(self.fv_dr_a):
+            with m.If(past_valid & Past(dr_a)):
                 sync += [
-                    Assert(Past(self.wadr) == 0),
-                    Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_a1),
-                ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 0),
-                    Assert(Past(self.awe)),
+                    Assert(Past(self.wadr) == i),
+                    Assert(Past(self.awe) == Past(self.ack_i)),
                     Assert(~Past(self.cwe)),
                     Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_a2),
                 ]
+                with m.If(~Past(self.ack_i)):
+                    sync += Assert(dr_a)
+                with m.Else():
+                    sync += Assert(self.fv_dr_a[i + 1] if i < last else self.fv_dr_c[0])
 
-        with m.If(past_valid & Past(self.fv_dr_a2)):
-            with m.If(~Past(self.ack_i)):
+        for i, dr_c in enumerate(self.fv_dr_c):
+            with m.If(past_valid & Past(dr_c)):
                 sync += [
-                    Assert(Past(self.wadr) == 1),
+                    Assert(Past(self.wadr) == i),
                     Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
+                    Assert(Past(self.cwe) == Past(self.ack_i)),
                     Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_a2),
                 ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 1),
-                    Assert(Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_a3),
-                ]
-
-        with m.If(past_valid & Past(self.fv_dr_a3)):
-            with m.If(~Past(self.ack_i)):
-                sync += [
-                    Assert(Past(self.wadr) == 2),
+                with m.If(~Past(self.ack_i)):
+                    sync += Assert(dr_c)
+                with m.Else():
+                    if i < last:
+                        sync += Assert(self.fv_dr_c[i + 1])
+                    else:
+                        with m.If(~Past(self.fv_dr_bitmap_mode)):
+                            sync += Assert(self.fv_dr_f[0])
+                        with m.Else():
+                            assert_dr_next()
+
+        for i, dr_f in enumerate(self.fv_dr_f):
+            with m.If(past_valid & Past(dr_f)):
+                sync += [
+                    Assert(Past(self.wadr) == i),
                     Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_a3),
-                ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 2),
-                    Assert(Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_a4),
+                    Assert(Past(self.cwe) == Past(self.ack_i)),
+                    Assert(Past(self.fv_ag_go_font) == (
+                        ~Past(self.fv_queued) if i == 0 else 0
+                    )),
                 ]
+                with m.If(~Past(self.ack_i)):
+                    sync += Assert(dr_f)
+                with m.Else():
+                    if i < last:
+                        sync += Assert(self.fv_dr_f[i + 1])
+                    else:
+                        assert_dr_next()
 
-        with m.If(past_valid & Past(self.fv_dr_a4)):
-            with m.If(~Past(self.ack_i)):
-                sync += [
-                    Assert(Past(self.wadr) == 3),
-                    Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_a4),
-                ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 3),
-                    Assert(Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_c1),
-                ]
+        return m
 
-        with m.If(past_valid & Past(self.fv_dr_c1)):
-            with m.If(~Past(self.ack_i)):
-                sync += [
-                    Assert(Past(self.wadr) == 0),
-                    Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_c1),
-                ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 0),
-                    Assert(~Past(self.awe)),
-                    Assert(Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_c2),
-                ]
 
-        with m.If(past_valid & Past(self.fv_dr_c2)):
-            with m.If(~Past(self.ack_i)):
-                sync += [
-                    Assert(Past(self.wadr) == 1),
-                    Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_c2),
-                ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 1),
-                    Assert(~Past(self.awe)),
-                    Assert(Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_c3),
-                ]
+class VideoFetchDeadlineFormal(Elaboratable):
+    """
+    Proves the half of the deadline argument that BlockRamArbiterFormal
+    takes on trust: what cycles_left does on its way to zero.
 
-        with m.If(past_valid & Past(self.fv_dr_c3)):
-            with m.If(~Past(self.ack_i)):
-                sync += [
-                    Assert(Past(self.wadr) == 2),
-                    Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_c3),
-                ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 2),
-                    Assert(~Past(self.awe)),
-                    Assert(Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_c4),
-                ]
+    The bus is modelled as the arbiter drives it, acknowledging every
+    accepted strobe exactly latency clocks later.  The fetch engine
+    itself is left free, row cache, wide RAM and all.
+    """
 
-        with m.If(past_valid & Past(self.fv_dr_c4)):
-            with m.If(~Past(self.ack_i)):
-                sync += [
-                    Assert(Past(self.wadr) == 3),
-                    Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_c4),
-                ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 3),
-                    Assert(~Past(self.awe)),
-                    Assert(Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                ]
-                with m.If(~Past(self.fv_bitmap_mode)):
-                    sync += Assert(self.fv_dr_f1)
-                with m.Else():
-                    sync += Assert(self.fv_dr_idle)
+    def __init__(self, latency=1, strip_width=4, row_cache=False, wide=False):
+        super().__init__()
+        self.latency = latency
+        self.strip_width = strip_width
+        self.row_cache = row_cache
+        self.wide = wide
+        create_video_fetch_interface(
+            self, platform="formal", latency=latency, strip_width=strip_width
+        )
 
-        with m.If(past_valid & Past(self.fv_dr_f1)):
-            with m.If(~Past(self.ack_i)):
-                sync += [
-                    Assert(Past(self.wadr) == 0),
-                    Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_f1),
-                ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 0),
-                    Assert(~Past(self.awe)),
-                    Assert(Past(self.cwe)),
-                    Assert(Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_f2),
-                ]
+    def elaborate(self, platform):
+        m = Module()
+        sync = m.d.sync
+        comb = m.d.comb
 
-        with m.If(past_valid & Past(self.fv_dr_f2)):
-            with m.If(~Past(self.ack_i)):
-                sync += [
-                    Assert(Past(self.wadr) == 1),
-                    Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_f2),
-                ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 1),
-                    Assert(~Past(self.awe)),
-                    Assert(Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_f3),
-                ]
+        z_past_valid = Signal(1, reset=0)
+        sync += z_past_valid.eq(1)
 
-        with m.If(past_valid & Past(self.fv_dr_f3)):
-            with m.If(~Past(self.ack_i)):
-                sync += [
-                    Assert(Past(self.wadr) == 2),
-                    Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_f3),
-                ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 2),
-                    Assert(~Past(self.awe)),
-                    Assert(Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_f4),
-                ]
+        dut = VideoFetch(
+            platform=platform, wide=self.wide, latency=self.latency,
+            row_cache=self.row_cache, strip_width=self.strip_width,
+        )
+        m.submodules.dut = dut
+        rst = ResetSignal()
 
-        with m.If(past_valid & Past(self.fv_dr_f4)):
-            with m.If(~Past(self.ack_i)):
-                sync += [
-                    Assert(Past(self.wadr) == 3),
-                    Assert(~Past(self.awe)),
-                    Assert(~Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_f4),
-                ]
-            with m.Else():
-                sync += [
-                    Assert(Past(self.wadr) == 3),
-                    Assert(~Past(self.awe)),
-                    Assert(Past(self.cwe)),
-                    Assert(~Past(self.fv_ag_go_font)),
-                    Assert(self.fv_dr_idle),
-                ]
+        past_valid = Signal()
+        comb += past_valid.eq(z_past_valid & Stable(rst) & ~rst)
+
+        comb += [
+            self.cyc_o.eq(dut.cyc_o),
+            self.stb_o.eq(dut.stb_o),
+            self.cycles_left.eq(dut.cycles_left),
+            self.started_o.eq(dut.started_o),
+
+            dut.go_i.eq(self.go_i),
+            dut.ldptr.eq(self.ldptr),
+            dut.first_raster.eq(self.first_raster),
+            dut.attr_enable.eq(self.attr_enable),
+            dut.bitmap_mode.eq(self.bitmap_mode),
+            dut.tallfont.eq(self.tallfont),
+            dut.fontbase.eq(self.fontbase),
+            dut.ra.eq(self.ra),
+            dut.charcode.eq(self.charcode),
+            dut.atrptr.eq(self.atrptr),
+            dut.chrptr.eq(self.chrptr),
+
+            dut.stall_i.eq(self.stall_i),
+            dut.ack_i.eq(self.ack_i),
+        ]
+
+        # Bit i is set when a strobe was accepted i+1 clocks ago; the
+        # oldest bit is its acknowledgement, as in BlockRamArbiter.
+        accepted = Signal(self.latency)
+        sync += accepted.eq(
+            Cat(self.cyc_o & self.stb_o & ~self.stall_i, accepted)
+        )
+        comb += Assume(self.ack_i == accepted[-1])
+
+        # These are the assumptions BlockRamArbiterFormal makes of
+        # vfe_left_i.  cycles_left is nonzero whenever we want the bus.
+        # Once a fetch is under way, it never grows, and drops every
+        # clock we are not stalled, until started_o chains the next
+        # fetch on.  A chained start only happens when go_i arrives
+        # before the fetch is done, which VDC2 does only with a line
+        # buffer, where it gives the arbiter no deadline to work to.
+        comb += Assert(~self.cyc_o | (self.cycles_left != 0))
+        with m.If(past_valid & (Past(self.cycles_left) != 0) &
+                  ~Past(self.started_o)):
+            comb += Assert(self.cycles_left <= Past(self.cycles_left))
+            with m.If(~(Past(self.cyc_o) & Past(self.stall_i))):
+                comb += Assert(self.cycles_left < Past(self.cycles_left))
 
         return m
 
@@ -632,3 +499,479 @@ class VideoFetchTestCase(FHDLTestCase):
     def test_video_fetch(self):
         self.assertFormal(VideoFetchFormal(), mode='bmc', depth=100)
         self.assertFormal(VideoFetchFormal(), mode='prove', depth=100)
+
+    def test_video_fetch_pipelined(self):
+        self.assertFormal(VideoFetchFormal(latency=2), mode='bmc', depth=100)
+        self.assertFormal(VideoFetchFormal(latency=2), mode='prove', depth=100)
+
+    def test_video_fetch_strip_widths(self):
+        for strip_width in (8, 16):
+            with self.subTest(strip_width=strip_width):
+                self.assertFormal(
+                    VideoFetchFormal(strip_width=strip_width),
+                    mode='bmc', depth=100,
+                )
+                self.assertFormal(
+                    VideoFetchFormal(strip_width=strip_width),
+                    mode='prove', depth=100,
+                )
+
+    def test_video_fetch_deadline(self):
+        for kw in (
+            {}, {"latency": 2}, {"row_cache": True}, {"wide": True},
+        ):
+            with self.subTest(**kw):
+                self.assertFormal(
+                    VideoFetchDeadlineFormal(**kw), mode='bmc', depth=100,
+                )
+                self.assertFormal(
+                    VideoFetchDeadlineFormal(**kw), mode='prove', depth=100,
+                )
+
+    def test_fetch(self):
+        # Text mode with attributes, fetching four columns.  With a 16-bit
+        # video RAM, characters and attributes are interleaved, and the
+        # strip takes eight accesses instead of twelve.  A pipelined video
+        # RAM, or a strip buffer held in memory, changes the timing, or the
+        # logic, but not the result.  As the shifter does, the strip is
+        # swapped onto the display as soon as done_o is asserted, so the
+        # last bytes of a pipelined fetch must have landed by then.
+        chars = [0x21, 0x02, 0x23, 0x34]
+        attrs = [0x01, 0x12, 0x23, 0x74]
+        ra = 3
+
+        def glyph(code):
+            return (code * 7 + 1) & 0xFF
+
+        for wide, accesses, latency, strip_ram in (
+            (False, 12, 1, False), (True, 8, 1, False),
+            (False, 12, 2, False), (True, 8, 3, False),
+            (False, 12, 1, True), (True, 8, 2, True),
+        ):
+            with self.subTest(wide=wide, latency=latency, strip_ram=strip_ram):
+                image = [0] * (1 << 10)
+                for code in chars:
+                    image[(code * 16 + ra) & 0x3FF] = glyph(code)
+                for i, (char, attr) in enumerate(zip(chars, attrs)):
+                    if wide:
+                        image[0x200 + 2 * i] = char
+                        image[0x201 + 2 * i] = attr
+                    else:
+                        image[0x200 + i] = char
+                        image[0x300 + i] = attr
+
+                m = Module()
+                vfe = m.submodules.vfe = VideoFetch(wide=wide, latency=latency)
+                arb = m.submodules.arb = BlockRamArbiter(
+                    asize=10, wide=wide, latency=latency
+                )
+                ram = m.submodules.ram = RAM(
+                    abus_width=10, wide=wide, latency=latency
+                )
+                sb = m.submodules.sb = StripBuffer(wide=wide, strip_ram=strip_ram)
+
+                if wide:
+                    ram.mem.init = [
+                        image[i] | (image[i + 1] << 8)
+                        for i in range(0, len(image), 2)
+                    ]
+                else:
+                    ram.mem.init = image
+
+                m.d.comb += [
+                    ram.adr_i.eq(arb.adr_o),
+                    ram.wadr_i.eq(arb.wadr_o),
+                    ram.we_i.eq(arb.we_o),
+                    ram.dat_i.eq(arb.dat_o),
+                    arb.dat_i.eq(ram.dat_o),
+
+                    arb.vfe_adr_i.eq(vfe.adr_o),
+                    arb.vfe_cyc_i.eq(vfe.cyc_o),
+                    arb.vfe_stb_i.eq(vfe.stb_o),
+                    vfe.ack_i.eq(arb.vfe_ack_o),
+                    vfe.stall_i.eq(arb.vfe_stall_o),
+
+                    vfe.charcode.eq(Cat(sb.pair[0:8], sb.pair[15])),
+                    sb.awe.eq(vfe.awe),
+                    sb.cwe.eq(vfe.cwe),
+                    sb.pwe.eq(vfe.pwe),
+                    sb.padr.eq(vfe.padr),
+                    sb.wadr.eq(vfe.wadr),
+                    sb.dat_i.eq(arb.vfe_dat_o),
+                ]
+
+                sim = Simulator(m)
+                sim.add_clock(1e-6)
+
+                def process():
+                    yield vfe.attr_enable.eq(1)
+                    yield vfe.ra.eq(ra)
+                    yield vfe.chrptr.eq(0x200)
+                    yield vfe.atrptr.eq(0x300)
+                    yield vfe.ldptr.eq(1)
+                    yield vfe.go_i.eq(1)
+                    yield
+                    yield vfe.go_i.eq(0)
+                    for _ in range(40):
+                        yield
+                        yield Settle()
+                        if (yield vfe.done_o):
+                            break
+                    self.assertEqual((yield arb.pc_vfe), accesses)
+
+                    yield sb.swap.eq(1)
+                    yield
+                    yield sb.swap.eq(0)
+                    for i, (char, attr) in enumerate(zip(chars, attrs)):
+                        yield sb.sh_padr.eq(i)
+                        yield Settle()
+                        self.assertEqual(
+                            (yield sb.sh_pair),
+                            (attr << 8) | glyph(char),
+                        )
+
+                sim.add_sync_process(process)
+                sim.run()
+
+    def test_fetch_strip_widths(self):
+        # Wider strips fetch more columns per burst, in three accesses per
+        # column, or two with a 16-bit video RAM.
+        ra = 3
+
+        def glyph(code):
+            return (code * 7 + 1) & 0xFF
+
+        for strip_width in (8, 16):
+            for wide in (False, True):
+                with self.subTest(strip_width=strip_width, wide=wide):
+                    chars = [(5 * i + 3) % 16 for i in range(strip_width)]
+                    attrs = [(0x13 * i + 0x05) & 0x7F for i in range(strip_width)]
+
+                    image = [0] * (1 << 10)
+                    for code in chars:
+                        image[code * 16 + ra] = glyph(code)
+                    for i, (char, attr) in enumerate(zip(chars, attrs)):
+                        if wide:
+                            image[0x200 + 2 * i] = char
+                            image[0x201 + 2 * i] = attr
+                        else:
+                            image[0x200 + i] = char
+                            image[0x300 + i] = attr
+
+                    m = Module()
+                    vfe = m.submodules.vfe = VideoFetch(
+                        wide=wide, strip_width=strip_width
+                    )
+                    arb = m.submodules.arb = BlockRamArbiter(asize=10, wide=wide)
+                    ram = m.submodules.ram = RAM(abus_width=10, wide=wide)
+                    sb = m.submodules.sb = StripBuffer(
+                        wide=wide, strip_width=strip_width
+                    )
+
+                    if wide:
+                        ram.mem.init = [
+                            image[i] | (image[i + 1] << 8)
+                            for i in range(0, len(image), 2)
+                        ]
+                    else:
+                        ram.mem.init = image
+
+                    m.d.comb += [
+                        ram.adr_i.eq(arb.adr_o),
+                        ram.wadr_i.eq(arb.wadr_o),
+                        ram.we_i.eq(arb.we_o),
+                        ram.dat_i.eq(arb.dat_o),
+                        arb.dat_i.eq(ram.dat_o),
+
+                        arb.vfe_adr_i.eq(vfe.adr_o),
+                        arb.vfe_cyc_i.eq(vfe.cyc_o),
+                        arb.vfe_stb_i.eq(vfe.stb_o),
+                        vfe.ack_i.eq(arb.vfe_ack_o),
+                        vfe.stall_i.eq(arb.vfe_stall_o),
+
+                        vfe.charcode.eq(Cat(sb.pair[0:8], sb.pair[15])),
+                        sb.awe.eq(vfe.awe),
+                        sb.cwe.eq(vfe.cwe),
+                        sb.pwe.eq(vfe.pwe),
+                        sb.padr.eq(vfe.padr),
+                        sb.wadr.eq(vfe.wadr),
+                        sb.dat_i.eq(arb.vfe_dat_o),
+                    ]
+
+                    sim = Simulator(m)
+                    sim.add_clock(1e-6)
+
+                    def process():
+                        yield vfe.attr_enable.eq(1)
+                        yield vfe.ra.eq(ra)
+                        yield vfe.chrptr.eq(0x200)
+                        yield vfe.atrptr.eq(0x300)
+                        yield vfe.ldptr.eq(1)
+                        yield vfe.go_i.eq(1)
+                        yield
+                        yield vfe.go_i.eq(0)
+                        for _ in range(4 * strip_width + 10):
+                            yield
+                            if not (yield vfe.cyc_o):
+                                break
+                        self.assertEqual(
+                            (yield arb.pc_vfe),
+                            (2 if wide else 3) * strip_width,
+                        )
+
+                        yield sb.swap.eq(1)
+                        yield
+                        yield sb.swap.eq(0)
+                        for i, (char, attr) in enumerate(zip(chars, attrs)):
+                            yield sb.sh_padr.eq(i)
+                            yield Settle()
+                            self.assertEqual(
+                                (yield sb.sh_pair),
+                                (attr << 8) | glyph(char),
+                            )
+
+                    sim.add_sync_process(process)
+                    sim.run()
+
+    def test_row_cache(self):
+        # Two strips of a text row.  The first raster fetches characters,
+        # attributes, and font bytes; later rasters recall the pairs from
+        # the row cache and fetch only font bytes.
+        chars = [0x21, 0x02, 0x23, 0x34, 0x05, 0x16, 0x27, 0x38]
+        attrs = [0x01, 0x12, 0x23, 0x74, 0x45, 0x56, 0x67, 0x08]
+
+        def glyph(code, ra):
+            return (code * 7 + ra * 3 + 1) & 0xFF
+
+        for wide, first, later, strip_ram in (
+            (False, 24, 8, False), (True, 16, 8, False),
+            (False, 24, 8, True), (True, 16, 8, True),
+        ):
+            with self.subTest(wide=wide, strip_ram=strip_ram):
+                image = [0] * (1 << 10)
+                for code in chars:
+                    for ra in range(4):
+                        image[(code * 16 + ra) & 0x3FF] = glyph(code, ra)
+                for i, (char, attr) in enumerate(zip(chars, attrs)):
+                    if wide:
+                        image[0x200 + 2 * i] = char
+                        image[0x201 + 2 * i] = attr
+                    else:
+                        image[0x200 + i] = char
+                        image[0x300 + i] = attr
+
+                m = Module()
+                vfe = m.submodules.vfe = VideoFetch(wide=wide, row_cache=True)
+                arb = m.submodules.arb = BlockRamArbiter(asize=10, wide=wide)
+                ram = m.submodules.ram = RAM(abus_width=10, wide=wide)
+                sb = m.submodules.sb = StripBuffer(
+                    wide=wide, row_cache=True, strip_ram=strip_ram
+                )
+
+                if wide:
+                    ram.mem.init = [
+                        image[i] | (image[i + 1] << 8)
+                        for i in range(0, len(image), 2)
+                    ]
+                else:
+                    ram.mem.init = image
+
+                m.d.comb += [
+                    ram.adr_i.eq(arb.adr_o),
+                    ram.wadr_i.eq(arb.wadr_o),
+                    ram.we_i.eq(arb.we_o),
+                    ram.dat_i.eq(arb.dat_o),
+                    arb.dat_i.eq(ram.dat_o),
+
+                    arb.vfe_adr_i.eq(vfe.adr_o),
+                    arb.vfe_cyc_i.eq(vfe.cyc_o),
+                    arb.vfe_stb_i.eq(vfe.stb_o),
+                    vfe.ack_i.eq(arb.vfe_ack_o),
+                    vfe.stall_i.eq(arb.vfe_stall_o),
+
+                    vfe.charcode.eq(Cat(sb.pair[0:8], sb.pair[15])),
+                    sb.awe.eq(vfe.awe),
+                    sb.cwe.eq(vfe.cwe),
+                    sb.pwe.eq(vfe.pwe),
+                    sb.padr.eq(vfe.padr),
+                    sb.wadr.eq(vfe.wadr),
+                    sb.cadr.eq(vfe.cadr),
+                    sb.record.eq(vfe.record),
+                    sb.recall.eq(vfe.recall),
+                    sb.dat_i.eq(arb.vfe_dat_o),
+                ]
+
+                sim = Simulator(m)
+                sim.add_clock(1e-6)
+
+                def process():
+                    yield vfe.attr_enable.eq(1)
+                    yield vfe.chrptr.eq(0x200)
+                    yield vfe.atrptr.eq(0x300)
+                    for ra in range(4):
+                        yield vfe.ra.eq(ra)
+                        yield vfe.first_raster.eq(ra == 0)
+                        before = yield arb.pc_vfe
+                        for strip in range(2):
+                            yield vfe.ldptr.eq(strip == 0)
+                            yield vfe.go_i.eq(1)
+                            yield
+                            yield vfe.go_i.eq(0)
+                            for _ in range(40):
+                                yield
+                                if (yield vfe.done_o) and not (yield vfe.cyc_o):
+                                    break
+
+                            yield sb.swap.eq(1)
+                            yield
+                            yield sb.swap.eq(0)
+                            for i in range(4):
+                                col = 4 * strip + i
+                                yield sb.sh_padr.eq(i)
+                                yield Settle()
+                                self.assertEqual(
+                                    (yield sb.sh_pair),
+                                    (attrs[col] << 8) | glyph(chars[col], ra),
+                                )
+                        self.assertEqual(
+                            (yield arb.pc_vfe) - before, first if ra == 0 else later
+                        )
+
+                sim.add_sync_process(process)
+                sim.run()
+
+    def test_line_buffer(self):
+        # A scanline of two strips is fetched whole into one half of the
+        # line buffer, then copied out a strip at a time for display.  The
+        # second strip is chained onto the first, starting before the last
+        # font byte of the first has arrived, without cyc_o dropping.
+        chars = [0x21, 0x02, 0x23, 0x34, 0x05, 0x16, 0x27, 0x38]
+        attrs = [0x01, 0x12, 0x23, 0x74, 0x45, 0x56, 0x67, 0x08]
+        ra = 2
+
+        def glyph(code):
+            return (code * 7 + 1) & 0xFF
+
+        for wide, latency, strip_ram in (
+            (False, 1, False), (True, 1, False), (False, 2, False),
+            (True, 3, False), (False, 1, True), (True, 2, True),
+        ):
+            with self.subTest(wide=wide, latency=latency, strip_ram=strip_ram):
+                image = [0] * (1 << 10)
+                for code in chars:
+                    image[(code * 16 + ra) & 0x3FF] = glyph(code)
+                for i, (char, attr) in enumerate(zip(chars, attrs)):
+                    if wide:
+                        image[0x200 + 2 * i] = char
+                        image[0x201 + 2 * i] = attr
+                    else:
+                        image[0x200 + i] = char
+                        image[0x300 + i] = attr
+
+                m = Module()
+                vfe = m.submodules.vfe = VideoFetch(
+                    wide=wide, latency=latency, line_buffer=True
+                )
+                arb = m.submodules.arb = BlockRamArbiter(
+                    asize=10, wide=wide, latency=latency
+                )
+                ram = m.submodules.ram = RAM(
+                    abus_width=10, wide=wide, latency=latency
+                )
+                sb = m.submodules.sb = StripBuffer(
+                    wide=wide, line_buffer=True, strip_ram=strip_ram
+                )
+
+                if wide:
+                    ram.mem.init = [
+                        image[i] | (image[i + 1] << 8)
+                        for i in range(0, len(image), 2)
+                    ]
+                else:
+                    ram.mem.init = image
+
+                m.d.comb += [
+                    ram.adr_i.eq(arb.adr_o),
+                    ram.wadr_i.eq(arb.wadr_o),
+                    ram.we_i.eq(arb.we_o),
+                    ram.dat_i.eq(arb.dat_o),
+                    arb.dat_i.eq(ram.dat_o),
+
+                    arb.vfe_adr_i.eq(vfe.adr_o),
+                    arb.vfe_cyc_i.eq(vfe.cyc_o),
+                    arb.vfe_stb_i.eq(vfe.stb_o),
+                    vfe.ack_i.eq(arb.vfe_ack_o),
+                    vfe.stall_i.eq(arb.vfe_stall_o),
+
+                    vfe.charcode.eq(Cat(sb.pair[0:8], sb.pair[15])),
+                    sb.awe.eq(vfe.awe),
+                    sb.cwe.eq(vfe.cwe),
+                    sb.pwe.eq(vfe.pwe),
+                    sb.padr.eq(vfe.padr),
+                    sb.wadr.eq(vfe.wadr),
+                    sb.cadr.eq(vfe.cadr),
+                    sb.lwe.eq(vfe.lwe),
+                    sb.dat_i.eq(arb.vfe_dat_o),
+                ]
+
+                sim = Simulator(m)
+                sim.add_clock(1e-6)
+
+                def process():
+                    yield vfe.attr_enable.eq(1)
+                    yield vfe.ra.eq(ra)
+                    yield vfe.chrptr.eq(0x200)
+                    yield vfe.atrptr.eq(0x300)
+                    yield vfe.first_raster.eq(1)
+                    yield sb.lhalf.eq(1)
+                    yield vfe.ldptr.eq(1)
+                    yield vfe.go_i.eq(1)
+                    started = 0
+                    stored = 0
+                    for _ in range(80):
+                        yield Settle()
+                        if started == 1:
+                            self.assertTrue((yield vfe.cyc_o))
+                        if (yield vfe.started_o):
+                            started += 1
+                            if started == 2:
+                                self.assertLess(stored, 4)
+                        stored += (yield vfe.lwe)
+                        yield
+                        yield vfe.ldptr.eq(0)
+                        yield vfe.go_i.eq(started < 2)
+                        if started == 2 and not (yield vfe.cyc_o):
+                            break
+                    self.assertEqual(started, 2)
+                    self.assertEqual((yield arb.pc_vfe), 16 if wide else 24)
+
+                    # Show the line just fetched, while the VFE would go on
+                    # to fetch the next one into the other half.
+                    yield sb.lhalf.eq(0)
+                    yield sb.shalf.eq(1)
+                    for strip in range(2):
+                        yield sb.copy.eq(1)
+                        yield sb.copy_rst.eq(strip == 0)
+                        yield
+                        yield sb.copy.eq(0)
+                        yield sb.copy_rst.eq(0)
+                        for _ in range(8):
+                            yield
+                            if (yield sb.copy_done):
+                                break
+                        self.assertTrue((yield sb.copy_done))
+
+                        yield sb.swap.eq(1)
+                        yield
+                        yield sb.swap.eq(0)
+                        for i in range(4):
+                            col = 4 * strip + i
+                            yield sb.sh_padr.eq(i)
+                            yield Settle()
+                            self.assertEqual(
+                                (yield sb.sh_pair),
+                                (attrs[col] << 8) | glyph(chars[col]),
+                            )
+
+                sim.add_sync_process(process)
+                sim.run()
@@ -0,0 +1,221 @@
+from nmigen.test.utils import FHDLTestCase
+from nmigen.back.pysim import Settle, Simulator
+from nmigen import (
+    Elaboratable,
+    Module,
+    ResetSignal,
+    Signal,
+)
+from nmigen.hdl.ast import (
+    Assert,
+    Assume,
+    Past,
+    Stable,
+)
+
+from interfaces import create_write_queue_interface
+
+from write_queue import WriteQueue
+
+
+class WriteQueueFormal(Elaboratable):
+    def __init__(self):
+        super().__init__()
+        create_write_queue_interface(self, platform="formal")
+
+    def elaborate(self, platform):
+        m = Module()
+        sync = m.d.sync
+        comb = m.d.comb
+
+        # This flag indicates when it's safe to use Past(), Stable(), etc.
+        # Required so we can detect the start of simulation and prevent literal
+        # edge cases from giving false negatives concerning the behavior of the
+        # Past and Stable functions.
+        z_past_valid = Signal(1, reset=0)
+        sync += z_past_valid.eq(1)
+
+        dut = WriteQueue(platform=platform)
+        m.submodules.dut = dut
+        rst = ResetSignal()
+
+        past_valid = Signal()
+        comb += past_valid.eq(z_past_valid & Stable(rst) & ~rst)
+
+        # Connect DUT outputs
+        comb += [
+            self.level.eq(dut.level),
+            self.posted.eq(dut.posted),
+            self.adr_o.eq(dut.adr_o),
+            self.dat_o.eq(dut.dat_o),
+            self.stride_o.eq(dut.stride_o),
+            self.repeat_o.eq(dut.repeat_o),
+            self.dual_o.eq(dut.dual_o),
+            self.attr_o.eq(dut.attr_o),
+            self.empty.eq(dut.empty),
+            self.full.eq(dut.full),
+
+            self.fv_pending.eq(dut.fv_pending),
+            self.fv_rdptr.eq(dut.fv_rdptr),
+            self.fv_wrptr.eq(dut.fv_wrptr),
+        ]
+
+        # Connect DUT inputs.  These will be driven by the formal verifier
+        # for us, based on assertions and assumptions.
+        comb += [
+            dut.push.eq(self.push),
+            dut.adr_i.eq(self.adr_i),
+            dut.dat_i.eq(self.dat_i),
+            dut.stride_i.eq(self.stride_i),
+            dut.repeat_i.eq(self.repeat_i),
+            dut.dual_i.eq(self.dual_i),
+            dut.attr_i.eq(self.attr_i),
+            dut.pop.eq(self.pop),
+        ]
+
+        # The register set raises push for one clock per host write, and
+        # host writes are never back to back.
+        with m.If(past_valid & Past(self.push)):
+            comb += Assume(~self.push)
+
+        # The level never exceeds the queue's depth, and the pointers
+        # always agree with it.
+        comb += Assert(self.level <= 4)
+        with m.If(self.level == 4):
+            comb += Assert(self.fv_rdptr == self.fv_wrptr)
+        with m.Else():
+            comb += Assert(self.level == ((self.fv_wrptr - self.fv_rdptr) & 3))
+
+        # Empty and full report the level, counting a write still being
+        # stored.
+        comb += [
+            Assert(self.empty == ((self.level == 0) & ~self.fv_pending)),
+            Assert(self.full == ((self.level + self.fv_pending) >= 4)),
+            Assert(self.posted == self.level + self.fv_pending),
+        ]
+
+        # A push is stored on the following clock, unless the queue is
+        # full, in which case it is discarded.
+        with m.If(past_valid):
+            sync += Assert(self.fv_pending == (Past(self.push) & ~Past(self.full)))
+
+        # A write landing in an empty queue is offered with the data byte
+        # that arrives alongside it, and the stride, repeat count and
+        # dual-plane settings in effect when it was pushed.
+        with m.If(past_valid & Past(self.push) & Past(self.empty) & self.fv_pending):
+            comb += [
+                Assert(self.adr_o == Past(self.adr_i)[0:len(self.adr_o)]),
+                Assert(self.dat_o == self.dat_i),
+                Assert(self.stride_o == Past(self.stride_i)),
+                Assert(self.repeat_o == Past(self.repeat_i)),
+                Assert(self.dual_o == Past(self.dual_i)),
+                Assert(self.attr_o == Past(self.attr_i)),
+            ]
+
+        # Stores and discards adjust the level.
+        with m.If(past_valid):
+            with m.If(Past(self.fv_pending) & ~(Past(self.pop) & ~Past(self.empty))):
+                sync += Assert(self.level == Past(self.level) + 1)
+            with m.Elif(~Past(self.fv_pending) & Past(self.pop) & ~Past(self.empty)):
+                sync += Assert(self.level == Past(self.level) - 1)
+            with m.Else():
+                sync += Assert(Stable(self.level))
+
+        # The oldest write is held steady until it is popped.
+        with m.If(past_valid & ~Past(self.empty) & ~Past(self.pop) & (Past(self.level) != 0)):
+            sync += [
+                Assert(Stable(self.adr_o)),
+                Assert(Stable(self.dat_o)),
+                Assert(Stable(self.stride_o)),
+                Assert(Stable(self.repeat_o)),
+                Assert(Stable(self.dual_o)),
+                Assert(Stable(self.attr_o)),
+            ]
+
+        return m
+
+
+class WriteQueueTestCase(FHDLTestCase):
+    def test_write_queue(self):
+        self.assertFormal(WriteQueueFormal(), mode='bmc', depth=100)
+        self.assertFormal(WriteQueueFormal(), mode='prove', depth=100)
+
+    def test_fifo_order(self):
+        dut = WriteQueue(abus_width=8)
+        popped = []
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def push(adr, dat, stride=1, repeat=1):
+            yield dut.adr_i.eq(adr)
+            yield dut.stride_i.eq(stride)
+            yield dut.repeat_i.eq(repeat)
+            yield dut.push.eq(1)
+            yield
+            yield dut.push.eq(0)
+            # Later changes to the stride and repeat count don't affect
+            # writes already posted.
+            yield dut.stride_i.eq(0xFF)
+            yield dut.repeat_i.eq(0xF)
+            yield dut.dat_i.eq(dat)
+            yield
+
+        def process():
+            for i in range(4):
+                yield from push(0x10 + i, 0xA0 + i, 1 + i, 2 + i)
+            yield
+            self.assertEqual((yield dut.level), 4)
+            self.assertEqual((yield dut.full), 1)
+
+            # Writes offered while full are lost.
+            yield from push(0x20, 0xFF)
+            yield
+            self.assertEqual((yield dut.level), 4)
+
+            while not (yield dut.empty):
+                popped.append((
+                    (yield dut.adr_o), (yield dut.dat_o),
+                    (yield dut.stride_o), (yield dut.repeat_o),
+                ))
+                yield dut.pop.eq(1)
+                yield
+                yield dut.pop.eq(0)
+                yield
+
+        sim.add_sync_process(process)
+        sim.run()
+        self.assertEqual(
+            popped, [(0x10 + i, 0xA0 + i, 1 + i, 2 + i) for i in range(4)]
+        )
+
+    def test_posted(self):
+        dut = WriteQueue(abus_width=8)
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def process():
+            # A write waiting for its data byte is not stored yet, but it
+            # has been posted.
+            yield dut.adr_i.eq(0x10)
+            yield dut.push.eq(1)
+            yield
+            yield dut.push.eq(0)
+            yield Settle()
+            self.assertEqual((yield dut.level), 0)
+            self.assertEqual((yield dut.posted), 1)
+
+            yield
+            yield Settle()
+            self.assertEqual((yield dut.level), 1)
+            self.assertEqual((yield dut.posted), 1)
+
+            yield dut.pop.eq(1)
+            yield
+            yield dut.pop.eq(0)
+            yield Settle()
+            self.assertEqual((yield dut.posted), 0)
+
+        sim.add_sync_process(process)
+        sim.run()
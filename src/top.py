@@ -37,6 +37,8 @@ class VDC_II_Chip(TinyFPGABXPlatform):
             Subsignal("cs", PinsN("B1", dir="i")),
             Subsignal("dboe", Pins("C2", dir="o")),
             Subsignal("db", Pins("C1 D2 D1 E2 E1 G2 H1 J1", dir="io")),
+            Subsignal("int", PinsN("H2", dir="oe")),
+            Subsignal("wait", PinsN("G1", dir="oe")),
             Attrs(IO_STANDARD="LVCMOS"),
         ),
         Resource("video", 0,
@@ -174,7 +176,9 @@ class Top(Elaboratable):
         m.submodules.pll = pll
 
         bus = platform.request("host_bus", 0)
-        hostbus = m.submodules.hostbus = DomainRenamer("vga")(HostBus())
+        hostbus = m.submodules.hostbus = DomainRenamer("vga")(
+            HostBus(early_writes=True)
+        )
         comb += [
             # Inputs
             hostbus.a.eq(bus.ad.i),
@@ -198,11 +202,21 @@ class Top(Elaboratable):
             ## Inputs
             vdc2.adr_i.eq(hostbus.adr_o),
             vdc2.we_i.eq(hostbus.we_o),
+            vdc2.rd_i.eq(hostbus.rd_o),
             vdc2.dat_i.eq(hostbus.dat_o),
 
             ## Outputs
             hostbus.dat_i.eq(vdc2.dat_o),
             hostbus.ready_i.eq(vdc2.ready_o),
+            hostbus.stale_i.eq(vdc2.stale_o),
+
+            # The Z80's /INT line is shared, so it is only ever pulled low.
+            bus.int.o.eq(1),
+            bus.int.oe.eq(vdc2.irq_o),
+
+            # /WAIT is shared as well.
+            bus.wait.o.eq(1),
+            bus.wait.oe.eq(hostbus.wait),
 
             # Video
             ## Outputs
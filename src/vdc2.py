@@ -30,6 +30,7 @@ from shifter import Shifter
 from video_fetch import VideoFetch
 from blockram_arbiter import BlockRamArbiter
 from strip_buffer import StripBuffer
+from write_queue import WriteQueue
 
 from interfaces import create_vdc2_interface
 
@@ -37,10 +38,69 @@ from interfaces import create_vdc2_interface
 class VDC2(Elaboratable):
     """
     This core implements the "top" level module of the VDC-II.
+
+    With wide set, video RAM is organized as 16-bit words, and the screen
+    is laid out as character code and attribute pairs starting at the
+    character base address (R12:R13), so one access fetches both.
+
+    latency sets the read latency of video RAM, in clocks.  Raising it
+    to 2 registers the block RAM outputs, shortening the critical path
+    from video RAM to the strip buffer and the MPE.
+
+    With row_cache set, the strip buffer keeps the character codes and
+    attributes of the current text row in a block RAM of its own, so that
+    only the first raster of each row fetches them, and the rest leave
+    that bandwidth to the MPE.  It is off by default, since a 16KB video
+    RAM already takes every block RAM of the iCE40LP8K.
+
+    With line_buffer set, each scanline is fetched whole into a line
+    buffer while the one before it is blanked, and copied out of it a
+    strip at a time during display.  Video memory is then left to the MPE
+    for all of active display.  This also takes block RAMs of its own.
+
+    strip_width sets the number of columns (4, 8, or 16) fetched into the
+    strip buffer in one burst.  Wider strips spend fewer clocks starting
+    fetches and winning the video RAM back from the MPE, at the cost of a
+    larger strip buffer.  The first strip of each line is fetched between
+    the end of horizontal sync and the start of display, so that gap must
+    be long enough to fetch it: 3*strip_width + 3 + latency clocks with
+    attributes enabled (an attribute, a character and a font byte per
+    column), 2*strip_width + 3 + latency with wide, and strip_width + 2
+    with line_buffer.  With 16-column strips that is 52 clocks, or 7
+    character times of 8 dots; with 4-column strips, 16 clocks.  With a
+    shorter gap, the first strip is not ready when display begins, and
+    the line is drawn wrongly.
+
+    With strip_ram set, the strip buffer holds its two strips in a small
+    memory rather than in registers, freeing logic on parts with
+    distributed RAM.
+
+    With dual_port set, the MPE writes video RAM through the block RAM's
+    write port in the same cycle the VFE reads it, so only MPE reads wait
+    for the VFE.  Turning it off grants one of them per cycle.
+
+    With deadline set, the arbiter lends the VFE's cycles to the MPE
+    whenever the shifter's swap counter shows the fetch can still finish
+    before the next strip swap.  Turning it off makes the VFE always win,
+    leaving the MPE only the cycles the VFE leaves idle.
+
+    abus_width sets the size of video RAM, 2**abus_width bytes.  Addresses
+    wrap around within it.
     """
 
-    def __init__(self, platform=""):
+    def __init__(self, platform="", wide=False, latency=1, row_cache=False,
+                 line_buffer=False, strip_width=4, strip_ram=False,
+                 dual_port=True, deadline=True, abus_width=14):
         super().__init__()
+        self.wide = wide
+        self.latency = latency
+        self.row_cache = row_cache
+        self.line_buffer = line_buffer
+        self.strip_width = strip_width
+        self.strip_ram = strip_ram
+        self.dual_port = dual_port
+        self.deadline = deadline
+        self.abus_width = abus_width
         create_vdc2_interface(self, platform=platform)
 
     def elaborate(self, platform):
@@ -54,12 +114,32 @@ class VDC2(Elaboratable):
             char_total_bits=5,
             adj_bits=5,
         )
-        shifter = m.submodules.shifter = Shifter()
-        vfe = m.submodules.vfe = VideoFetch()
-        mpe = m.submodules.mpe = MPE(abus_width=14)
-        vram = m.submodules.vram = RAM(abus_width=14)
-        arb = m.submodules.arb = BlockRamArbiter()
-        stripbuf = m.submodules.stripbuf = StripBuffer()
+        shifter = m.submodules.shifter = Shifter(
+            wide=self.wide, line_buffer=self.line_buffer,
+            strip_width=self.strip_width,
+        )
+        vfe = m.submodules.vfe = VideoFetch(
+            wide=self.wide, latency=self.latency, row_cache=self.row_cache,
+            line_buffer=self.line_buffer, strip_width=self.strip_width,
+        )
+        mpe = m.submodules.mpe = MPE(abus_width=self.abus_width)
+        wq = m.submodules.wq = WriteQueue(abus_width=self.abus_width)
+        vram = m.submodules.vram = RAM(
+            abus_width=self.abus_width, wide=self.wide, latency=self.latency
+        )
+        arb = m.submodules.arb = BlockRamArbiter(
+            asize=self.abus_width,
+            dual_port=self.dual_port,
+            deadline=self.deadline,
+            wide=self.wide,
+            latency=self.latency,
+            deadline_bits=max(len(shifter.swap_ctr), len(vfe.cycles_left)),
+        )
+        stripbuf = m.submodules.stripbuf = StripBuffer(
+            wide=self.wide, row_cache=self.row_cache,
+            line_buffer=self.line_buffer, strip_width=self.strip_width,
+            strip_ram=self.strip_ram,
+        )
 
         # Register Set (R0-R..)
 
@@ -67,6 +147,7 @@ class VDC2(Elaboratable):
             # Inputs
             regset.adr_i.eq(self.adr_i),
             regset.we_i.eq(self.we_i),
+            regset.rd_i.eq(self.rd_i),
             regset.dat_i.eq(self.dat_i),
 
             # Outputs
@@ -105,14 +186,42 @@ class VDC2(Elaboratable):
             self.raw_vs.eq(vsyncgen.xs),
         ]
 
+        # Raster line counter.  Line 0 is the first displayed line; the
+        # count advances at the end of every line, as the vertical sync
+        # generator does.  The register set compares it against R52:R53.
+        rasterline = Signal(10)
+        vden_prev = Signal(1)
+
+        sync += vden_prev.eq(vsyncgen.xden)
+        with m.If(vsyncgen.xden & ~vden_prev):
+            sync += rasterline.eq(0)
+        with m.Elif(vsyncgen.dotclken):
+            sync += rasterline.eq(rasterline + 1)
+
+        comb += [
+            regset.int_mpe.eq(mpe.idle),
+            regset.int_vsync.eq(vsyncgen.xs),
+            regset.rasterline.eq(rasterline),
+            self.irq_o.eq(regset.irq),
+        ]
+
+        # Performance counters
+
+        comb += [
+            regset.pc_vfe.eq(arb.pc_vfe),
+            regset.pc_mpe.eq(arb.pc_mpe),
+            regset.pc_stall.eq(arb.pc_stall),
+            regset.pc_idle.eq(arb.pc_idle),
+            regset.pc_ops.eq(mpe.pc_ops),
+        ]
+
         ## VFE
 
         comb += [
             vfe.atrptr.eq(shifter.atrptr),
             vfe.chrptr.eq(shifter.chrptr),
-            vfe.go_i.eq(shifter.go_prefetch),
-            vfe.ldptr.eq(shifter.go_ldptr),
             vfe.ra.eq(shifter.ra),
+            vfe.first_raster.eq(shifter.first_raster),
 
             vfe.attr_enable.eq(regset.attr_enable),
             vfe.bitmap_mode.eq(regset.bitmap_mode),
@@ -126,33 +235,101 @@ class VDC2(Elaboratable):
             arb.vfe_dat_i.eq(0),
             arb.vfe_stb_i.eq(vfe.stb_o),
             arb.vfe_we_i.eq(0),
+            arb.vfe_left_i.eq(vfe.cycles_left),
+            arb.vfe_slack_i.eq(shifter.swap_ctr),
 
             vfe.charcode.eq(Cat(stripbuf.pair[0:8], stripbuf.pair[15])),
             stripbuf.awe.eq(vfe.awe),
             stripbuf.cwe.eq(vfe.cwe),
+            stripbuf.pwe.eq(vfe.pwe),
             stripbuf.padr.eq(vfe.padr),
             stripbuf.wadr.eq(vfe.wadr),
+            stripbuf.cadr.eq(vfe.cadr),
+            stripbuf.record.eq(vfe.record),
+            stripbuf.recall.eq(vfe.recall),
+            stripbuf.lwe.eq(vfe.lwe),
             stripbuf.dat_i.eq(arb.vfe_dat_o),
         ]
 
+        # With a line buffer, the shifter kicks off the VFE to fetch whole
+        # scanlines, and its strip prefetches copy out of the line buffer.
+        # Otherwise, they kick off the VFE directly.
+        if self.line_buffer:
+            comb += [
+                vfe.go_i.eq(shifter.go_fetch),
+                vfe.ldptr.eq(shifter.fetch_ldptr),
+                shifter.fetch_started.eq(vfe.started_o),
+
+                stripbuf.lhalf.eq(shifter.lhalf),
+                stripbuf.shalf.eq(shifter.shalf),
+                stripbuf.copy.eq(shifter.go_prefetch),
+                stripbuf.copy_rst.eq(shifter.go_ldptr),
+                shifter.done_prefetch.eq(stripbuf.copy_done),
+            ]
+        else:
+            comb += [
+                vfe.go_i.eq(shifter.go_prefetch),
+                vfe.ldptr.eq(shifter.go_ldptr),
+                shifter.done_prefetch.eq(vfe.done_o),
+            ]
+
         ## MPE
 
         comb += [
             self.ready_o.eq(mpe.ready),
+            self.stale_o.eq(mpe.cpudatar_stale),
             regset.cpudatar.eq(mpe.cpudatar),
             regset.incr_updloc.eq(mpe.incr_updloc),
             regset.incr_copysrc.eq(mpe.incr_copysrc),
+            regset.decr_updloc.eq(mpe.decr_updloc),
+            regset.decr_copysrc.eq(mpe.decr_copysrc),
             regset.decr_bytecnt.eq(mpe.decr_bytecnt),
+            regset.next_row.eq(mpe.next_row),
+            regset.ld_desc.eq(mpe.ld_desc),
+            regset.desc_dst.eq(mpe.desc_dst),
+            regset.desc_src.eq(mpe.desc_src),
+            regset.desc_len.eq(mpe.desc_len),
+            regset.list_done.eq(mpe.list_done),
 
             mpe.go_wr_updloc.eq(regset.go_wr_updloc),
             mpe.go_rd_cpudatar.eq(regset.go_rd_cpudatar),
-            mpe.go_wr_cpudataw.eq(regset.go_wr_cpudataw),
             mpe.go_wr_bytecnt.eq(regset.go_wr_bytecnt),
+            mpe.go_wr_listptr.eq(regset.go_wr_listptr),
             mpe.update_location.eq(regset.update_location),
             mpe.cpudataw.eq(regset.cpudataw),
             mpe.block_copy.eq(regset.block_copy),
             mpe.copysrc.eq(regset.copysrc),
             mpe.bytecnt.eq(regset.bytecnt),
+            mpe.rows.eq(regset.rows),
+            mpe.rop.eq(regset.rop),
+            mpe.wrmask.eq(regset.wrmask),
+            mpe.descending.eq(regset.descending),
+            mpe.stride.eq(regset.stride),
+            mpe.dualplane.eq(regset.dualplane),
+            mpe.attrfill.eq(regset.attrfill),
+            mpe.chrbase.eq(regset.chrbase),
+            mpe.atrbase.eq(regset.atrbase),
+            mpe.listptr.eq(regset.listptr),
+
+            regset.cpudatar_stale.eq(mpe.cpudatar_stale),
+            regset.wq_level.eq(wq.posted),
+
+            wq.push.eq(regset.go_wr_cpudataw),
+            wq.adr_i.eq(regset.update_location),
+            wq.dat_i.eq(regset.cpudataw),
+            wq.stride_i.eq(regset.stride),
+            wq.repeat_i.eq(regset.wrrepeat),
+            wq.dual_i.eq(regset.dualplane),
+            wq.attr_i.eq(regset.attrfill),
+            wq.pop.eq(mpe.wq_pop),
+            mpe.wq_adr.eq(wq.adr_o),
+            mpe.wq_dat.eq(wq.dat_o),
+            mpe.wq_stride.eq(wq.stride_o),
+            mpe.wq_repeat.eq(wq.repeat_o),
+            mpe.wq_dual.eq(wq.dual_o),
+            mpe.wq_attr.eq(wq.attr_o),
+            mpe.wq_empty.eq(wq.empty),
+            mpe.wq_full.eq(wq.full),
 
             arb.mpe_cyc_i.eq(mpe.mem_cyc_o),
             arb.mpe_stb_i.eq(mpe.mem_stb_o),
@@ -168,6 +345,7 @@ class VDC2(Elaboratable):
 
         comb += [
             vram.adr_i.eq(arb.adr_o),
+            vram.wadr_i.eq(arb.wadr_o),
             vram.we_i.eq(arb.we_o),
             vram.dat_i.eq(arb.dat_o),
             arb.dat_i.eq(vram.dat_o),
@@ -181,6 +359,7 @@ class VDC2(Elaboratable):
             shifter.hs.eq(hsyncgen.xs),
             shifter.vs.eq(vsyncgen.xs),
             shifter.vden.eq(vsyncgen.xden),
+            shifter.vden_next.eq(vsyncgen.xden_next),
 
             shifter.hscroll.eq(regset.hscroll),
             shifter.vscroll.eq(regset.vscroll),
@@ -193,6 +372,7 @@ class VDC2(Elaboratable):
             shifter.blink_rate.eq(regset.blink_rate),
             shifter.reverse_screen.eq(regset.reverse_screen),
             shifter.bitmap_mode.eq(regset.bitmap_mode),
+            shifter.hd.eq(regset.hd),
             shifter.atrbase.eq(regset.atrbase),
             shifter.chrbase.eq(regset.chrbase),
 
@@ -204,8 +384,6 @@ class VDC2(Elaboratable):
             stripbuf.sh_padr.eq(shifter.padr),
             stripbuf.swap.eq(shifter.swap_strip),
 
-            shifter.done_prefetch.eq(vfe.done_o),
-
             #self.r.eq(stripbuf.sh_pair[3]),
             #self.g.eq(stripbuf.sh_pair[2]),
             #self.b.eq(stripbuf.sh_padr[1]),
@@ -2,10 +2,11 @@ from nmigen import (
     Cat,
     Elaboratable,
     Module,
+    Mux,
     Signal,
 )
 
-from interfaces import create_video_fetch_interface
+from interfaces import create_video_fetch_interface, strip_bits
 
 
 class VideoFetch(Elaboratable):
@@ -17,6 +18,14 @@ class VideoFetch(Elaboratable):
 
     This module doesn't actually implement the strip buffers.
 
+    Each go_i fetches one strip of strip_width (4, 8, or 16) columns.
+    Every fetch pays for the handshake with the shifter and for
+    re-acquiring the video RAM from the arbiter, so wider strips make
+    for fewer, longer, and more efficient bursts, at the cost of a
+    larger strip buffer.  The states of each phase of a fetch are
+    numbered by column from 1: a1, a2, ... for attributes, c1, c2, ...
+    for character codes, and f1, f2, ... for font bytes.
+
     Signals:
 
     # Video Timing Interface
@@ -25,9 +34,17 @@ class VideoFetch(Elaboratable):
     - chrptr.  The current character pointer.  Note that this IS NOT the same
       as the contents of the character base address in the register set.
     - go_i.  When asserted, it kicks off the next batch of read cycles.
+      It is ignored while the address generator is busy.
     - ldptr.  When asserted in conjunction with go_i, it causes the character
       and attribute pointer registers to be reloaded.  Otherwise, these
       registers will retain their current values.
+    - started_o.  Asserted when go_i has started a fetch.  A caller with
+      several strips to fetch can hold go_i until it sees started_o.
+    - done_o.  Asserted when no fetch is in progress: every address has
+      been issued, and every byte fetched has reached the strip buffer.
+      With a pipelined video RAM, the last bytes arrive well after the
+      address generator goes idle, so a strip is only safe to display
+      once done_o is asserted.
     - ra.  Row Address.  This input indicates which row of pixels is currently
       being refreshed within the character row.
     
@@ -72,20 +89,104 @@ class VideoFetch(Elaboratable):
       the stripe buffer will then drive the charcode input with the selected
       character code.  (Pair Address is named because one address selects a
       pair of bytes: the attribute and the corresponding character code.)
+    - pwe.  Asserted by VideoFetch, in wide mode only, when the video memory
+      data bus is known to have a valid character code and attribute pair.
     - wadr.  Write Address.  This output is routed to the stripe buffer,
       where it determines which character (cwe) or attribute (awe) register
       receives the data currently on the video memory data bus.
+
+    # Wide Video Memory
+    With wide set, video memory is taken to be 16 bits wide, with each
+    character code at an even address and its attribute in the byte after
+    it.  chrptr then addresses the pairs, stepping by two per column, and
+    atrptr is ignored.  Each column takes one access for the pair plus one
+    for its font byte, rather than three.  The arbiter presents font bytes
+    in the low byte lane.
+
+    # Row Cache
+    With row_cache set, the strip buffer keeps a copy of the character
+    codes and attributes of the current text row, and only the first
+    raster of each row fetches them from video memory.
+    - first_raster.  Asserted by the shifter when the current raster is the
+      first of a character row.  Sampled along with go_i.
+    - cadr.  Cache Address.  The column of the pair being recorded into or
+      recalled from the row cache.  Columns are counted from the last go_i
+      with ldptr.
+    - record.  Asserted along with awe, cwe, or pwe when the data written
+      to the strip buffer should also be recorded in the row cache.
+    - recall.  Asserted to reload the pair at cadr from the row cache into
+      the strip buffer instead of fetching it.  On rasters other than the
+      first of a text row, the character fetch cycles become recalls, which
+      take one clock each and no memory cycles, and attributes are not
+      fetched at all.  Only font bytes are read from video memory.  Bitmap
+      mode fetches every raster, as each raster has its own bitmap data.
+      Changes the host makes to a row's codes and attributes show up from
+      the first raster of the next row.
+
+    # Line Buffer
+    With line_buffer set, the strip buffer also holds a line buffer, and
+    each pair is stored there, by column (cadr), once it is complete.
+    - lwe.  Asserted along with cwe or pwe when the write completes the pair
+      at wadr: the font byte in text mode, or the bitmap byte in bitmap
+      mode.
+
+    # Overlapped Fetches
+    As the address generator issues the last address of a fetch, it takes
+    the next go_i, if any, without waiting for the data receiver to drain
+    the previous fetch's data.  The new fetch is queued for the data receiver,
+    which moves on to it as soon as it stores its last byte of the old one.
+    cyc_o stays asserted between the two, so back-to-back strips keep the
+    video RAM busy.  As acknowledgements come back in order, the data
+    receiver stores every byte in the strip it was fetched for.  A fetch
+    that loads the pointers, or recalls from the row cache, still waits
+    for the data receiver to go idle.
+
+    # Arbiter Interface
+    - cycles_left.  An upper bound on the number of clocks the current fetch
+      still needs before its last byte reaches the strip buffer, assuming it
+      is never stalled again, and that each access is acknowledged latency
+      clocks after it is accepted.  Zero when idle.  While recalling from the
+      row cache, cycles_left is nonzero even though cyc_o is negated, but
+      it is never zero while cyc_o is asserted.  It never increases while a
+      fetch is in progress, until the next fetch starts, and drops with
+      every clock the fetch is not stalled, which lets a deadline-aware
+      arbiter lend cycles to other bus masters without making the fetch
+      late.  VideoFetchDeadlineFormal proves this.
     """
 
-    def __init__(self, platform=None):
+    def __init__(self, platform=None, wide=False, latency=1, row_cache=False,
+                 line_buffer=False, strip_width=4):
         super().__init__()
-        create_video_fetch_interface(self, platform=platform)
+        self.wide = wide
+        self.latency = latency
+        self.row_cache = row_cache
+        self.line_buffer = line_buffer
+        self.strip_width = strip_width
+        create_video_fetch_interface(
+            self, platform=platform, latency=latency, strip_width=strip_width
+        )
 
     def elaborate(self, platform):
         m = Module()
         sync = m.d.sync
         comb = m.d.comb
 
+        strip_width = self.strip_width
+        col_bits = strip_bits(strip_width)
+        last = strip_width - 1
+
+        # Both FSMs step through the same states: a phase per kind of
+        # byte fetched, and a state per column within each phase.
+        a_states = ["a{}".format(i + 1) for i in range(strip_width)]
+        c_states = ["c{}".format(i + 1) for i in range(strip_width)]
+        f_states = ["f{}".format(i + 1) for i in range(strip_width)]
+
+        n_states = 1 + 3 * strip_width
+        spare_states = [
+            "state{:X}".format(i)
+            for i in range(n_states, 1 << (n_states - 1).bit_length())
+        ]
+
         # Address Generation Logic.
 
         ag_go_font = Signal(1)
@@ -95,116 +196,127 @@ class VideoFetch(Elaboratable):
         fontptr = Signal(len(self.adr_o))
         safe_to_go = Signal(1)
         ag_idle = Signal(1)
+        ag_free = Signal(1)
         dr_idle = Signal(1)
         r_bitmap_mode = Signal(1)
 
+        # Row cache state.  cached is asserted when the fetch about to be
+        # started can recall its pairs from the row cache; r_cached holds
+        # it for the fetch in progress.  strip counts the strips fetched
+        # since the pointers were last loaded, and col is the column
+        # within the strip being recalled.
+        cached = Signal(1)
+        r_cached = Signal(1)
+        strip = Signal(len(self.cadr) - col_bits)
+        next_strip = Signal(len(strip))
+        col = Signal(col_bits)
+
+        comb += next_strip.eq(Mux(self.ldptr, 0, strip + 1))
+
+        # Data receiver state.  The data receiver may still be storing one
+        # fetch while the address generator works on the next, so it keeps
+        # its own copy of the fetch's parameters.  A fetch started while
+        # the data receiver is busy waits in the queue.
+        dr_bitmap_mode = Signal(1)
+        dr_strip = Signal(len(strip))
+        queued = Signal(1)
+        q_attr = Signal(1)
+        q_bitmap_mode = Signal(1)
+        q_strip = Signal(len(strip))
+        dr_parked = Signal(1)
+
+        # Whether a fetch started now begins with the attributes.
+        start_attr = Signal(1)
+        if not self.wide:
+            comb += start_attr.eq(self.attr_enable)
+
+        if self.row_cache:
+            comb += cached.eq(~self.first_raster & ~self.bitmap_mode)
+
         atrptr_inc = Signal(len(atrptr))
         chrptr_inc = Signal(len(chrptr))
 
         comb += [
             atrptr_inc.eq(atrptr + 1),
-            chrptr_inc.eq(chrptr + 1),
-            safe_to_go.eq(ag_idle & dr_idle),
+            chrptr_inc.eq(chrptr + (2 if self.wide else 1)),
+            safe_to_go.eq(ag_free & (
+                dr_idle | (~queued & ~cached & ~self.ldptr)
+            )),
+            self.started_o.eq(self.go_i & safe_to_go),
         ]
         with m.If(self.tallfont):
             comb += fontptr.eq(Cat(self.ra[0:5], self.charcode, self.fontbase[1:3]))
         with m.Else():
             comb += fontptr.eq(Cat(self.ra[0:4], self.charcode, self.fontbase[0:3]))
 
+        def ag_start():
+            m.d.sync += [
+                r_bitmap_mode.eq(self.bitmap_mode),
+                r_cached.eq(cached),
+                strip.eq(next_strip),
+            ]
+            with m.If(self.ldptr):
+                m.d.sync += [
+                    atrptr.eq(self.atrptr),
+                    chrptr.eq(self.chrptr),
+                ]
+            if self.wide:
+                m.next = c_states[0]
+            else:
+                with m.If(self.attr_enable & ~cached):
+                    m.next = a_states[0]
+                with m.Else():
+                    m.next = c_states[0]
+
+        # Having issued the last address of a fetch, the address generator
+        # goes straight on to the next fetch, if go_i is waiting.
+        def ag_done():
+            with m.If(self.started_o):
+                ag_start()
+            with m.Else():
+                m.next = "idle"
+
         with m.FSM() as ag:
             comb += [
                 ag_idle.eq(ag.ongoing("idle")),
-                self.done_o.eq(ag_idle),
+                self.done_o.eq(ag_idle & dr_idle),
             ]
             with m.State("idle"):
-                with m.If(self.go_i & safe_to_go):
-                    sync += r_bitmap_mode.eq(self.bitmap_mode)
-                    with m.If(self.ldptr):
-                        sync += [
-                            atrptr.eq(self.atrptr),
-                            chrptr.eq(self.chrptr),
-                        ]
-                    with m.If(self.attr_enable):
-                        m.next = "a1"
-                    with m.Else():
-                        m.next = "c1"
-
-            with m.State("a1"):
-                comb += [
-                    self.adr_o.eq(atrptr),
-                    self.stb_o.eq(1),
-                ]
-                with m.If(~self.stall_i):
-                    m.next = "a2"
-                    sync += atrptr.eq(atrptr_inc)
-
-            with m.State("a2"):
-                comb += [
-                    self.adr_o.eq(atrptr),
-                    self.stb_o.eq(1),
-                ]
-                with m.If(~self.stall_i):
-                    m.next = "a3"
-                    sync += atrptr.eq(atrptr_inc)
-
-            with m.State("a3"):
-                comb += [
-                    self.adr_o.eq(atrptr),
-                    self.stb_o.eq(1),
-                ]
-                with m.If(~self.stall_i):
-                    m.next = "a4"
-                    sync += atrptr.eq(atrptr_inc)
-
-            with m.State("a4"):
-                comb += [
-                    self.adr_o.eq(atrptr),
-                    self.stb_o.eq(1),
-                ]
-                with m.If(~self.stall_i):
-                    m.next = "c1"
-                    sync += atrptr.eq(atrptr_inc)
-
-            with m.State("c1"):
-                comb += [
-                    self.adr_o.eq(chrptr),
-                    self.stb_o.eq(1),
-                ]
-                with m.If(~self.stall_i):
-                    m.next = "c2"
-                    sync += chrptr.eq(chrptr_inc)
-
-            with m.State("c2"):
-                comb += [
-                    self.adr_o.eq(chrptr),
-                    self.stb_o.eq(1),
-                ]
-                with m.If(~self.stall_i):
-                    m.next = "c3"
-                    sync += chrptr.eq(chrptr_inc)
-
-            with m.State("c3"):
-                comb += [
-                    self.adr_o.eq(chrptr),
-                    self.stb_o.eq(1),
-                ]
-                with m.If(~self.stall_i):
-                    m.next = "c4"
-                    sync += chrptr.eq(chrptr_inc)
-
-            with m.State("c4"):
-                comb += [
-                    self.adr_o.eq(chrptr),
-                    self.stb_o.eq(1),
-                ]
-                with m.If(~self.stall_i):
-                    with m.If(~r_bitmap_mode):
-                        m.next = "f1"
-                    with m.Else():
-                        m.next = "idle"
-                    sync += chrptr.eq(chrptr_inc)
-
-            with m.State("f1"):
+                with m.If(self.started_o):
+                    ag_start()
+
+            for i, state in enumerate(a_states):
+                with m.State(state):
+                    comb += [
+                        self.adr_o.eq(atrptr),
+                        self.stb_o.eq(1),
+                    ]
+                    with m.If(~self.stall_i):
+                        if i < last:
+                            m.next = a_states[i + 1]
+                        else:
+                            m.next = c_states[0]
+                        sync += atrptr.eq(atrptr_inc)
+
+            for i, state in enumerate(c_states):
+                with m.State(state):
+                    comb += [
+                        self.adr_o.eq(chrptr),
+                        self.stb_o.eq(~r_cached),
+                        self.recall.eq(r_cached),
+                        col.eq(i),
+                    ]
+                    with m.If(~self.stall_i | r_cached):
+                        if i < last:
+                            m.next = c_states[i + 1]
+                        else:
+                            with m.If(~r_bitmap_mode):
+                                m.next = f_states[0]
+                            with m.Else():
+                                ag_done()
+                        sync += chrptr.eq(chrptr_inc)
+
+            with m.State(f_states[0]):
                 comb += [
                     self.padr.eq(0),
                     self.stb_o.eq(ag_go_font),
@@ -212,66 +324,49 @@ class VideoFetch(Elaboratable):
                 ]
                 with m.If(ag_go_font):
                     with m.If(~self.stall_i):
-                        m.next = "f2"
-
-            with m.State("f2"):
-                comb += [
-                    self.padr.eq(1),
-                    self.stb_o.eq(1),
-                    self.adr_o.eq(fontptr),
-                ]
-                with m.If(~self.stall_i):
-                    m.next = "f3"
-
-            with m.State("f3"):
-                comb += [
-                    self.padr.eq(2),
-                    self.stb_o.eq(1),
-                    self.adr_o.eq(fontptr),
-                ]
-                with m.If(~self.stall_i):
-                    m.next = "f4"
-
-            with m.State("f4"):
-                comb += [
-                    self.padr.eq(3),
-                    self.stb_o.eq(1),
-                    self.adr_o.eq(fontptr),
-                ]
-                with m.If(~self.stall_i):
-                    m.next = "idle"
+                        m.next = f_states[1]
+
+            for i, state in enumerate(f_states[1:], start=1):
+                with m.State(state):
+                    comb += [
+                        self.padr.eq(i),
+                        self.stb_o.eq(1),
+                        self.adr_o.eq(fontptr),
+                    ]
+                    with m.If(~self.stall_i):
+                        if i < last:
+                            m.next = f_states[i + 1]
+                        else:
+                            ag_done()
 
-            # The set of valid states takes four bits to represent internally.
+            # The set of valid states doesn't fill the state register.
             # The remaining 'states' are here to enforce a valid state.
             # In a way, we're leaking the abstraction in order to satisfy
             # formal verification and testing.
 
-            with m.State("stateD"):
-                m.next = 'idle'
-
-            with m.State("stateE"):
-                m.next = 'idle'
-
-            with m.State("stateF"):
-                m.next = 'idle'
+            for state in spare_states:
+                with m.State(state):
+                    m.next = 'idle'
 
             if platform == 'formal':
                 comb += [
                     self.fv_ag_idle.eq(ag_idle),
-                    self.fv_ag_a1.eq(ag.ongoing("a1")),
-                    self.fv_ag_a2.eq(ag.ongoing("a2")),
-                    self.fv_ag_a3.eq(ag.ongoing("a3")),
-                    self.fv_ag_a4.eq(ag.ongoing("a4")),
-                    self.fv_ag_c1.eq(ag.ongoing("c1")),
-                    self.fv_ag_c2.eq(ag.ongoing("c2")),
-                    self.fv_ag_c3.eq(ag.ongoing("c3")),
-                    self.fv_ag_c4.eq(ag.ongoing("c4")),
-                    self.fv_ag_f1.eq(ag.ongoing("f1")),
-                    self.fv_ag_f2.eq(ag.ongoing("f2")),
-                    self.fv_ag_f3.eq(ag.ongoing("f3")),
-                    self.fv_ag_f4.eq(ag.ongoing("f4")),
                     self.fv_ag_go_font.eq(ag_go_font),
                 ]
+                for fv, states in (
+                    (self.fv_ag_a, a_states),
+                    (self.fv_ag_c, c_states),
+                    (self.fv_ag_f, f_states),
+                ):
+                    for fv_state, state in zip(fv, states):
+                        comb += fv_state.eq(ag.ongoing(state))
+
+        # The address generator is free for the next fetch when idle, or
+        # when it is issuing the last address of the current one.
+        comb += ag_free.eq(ag_idle | (~self.stall_i & (
+            ag.ongoing(f_states[last]) |
+            (ag.ongoing(c_states[last]) & r_bitmap_mode)
+        )))
 
         #
         # Data Receiver Logic
@@ -281,171 +376,204 @@ class VideoFetch(Elaboratable):
         # to match that of the address generator FSM.
         #
 
+        # A 16-bit video RAM delivers a character code and its attribute
+        # together; otherwise only the character code arrives.
+        pair_we = self.pwe if self.wide else self.cwe
+
+        # A fetch started while the data receiver is busy is queued.
+        with m.If(self.started_o & ~dr_idle):
+            sync += [
+                queued.eq(1),
+                q_attr.eq(start_attr),
+                q_bitmap_mode.eq(self.bitmap_mode),
+                q_strip.eq(next_strip),
+            ]
+
+        def dr_start(attr, bitmap_mode, strip_no):
+            m.d.sync += [
+                dr_bitmap_mode.eq(bitmap_mode),
+                dr_strip.eq(strip_no),
+            ]
+            with m.If(attr):
+                m.next = a_states[0]
+            with m.Else():
+                m.next = c_states[0]
+
+        # Having stored the last byte of a fetch, the data receiver goes
+        # straight on to the queued fetch, if there is one.
+        def dr_done():
+            with m.If(queued):
+                m.d.sync += queued.eq(0)
+                dr_start(q_attr, q_bitmap_mode, q_strip)
+            with m.Else():
+                m.next = "idle"
+
         with m.FSM() as dr:
             comb += [
-                self.cyc_o.eq(~dr.ongoing("idle")),
+                dr_parked.eq(dr.ongoing("idle")),
+                self.cyc_o.eq(~dr_parked | queued),
                 dr_idle.eq(~self.cyc_o),
             ]
             with m.State("idle"):
-                with m.If(self.go_i & safe_to_go):
-                    with m.If(self.attr_enable):
-                        m.next = "a1"
-                    with m.Else():
-                        m.next = "c1"
-
-            with m.State("a1"):
-                comb += [
-                    self.wadr.eq(0),
-                    self.awe.eq(self.ack_i),
-                    self.cwe.eq(0),
-                    ag_go_font.eq(0),
-                ]
-                with m.If(self.ack_i):
-                    m.next = "a2"
-
-            with m.State("a2"):
-                comb += [
-                    self.wadr.eq(1),
-                    self.awe.eq(self.ack_i),
-                    self.cwe.eq(0),
-                    ag_go_font.eq(0),
-                ]
-                with m.If(self.ack_i):
-                    m.next = "a3"
-
-            with m.State("a3"):
-                comb += [
-                    self.wadr.eq(2),
-                    self.awe.eq(self.ack_i),
-                    self.cwe.eq(0),
-                    ag_go_font.eq(0),
-                ]
-                with m.If(self.ack_i):
-                    m.next = "a4"
-
-            with m.State("a4"):
-                comb += [
-                    self.wadr.eq(3),
-                    self.awe.eq(self.ack_i),
-                    self.cwe.eq(0),
-                    ag_go_font.eq(0),
-                ]
-                with m.If(self.ack_i):
-                    m.next = "c1"
-
-            with m.State("c1"):
-                comb += [
-                    self.wadr.eq(0),
-                    self.awe.eq(0),
-                    self.cwe.eq(self.ack_i),
-                    ag_go_font.eq(0),
-                ]
-                with m.If(self.ack_i):
-                    m.next = "c2"
-
-            with m.State("c2"):
-                comb += [
-                    self.wadr.eq(1),
-                    self.awe.eq(0),
-                    self.cwe.eq(self.ack_i),
-                    ag_go_font.eq(0),
-                ]
-                with m.If(self.ack_i):
-                    m.next = "c3"
-
-            with m.State("c3"):
-                comb += [
-                    self.wadr.eq(2),
-                    self.awe.eq(0),
-                    self.cwe.eq(self.ack_i),
-                    ag_go_font.eq(0),
-                ]
-                with m.If(self.ack_i):
-                    m.next = "c4"
-
-            with m.State("c4"):
-                comb += [
-                    self.wadr.eq(3),
-                    self.awe.eq(0),
-                    self.cwe.eq(self.ack_i),
-                    ag_go_font.eq(0),
-                ]
-                with m.If(self.ack_i):
-                    with m.If(r_bitmap_mode):
-                        m.next = "idle"
-                    with m.Else():
-                        m.next = "f1"
-
-            with m.State("f1"):
-                comb += [
-                    self.wadr.eq(0),
-                    self.awe.eq(0),
-                    self.cwe.eq(self.ack_i),
-                    ag_go_font.eq(1),
-                ]
-                with m.If(self.ack_i):
-                    m.next = "f2"
-
-            with m.State("f2"):
-                comb += [
-                    self.wadr.eq(1),
-                    self.awe.eq(0),
-                    self.cwe.eq(self.ack_i),
-                    ag_go_font.eq(0),
-                ]
-                with m.If(self.ack_i):
-                    m.next = "f3"
-
-            with m.State("f3"):
-                comb += [
-                    self.wadr.eq(2),
-                    self.awe.eq(0),
-                    self.cwe.eq(self.ack_i),
-                    ag_go_font.eq(0),
-                ]
-                with m.If(self.ack_i):
-                    m.next = "f4"
-
-            with m.State("f4"):
-                comb += [
-                    self.wadr.eq(3),
-                    self.awe.eq(0),
-                    self.cwe.eq(self.ack_i),
-                    ag_go_font.eq(0),
-                ]
-                with m.If(self.ack_i):
-                    m.next = "idle"
-
-            # The set of valid states takes four bits to represent internally.
+                # A fetch queued as the last byte of the previous one came
+                # in is taken up here.  The address generator's first
+                # address can't be acknowledged any sooner.
+                with m.If(queued):
+                    sync += queued.eq(0)
+                    dr_start(q_attr, q_bitmap_mode, q_strip)
+                with m.Elif(self.started_o & ~cached):
+                    dr_start(start_attr, self.bitmap_mode, next_strip)
+
+                # Recalls from the row cache need no data receiver; it
+                # waits to take the font bytes.
+                with m.If(ag.ongoing(c_states[last]) & r_cached):
+                    m.next = f_states[0]
+                    sync += [
+                        dr_bitmap_mode.eq(0),
+                        dr_strip.eq(strip),
+                    ]
+
+            for i, state in enumerate(a_states):
+                with m.State(state):
+                    comb += [
+                        self.wadr.eq(i),
+                        self.awe.eq(self.ack_i),
+                        self.cwe.eq(0),
+                        ag_go_font.eq(0),
+                    ]
+                    with m.If(self.ack_i):
+                        if i < last:
+                            m.next = a_states[i + 1]
+                        else:
+                            m.next = c_states[0]
+
+            for i, state in enumerate(c_states):
+                with m.State(state):
+                    comb += [
+                        self.wadr.eq(i),
+                        self.awe.eq(0),
+                        pair_we.eq(self.ack_i),
+                        ag_go_font.eq(0),
+                    ]
+                    with m.If(self.ack_i):
+                        if i < last:
+                            m.next = c_states[i + 1]
+                        else:
+                            with m.If(dr_bitmap_mode):
+                                dr_done()
+                            with m.Else():
+                                m.next = f_states[0]
+
+            # Reaching the first font state tells the address generator the
+            # last character code is in, so it may start on the font bytes.
+            # While a fetch is queued, the address generator is working on
+            # the queued fetch, whose character codes are not yet in.
+            for i, state in enumerate(f_states):
+                with m.State(state):
+                    comb += [
+                        self.wadr.eq(i),
+                        self.awe.eq(0),
+                        self.cwe.eq(self.ack_i),
+                        ag_go_font.eq(~queued if i == 0 else 0),
+                    ]
+                    with m.If(self.ack_i):
+                        if i < last:
+                            m.next = f_states[i + 1]
+                        else:
+                            dr_done()
+
+            # The set of valid states doesn't fill the state register.
             # The remaining 'states' are here to enforce a valid state.
             # In a way, we're leaking the abstraction in order to satisfy
             # formal verification and testing.
 
-            with m.State("stateD"):
-                m.next = 'idle'
-
-            with m.State("stateE"):
-                m.next = 'idle'
-
-            with m.State("stateF"):
-                m.next = 'idle'
+            for state in spare_states:
+                with m.State(state):
+                    m.next = 'idle'
 
             if platform == 'formal':
                 comb += [
                     self.fv_dr_idle.eq(dr_idle),
-                    self.fv_dr_a1.eq(dr.ongoing('a1')),
-                    self.fv_dr_a2.eq(dr.ongoing('a2')),
-                    self.fv_dr_a3.eq(dr.ongoing('a3')),
-                    self.fv_dr_a4.eq(dr.ongoing('a4')),
-                    self.fv_dr_c1.eq(dr.ongoing('c1')),
-                    self.fv_dr_c2.eq(dr.ongoing('c2')),
-                    self.fv_dr_c3.eq(dr.ongoing('c3')),
-                    self.fv_dr_c4.eq(dr.ongoing('c4')),
-                    self.fv_dr_f1.eq(dr.ongoing('f1')),
-                    self.fv_dr_f2.eq(dr.ongoing('f2')),
-                    self.fv_dr_f3.eq(dr.ongoing('f3')),
-                    self.fv_dr_f4.eq(dr.ongoing('f4')),
+                    self.fv_dr_idle_state.eq(dr_parked),
+                    self.fv_dr_bitmap_mode.eq(dr_bitmap_mode),
+                    self.fv_queued.eq(queued),
+                    self.fv_queued_attr.eq(q_attr),
+                    self.fv_queued_bitmap_mode.eq(q_bitmap_mode),
                 ]
+                for fv, states in (
+                    (self.fv_dr_a, a_states),
+                    (self.fv_dr_c, c_states),
+                    (self.fv_dr_f, f_states),
+                ):
+                    for fv_state, state in zip(fv, states):
+                        comb += fv_state.eq(dr.ongoing(state))
+
+        def ongoing(fsm, states):
+            return Cat(*[fsm.ongoing(state) for state in states]).any()
+
+        # Row Cache
+        #
+        # Pairs are recorded as the data receiver stores them, and recalled
+        # as the address generator steps through the character states.
+        # The two never happen at once, as recalling fetches wait for the
+        # data receiver to go idle.
+
+        if self.row_cache or self.line_buffer:
+            comb += self.cadr.eq(Mux(
+                self.recall, Cat(col, strip), Cat(self.wadr, dr_strip)
+            ))
+
+        if self.row_cache:
+            comb += self.record.eq(ongoing(dr, a_states + c_states))
+
+        # Line Buffer
+        #
+        # A pair is complete once its font byte arrives, or in bitmap mode,
+        # once its bitmap byte arrives.
+
+        if self.line_buffer:
+            comb += self.lwe.eq(self.ack_i & (
+                ongoing(dr, f_states) |
+                (dr_bitmap_mode & ongoing(dr, c_states))
+            ))
+
+        # Cycles Left
+        #
+        # One clock for every address yet to be issued, latency clocks for
+        # the final acknowledgement, and latency clocks for the bubble while
+        # the font fetch waits for the data receiver to catch up with the
+        # last character code.  ack_due counts down the clocks until the
+        # most recently issued address is acknowledged.  Recalls from the
+        # row cache take a clock each as well, so the same bound holds.
+
+        latency = self.latency
+        ack_due = Signal(range(latency + 1))
+
+        with m.If(self.stb_o & ~self.stall_i):
+            sync += ack_due.eq(latency)
+        with m.Elif(ack_due != 0):
+            sync += ack_due.eq(ack_due - 1)
+
+        font_left = Signal(len(self.cycles_left))
+        comb += font_left.eq(Mux(r_bitmap_mode, 0, strip_width + latency))
+
+        for i, state in enumerate(a_states):
+            with m.If(ag.ongoing(state)):
+                comb += self.cycles_left.eq(
+                    2 * strip_width - i + latency + font_left
+                )
+        for i, state in enumerate(c_states):
+            with m.If(ag.ongoing(state)):
+                comb += self.cycles_left.eq(strip_width - i + latency + font_left)
+        with m.If(ag.ongoing(f_states[0])):
+            comb += self.cycles_left.eq(
+                strip_width + latency + Mux(ag_go_font, 0, ack_due)
+            )
+        for i, state in enumerate(f_states[1:], start=1):
+            with m.If(ag.ongoing(state)):
+                comb += self.cycles_left.eq(strip_width - i + latency)
+        with m.If(ag_idle & ~dr_idle):
+            comb += self.cycles_left.eq(Mux(ack_due != 0, ack_due, 1))
 
         if platform == 'formal':
             comb += [
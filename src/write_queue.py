@@ -0,0 +1,183 @@
+from nmigen import (
+    Array,
+    Elaboratable,
+    Module,
+    Signal,
+)
+
+from interfaces import create_write_queue_interface
+
+
+class WriteQueue(Elaboratable):
+    """
+    The WriteQueue posts host CPU writes to the CPU Data register (R31)
+    so that the host need not wait for each byte to reach video memory
+    before writing the next.  It sits between the register set, which
+    supplies the bytes and their addresses, and the MPE, which drains
+    them into video memory whenever it can get a memory cycle.
+
+    Signals:
+
+    # Register Set Interface
+    - push.  Asserted for one clock when the host writes to R31.  This is
+      the register set's go_wr_cpudataw strobe.
+    - adr_i.  The update location at the time of the write.  The register
+      set advances the update location on the same clock edge that
+      captures the data byte, so the address is sampled with push.
+    - dat_i.  The CPU Data register.  This is sampled one clock after
+      push, once the register set has latched the host's byte.
+    - stride_i, repeat_i.  The stride (R47) and repeat count (R49) in
+      effect at the time of the write, sampled with push.  Each posted
+      byte is stored with the settings it was written under, even if the
+      host changes them before the byte is drained.
+    - dual_i, attr_i.  The dual-plane bit (R43 bit 4) and attribute fill
+      byte (R48), sampled with push in the same way.
+    - level.  The number of writes stored but not yet handed to the MPE.
+    - posted.  The level, plus a write pushed but still waiting for its
+      data byte.  This is what the host sees in R38, so a write is counted
+      from the clock after it is made until the MPE takes it.
+
+    # MPE Interface
+    - adr_o, dat_o, stride_o, repeat_o, dual_o, attr_o.  The oldest posted
+      write.  Valid unless empty is set.
+    - empty.  Asserted when no writes are waiting.
+    - full.  Asserted when the queue cannot accept another write.  The host
+      must not write R31 while full is asserted; such writes are lost.
+    - pop.  Asserted by the MPE to discard the oldest posted write, once
+      the memory system has accepted it.
+    """
+
+    def __init__(self, platform=None, depth=4, abus_width=14):
+        super().__init__()
+        self.depth = depth
+        create_write_queue_interface(
+            self, platform=platform, depth=depth, abus_width=abus_width
+        )
+
+    def elaborate(self, platform):
+        m = Module()
+        sync = m.d.sync
+        comb = m.d.comb
+
+        slot_adr = Array(
+            Signal(len(self.adr_o), name="slot_adr{}".format(i))
+            for i in range(self.depth)
+        )
+        slot_dat = Array(
+            Signal(len(self.dat_o), name="slot_dat{}".format(i))
+            for i in range(self.depth)
+        )
+        slot_stride = Array(
+            Signal(len(self.stride_o), name="slot_stride{}".format(i))
+            for i in range(self.depth)
+        )
+        slot_repeat = Array(
+            Signal(len(self.repeat_o), name="slot_repeat{}".format(i))
+            for i in range(self.depth)
+        )
+        slot_dual = Array(
+            Signal(1, name="slot_dual{}".format(i))
+            for i in range(self.depth)
+        )
+        slot_attr = Array(
+            Signal(len(self.attr_o), name="slot_attr{}".format(i))
+            for i in range(self.depth)
+        )
+
+        rdptr = Signal(range(self.depth))
+        wrptr = Signal(range(self.depth))
+        rdptr_inc = Signal(len(rdptr))
+        wrptr_inc = Signal(len(wrptr))
+
+        # Wrap the pointers explicitly, as depth need not be a power of two.
+        with m.If(rdptr == self.depth - 1):
+            comb += rdptr_inc.eq(0)
+        with m.Else():
+            comb += rdptr_inc.eq(rdptr + 1)
+
+        with m.If(wrptr == self.depth - 1):
+            comb += wrptr_inc.eq(0)
+        with m.Else():
+            comb += wrptr_inc.eq(wrptr + 1)
+
+        # The address accompanies the push strobe, but the data byte lands
+        # in the register set a clock later.  Hold the address and the
+        # settings it was written under until then.
+        pending = Signal(1)
+        pending_adr = Signal(len(self.adr_o))
+        pending_stride = Signal(len(self.stride_o))
+        pending_repeat = Signal(len(self.repeat_o))
+        pending_dual = Signal(1)
+        pending_attr = Signal(len(self.attr_o))
+
+        sync += pending.eq(self.push & ~self.full)
+        with m.If(self.push):
+            sync += [
+                pending_adr.eq(self.adr_i),
+                pending_stride.eq(self.stride_i),
+                pending_repeat.eq(self.repeat_i),
+                pending_dual.eq(self.dual_i),
+                pending_attr.eq(self.attr_i),
+            ]
+
+        do_push = Signal(1)
+        do_pop = Signal(1)
+
+        comb += [
+            do_push.eq(pending),
+            do_pop.eq(self.pop & ~self.empty),
+
+            self.empty.eq((self.level == 0) & ~pending),
+            self.full.eq((self.level + pending) >= self.depth),
+            self.posted.eq(self.level + pending),
+        ]
+
+        # A write arriving at an empty queue is offered to the MPE straight
+        # away, while it is still being stored.  Popping it then simply
+        # moves the read pointer past the slot as it is filled.
+        with m.If(self.level == 0):
+            comb += [
+                self.adr_o.eq(pending_adr),
+                self.dat_o.eq(self.dat_i),
+                self.stride_o.eq(pending_stride),
+                self.repeat_o.eq(pending_repeat),
+                self.dual_o.eq(pending_dual),
+                self.attr_o.eq(pending_attr),
+            ]
+        with m.Else():
+            comb += [
+                self.adr_o.eq(slot_adr[rdptr]),
+                self.dat_o.eq(slot_dat[rdptr]),
+                self.stride_o.eq(slot_stride[rdptr]),
+                self.repeat_o.eq(slot_repeat[rdptr]),
+                self.dual_o.eq(slot_dual[rdptr]),
+                self.attr_o.eq(slot_attr[rdptr]),
+            ]
+
+        with m.If(do_push):
+            sync += [
+                slot_adr[wrptr].eq(pending_adr),
+                slot_dat[wrptr].eq(self.dat_i),
+                slot_stride[wrptr].eq(pending_stride),
+                slot_repeat[wrptr].eq(pending_repeat),
+                slot_dual[wrptr].eq(pending_dual),
+                slot_attr[wrptr].eq(pending_attr),
+                wrptr.eq(wrptr_inc),
+            ]
+
+        with m.If(do_pop):
+            sync += rdptr.eq(rdptr_inc)
+
+        with m.If(do_push & ~do_pop):
+            sync += self.level.eq(self.level + 1)
+        with m.Elif(~do_push & do_pop):
+            sync += self.level.eq(self.level - 1)
+
+        if platform == 'formal':
+            comb += [
+                self.fv_pending.eq(pending),
+                self.fv_rdptr.eq(rdptr),
+                self.fv_wrptr.eq(wrptr),
+            ]
+
+        return m